@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+"""aoidwell computes the dwell time on every area of interest (AOI), i.e.
+every word or object of the stimuli, from all gaze samples of a session.
+
+It uses the label rasters that "mkobtzep --rasters" writes next to the obt
+files: a uint16 array of the size of the stimulus image that holds the
+number of the object under every pixel, or 0 where there's none. Mapping
+the samples to objects is then a single array lookup. The rasters are
+memory mapped and the .asc file is streamed in chunks, hence memory use
+doesn't depend on the length of the session.
+
+Like readmeasures, the stimulus image is assumed to be centered on the
+screen. Samples of a trial outside the image or on no object are counted
+as AOI 0. Samples between the trials, of trials without a raster and
+missing samples aren't counted.
+"""
+
+import os
+import os.path
+import sys
+import csv
+
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+import ascreader
+import readmeasures
+import trialindex
+
+_PROGRAM_NAME = "aoidwell"
+_DESCRIPTION = """aoidwell computes the dwell time and number of samples per
+trial and area of interest of Eyelink .asc files. It's run from the data
+directory of a zep experiment after "mkobtzep --rasters"."""
+
+# See mkobtzep.RASTER
+RASTER = ".labels.npy"
+
+
+class RasterLibrary(readmeasures.ObtLibrary):
+    """Loads the label rasters of an experiment on demand"""
+
+    def __init__(self, expdir: str):
+        super().__init__(expdir)
+        self.rasters: Dict[str, Optional[np.ndarray]] = {}
+        self.nlabels: Dict[str, int] = {}
+
+    def raster(self, plafile: str) -> Optional[np.ndarray]:
+        """Returns the memory mapped label raster of plafile or None when
+        it has none.
+        """
+        name = os.path.splitext(os.path.basename(plafile))[0]
+        if name not in self.rasters:
+            fn = os.path.join(self.obtdir, name + RASTER)
+            raster = np.load(fn, mmap_mode="r") if os.path.exists(fn) else None
+            self.rasters[name] = raster
+            self.nlabels[name] = int(raster.max()) + 1 if raster is not None else 0
+        return self.rasters[name]
+
+    def labels(self, plafile: str) -> int:
+        """Returns the number of labels of the raster of plafile, including
+        label 0.
+        """
+        self.raster(plafile)
+        return self.nlabels[os.path.splitext(os.path.basename(plafile))[0]]
+
+    def image_size(self, plafile: str) -> Optional[Tuple[int, int]]:
+        """Returns the size of the image of plafile from its raster"""
+        raster = self.raster(plafile)
+        if raster is not None:
+            return raster.shape[1], raster.shape[0]
+        return super().image_size(plafile)
+
+
+def lookup(raster: np.ndarray, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """Returns the label under every point, 0 for points outside the
+    raster and for missing points.
+    """
+    height, width = raster.shape
+    inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+    labels = np.zeros(len(x), np.uint16)
+    labels[inside] = raster[y[inside].astype(np.intp), x[inside].astype(np.intp)]
+    return labels
+
+
+class TrialDwell(NamedTuple):
+    """The number of samples per AOI of one trial, index 0 counts the
+    samples on no AOI.
+    """
+
+    trial: trialindex.Trial
+    counts: np.ndarray
+
+
+def process_file(
+    fn: str,
+    library: RasterLibrary,
+    offset: Optional[Tuple[float, float]] = None,
+    chunk_size: int = ascreader.CHUNK_SIZE,
+) -> Tuple[List[TrialDwell], float]:
+    """Counts the samples per trial and AOI of the .asc file fn
+
+    @offset the position of the stimuli on screen, by default they are
+            assumed to be centered.
+    @return the counts of the trials with a raster and the sample interval
+            in ms.
+    """
+    trials = [t for t in trialindex.load(fn) if t.plafile]
+    begins = np.array([t.begin_time for t in trials])
+    ends = np.array([t.end_time for t in trials])
+    ends[np.isnan(ends)] = np.inf
+    counts: List[Optional[np.ndarray]] = [None] * len(trials)
+    screen = None
+    interval = float("nan")
+
+    for chunk in ascreader.iter_chunks(fn, chunk_size):
+        if screen is None:
+            screen = readmeasures.screen_size(chunk.messages)
+        samples = chunk.samples
+        if not len(samples):
+            continue
+        if np.isnan(interval) and len(samples) > 1:
+            interval = float(np.median(np.diff(samples["time"])))
+        t = samples["time"]
+        # The samples are sorted by time, so every trial is a slice
+        low = np.searchsorted(t, begins)
+        high = np.searchsorted(t, ends, side="right")
+        for i in np.flatnonzero(high > low):
+            raster = library.raster(trials[i].plafile)
+            if raster is None:
+                continue
+            part = samples[low[i] : high[i]]
+            part = part[~(np.isnan(part["x"]) | np.isnan(part["y"]))]
+            dx, dy = offset or library.offset(trials[i].plafile, screen)
+            labels = lookup(raster, part["x"] - dx, part["y"] - dy)
+            found = np.bincount(labels, minlength=library.labels(trials[i].plafile))
+            if counts[i] is None:
+                counts[i] = found
+            else:
+                counts[i] += found
+    return (
+        [TrialDwell(t, c) for t, c in zip(trials, counts) if c is not None],
+        interval,
+    )
+
+
+def write_csv(
+    out,
+    fn: str,
+    results: List[TrialDwell],
+    interval: float,
+    library: RasterLibrary,
+    header: bool = True,
+):
+    """Writes the dwell times of results as csv rows to out"""
+    writer = csv.writer(out, lineterminator="\n")
+    if header:
+        writer.writerow(
+            ["file", "trial", "item", "condition", "plafile", "aoi", "word"]
+            + ["samples", "dwell"]
+        )
+    for result in results:
+        trial = result.trial
+        stimulus = library.get(trial.plafile)
+        words = {}
+        if stimulus is not None:
+            words = dict(zip(stimulus.words["number"], stimulus.words["word"]))
+        for aoi, count in enumerate(result.counts):
+            if aoi and aoi not in words and not count:
+                continue
+            writer.writerow(
+                [
+                    os.path.basename(fn),
+                    trial.trial,
+                    trial.item,
+                    trial.condition,
+                    trial.plafile,
+                    aoi,
+                    words.get(aoi, ""),
+                    count,
+                    "{:g}".format(count * interval),
+                ]
+            )
+
+
+if __name__ == "__main__":
+    import argparse as ap
+    import ascfile
+
+    parser = ap.ArgumentParser(_PROGRAM_NAME, description=_DESCRIPTION)
+    parser.add_argument("expname", help="The name of the experiment")
+    parser.add_argument("input_files", nargs="+", help="The input .asc file's")
+    parser.add_argument(
+        "-o", "--output", help="The output csv file, by default standard output"
+    )
+    parser.add_argument(
+        "--offset",
+        type=float,
+        nargs=2,
+        metavar=("X", "Y"),
+        help="The position of the top left of the stimuli on screen, by "
+        "default they are centered.",
+    )
+    args = parser.parse_args()
+
+    library = RasterLibrary(os.path.join(".", args.expname))
+    if not os.path.isdir(library.obtdir):
+        print(
+            'The folder "{}" doesn\'t exist or is not a folder'.format(
+                library.obtdir
+            ),
+            file=sys.stderr,
+        )
+        exit(1)
+
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    with out:
+        header = True
+        for fn in args.input_files:
+            if not os.path.exists(fn):
+                print('Skipping "{}" (it doesn\'t exist).'.format(fn), file=sys.stderr)
+                continue
+            try:
+                results, interval = process_file(fn, library, args.offset)
+            except ascfile.READ_ERRORS as error:
+                print('Skipping "{}" ({}).'.format(fn, error), file=sys.stderr)
+                continue
+            write_csv(out, fn, results, interval, library, header)
+            header = False
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+"""ascfile opens plain and compressed Eyelink .asc files alike.
+
+An .asc file is mostly digits and compresses well, so it may be stored
+as "name.asc.gz" (gzip, always available) or "name.asc.zst" (Zstandard,
+requires the optional zstandard package). open_asc() returns a file
+object that (de)compresses on the fly, so readers stream the contents of
+a compressed file just like those of a plain file and never need to
+unpack it on disk.
+"""
+
+import gzip
+import zlib
+import importlib.util
+import os
+import os.path
+import shutil
+import threading
+
+from typing import List, Optional
+
+_PROGRAM_NAME = "ascfile"
+_DESCRIPTION = """ascfile compresses or decompresses Eyelink .asc files."""
+
+ASC = ".asc"
+
+# The compressions by their name and the suffix they add to ".asc"
+COMPRESSIONS = {"gz": ".gz", "zst": ".zst"}
+SUFFIXES = (ASC,) + tuple(ASC + suffix for suffix in COMPRESSIONS.values())
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# The number of bytes copied at once by compress()
+_COPY_SIZE = 1 << 20
+
+
+class UnsupportedCompression(Exception):
+    """Raised when the module needed for a compression isn't installed"""
+
+
+# The errors that reading an .asc file may raise besides those of its
+# contents: a truncated .gz raises EOFError, a damaged one zlib.error and a
+# .zst file without zstandard UnsupportedCompression.
+READ_ERRORS = (OSError, EOFError, zlib.error, UnsupportedCompression)
+
+
+def is_asc(fn: str) -> bool:
+    """Returns whether fn is the name of a plain or compressed .asc file"""
+    return fn.endswith(SUFFIXES)
+
+
+def compression(fn: str) -> Optional[str]:
+    """Returns the name of the compression of fn or None"""
+    for name, suffix in COMPRESSIONS.items():
+        if fn.endswith(suffix):
+            return name
+    return None
+
+
+def plain_name(fn: str) -> str:
+    """Returns fn without its compression suffix"""
+    name = compression(fn)
+    return fn[: -len(COMPRESSIONS[name])] if name else fn
+
+
+def compressed_name(fn: str, name: Optional[str]) -> str:
+    """Returns the name of the .asc file fn when compressed with name,
+    None means uncompressed.
+    """
+    return plain_name(fn) + (COMPRESSIONS[name] if name else "")
+
+
+def variants(fn: str) -> List[str]:
+    """Returns the names of the plain and all compressed forms of fn"""
+    base = plain_name(fn)
+    return [base] + [base + suffix for suffix in COMPRESSIONS.values()]
+
+
+def temp_name(fn: str) -> str:
+    """Returns a name for a temporary file next to fn with the same
+    compression as fn, unique to the calling process and thread.
+    """
+    base = plain_name(fn)
+    dirname, basename = os.path.split(base)
+    suffix = ASC + fn[len(base) :]
+    return os.path.join(
+        dirname,
+        ".{}.{}.{}.tmp{}".format(basename, os.getpid(), threading.get_ident(), suffix),
+    )
+
+
+def available(name: Optional[str]) -> bool:
+    """Returns whether the compression name can be used"""
+    return name != "zst" or importlib.util.find_spec("zstandard") is not None
+
+
+def _zstandard():
+    """Imports the optional zstandard module"""
+    try:
+        import zstandard
+    except ImportError as error:
+        raise UnsupportedCompression(
+            "reading or writing .zst files requires the zstandard package"
+        ) from error
+    return zstandard
+
+
+def open_asc(
+    fn: str,
+    mode: str = "rb",
+    encoding: Optional[str] = None,
+    errors: Optional[str] = None,
+    newline: Optional[str] = None,
+):
+    """Opens the plain or compressed file fn
+
+    @mode "rb", "wb", "r" or "w", the latter two open fn in text mode,
+          also when it's compressed.
+    @encoding, errors, newline are used in text mode as with open()
+
+    Raises UnsupportedCompression for a .zst file when zstandard isn't
+    installed.
+    """
+    name = compression(fn)
+    if name is None:
+        return open(fn, mode, encoding=encoding, errors=errors, newline=newline)
+
+    if "b" not in mode and "t" not in mode:
+        mode += "t"
+    text = {}
+    if "t" in mode:
+        text = {"encoding": encoding, "errors": errors, "newline": newline}
+    writing = "w" in mode
+    if name == "gz":
+        return gzip.open(fn, mode, compresslevel=GZIP_LEVEL, **text)
+    zstandard = _zstandard()
+    cctx = zstandard.ZstdCompressor(level=ZSTD_LEVEL) if writing else None
+    return zstandard.open(fn, mode, cctx=cctx, **text)
+
+
+def compress(src: str, dst: str):
+    """Writes the contents of the file src to dst, (de)compressed according
+    to the names of both.
+    """
+    with open_asc(src, "rb") as fin, open_asc(dst, "wb") as fout:
+        shutil.copyfileobj(fin, fout, _COPY_SIZE)
+
+
+if __name__ == "__main__":
+    import sys
+    import argparse as ap
+
+    parser = ap.ArgumentParser(_PROGRAM_NAME, description=_DESCRIPTION)
+    parser.add_argument(
+        "input_files", nargs="+", help="The input .asc, .asc.gz or .asc.zst file's"
+    )
+    parser.add_argument(
+        "-c",
+        "--compress",
+        choices=sorted(COMPRESSIONS),
+        help="The compression of the output, by default the output is a "
+        "plain .asc file.",
+    )
+    parser.add_argument(
+        "-k",
+        "--keep",
+        action="store_true",
+        help="Keep the input file instead of removing it.",
+    )
+    args = parser.parse_args()
+
+    failures = 0
+    for fn in args.input_files:
+        if not (is_asc(fn) and os.path.exists(fn)):
+            print('Skipping "{}" (not an asc file).'.format(fn), file=sys.stderr)
+            continue
+        out = compressed_name(fn, args.compress)
+        if out == fn:
+            continue
+        tempname = temp_name(out)
+        try:
+            compress(fn, tempname)
+            os.replace(tempname, out)
+        except READ_ERRORS as error:
+            failures += 1
+            print('Unable to write "{}": {}'.format(out, error), file=sys.stderr)
+            if os.path.exists(tempname):
+                os.unlink(tempname)
+            continue
+        if not args.keep:
+            os.unlink(fn)
+        print('writing "{}" to "{}".'.format(fn, out))
+    exit(1 if failures else 0)
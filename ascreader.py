@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+
+"""ascreader reads the samples and events of Eyelink .asc files into NumPy
+structured arrays.
+
+The file is read in chunks of a fixed size, so memory stays bounded for
+recordings of any length when iter_chunks() is used. The sample and event
+lines of a chunk are parsed with array operations over the whole chunk,
+only the (relatively few) message lines are parsed line by line.
+"""
+
+import os.path
+
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+import ascfile
+
+_PROGRAM_NAME = "ascreader"
+_DESCRIPTION = """ascreader summarizes the samples and events found in
+Eyelink .asc files."""
+
+# The number of bytes that is read and parsed at once
+CHUNK_SIZE = 1 << 22
+
+SAMPLE_DTYPE = np.dtype(
+    [("time", "f8"), ("x", "f4"), ("y", "f4"), ("pupil", "f4"), ("flags", "u2")]
+)
+FIXATION_DTYPE = np.dtype(
+    [
+        ("eye", "S1"),
+        ("start", "f8"),
+        ("end", "f8"),
+        ("duration", "f8"),
+        ("x", "f4"),
+        ("y", "f4"),
+        ("pupil", "f4"),
+    ]
+)
+SACCADE_DTYPE = np.dtype(
+    [
+        ("eye", "S1"),
+        ("start", "f8"),
+        ("end", "f8"),
+        ("duration", "f8"),
+        ("x_start", "f4"),
+        ("y_start", "f4"),
+        ("x_end", "f4"),
+        ("y_end", "f4"),
+        ("amplitude", "f4"),
+        ("peak_velocity", "f4"),
+    ]
+)
+BLINK_DTYPE = np.dtype(
+    [("eye", "S1"), ("start", "f8"), ("end", "f8"), ("duration", "f8")]
+)
+MESSAGE_DTYPE = np.dtype([("time", "f8"), ("text", "O")])
+
+# The event lines and the structured array they are stored in
+EVENT_DTYPES = {
+    b"EFIX": FIXATION_DTYPE,
+    b"ESACC": SACCADE_DTYPE,
+    b"EBLINK": BLINK_DTYPE,
+}
+
+_TAB = ord("\t")
+_NEWLINE = ord("\n")
+_CR = ord("\r")
+_SPACE = ord(" ")
+_DOT = ord(".")
+_MINUS = ord("-")
+_ZERO = ord("0")
+_NINE = ord("9")
+# Which bytes may occur in the status field of a sample line
+_STATUS_CHARS = np.zeros(256, bool)
+_STATUS_CHARS[np.frombuffer(b".ICR", np.uint8)] = True
+
+
+class Recording(NamedTuple):
+    """The samples and events of (a chunk of) an .asc file"""
+
+    samples: np.ndarray
+    fixations: np.ndarray
+    saccades: np.ndarray
+    blinks: np.ndarray
+    messages: np.ndarray
+
+
+class SampleLayout:
+    """The columns of the sample lines as announced by a SAMPLES line, e.g.
+
+        SAMPLES GAZE LEFT RIGHT VEL RATE 500.00 TRACKING CR FILTER 2
+
+    The sample lines start with the time followed by x, y and pupil of
+    each eye, then optionally the velocity and resolution columns, followed
+    by a status field with a character per flag.
+    """
+
+    def __init__(self, line: bytes = b"SAMPLES GAZE RIGHT"):
+        words = line.split()
+        self.eyes = [w[:1] for w in words if w in (b"LEFT", b"RIGHT")] or [b"R"]
+        neyes = len(self.eyes)
+        self.ncols = 1 + 3 * neyes
+        if b"VEL" in words:
+            self.ncols += 2 * neyes
+        if b"RES" in words:
+            self.ncols += 2
+        self.status_width = 3 if neyes == 1 else 5
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, SampleLayout) and vars(self) == vars(other)
+
+    def offset(self, eye: Optional[bytes]) -> int:
+        """Returns the column of x of eye, by default the first eye"""
+        if eye is None or eye[:1] not in self.eyes:
+            return 1
+        return 1 + 3 * self.eyes.index(eye[:1])
+
+
+def _float(token: bytes) -> float:
+    """Converts a value of an event line, missing data "." becomes NaN"""
+    return float("nan") if token == b"." else float(token)
+
+
+def _floats(arr: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Converts the numbers in the byte ranges arr[starts[i]:ends[i] + 1] to
+    floats at once, the byte at ends[i] must be whitespace. A missing value,
+    a lone ".", becomes NaN.
+    """
+    # Gather the ranges, every value is followed by whitespace.
+    lengths = ends - starts + 1
+    offsets = np.cumsum(lengths) - lengths
+    index = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+    buf = arr[index]
+
+    # A missing value is parsed as 0 and set to NaN after conversion, which
+    # requires the index of its value.
+    blank = (buf == _SPACE) | (buf == _TAB) | (buf == _NEWLINE) | (buf == _CR)
+    dots = np.flatnonzero(buf == _DOT)
+    missing = dots[blank[dots - 1] & blank[dots + 1]]
+    if len(missing):
+        tokenstarts = np.empty(len(buf), bool)
+        tokenstarts[0] = not blank[0]
+        tokenstarts[1:] = ~blank[1:] & blank[:-1]
+        valueindex = np.cumsum(tokenstarts)[missing] - 1
+        buf[missing] = _ZERO
+
+    values = np.fromstring(buf.tobytes(), sep=" ")
+    if len(missing):
+        values[valueindex] = np.nan
+    return values
+
+
+def _bits(mask: np.ndarray) -> np.ndarray:
+    """Returns an integer per row of the (rows, 8) or (rows, 16) mask with
+    bit j set if column j is.
+    """
+    dtype = "u1" if mask.shape[1] == 8 else "<u2"
+    return np.packbits(mask.ravel(), bitorder="little").view(dtype)
+
+
+def _fixed_width(field: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Converts a column of right aligned numbers, field is a (lines, width)
+    array with the bytes of the column in each line.
+
+    The digits of a line are accumulated column by column, which requires
+    that the decimal point of every line is in the same column. Returns the
+    values and which lines were converted, the other lines have to be
+    converted otherwise. A missing value "." becomes NaN.
+    """
+    nlines, width = field.shape
+    values = np.full(nlines, np.nan)
+    if width > 15:
+        return values, np.zeros(nlines, bool)
+    digits = field - np.uint8(_ZERO)
+    isdigit = digits < 10
+    digits *= isdigit
+
+    # The class of each byte as bits of an integer per line, which requires
+    # padding the lines with blanks to 8 or 16 bytes.
+    size = 8 if width <= 8 else 16
+    padded = np.full((nlines, size), _SPACE, np.uint8)
+    padded[:, size - width :] = field
+    digitbits = _bits(padded - np.uint8(_ZERO) < 10)
+    hasdigits = digitbits != 0
+    if not hasdigits.any():
+        return values, np.zeros(nlines, bool)
+    blankbits = _bits(padded == _SPACE)
+    dotbits = _bits(padded == _DOT)
+    minusbits = _bits(padded == _MINUS)
+
+    # Blanks followed by an optional minus sign and the number
+    ok = (digitbits | blankbits | dotbits | minusbits) == (1 << size) - 1
+    ok &= (blankbits & (blankbits + 1)) == 0
+    ok &= (minusbits == 0) | (minusbits == blankbits + 1)
+    # At most one dot, without digits only a lone "." is valid.
+    ok &= (dotbits & (dotbits - 1)) == 0
+    ok &= hasdigits | ((dotbits != 0) & (minusbits == 0))
+
+    # The decimal point has to be in the most common column.
+    common = int(np.argmax(np.bincount(dotbits[hasdigits])))
+    ok &= ~hasdigits | (dotbits == common)
+    point = common.bit_length() - 1
+    if point >= 0:
+        point -= size - width
+    mantissas = np.zeros(nlines)
+    for j in range(width):
+        if j != point:
+            mantissas *= 10
+            mantissas += digits[:, j]
+    decimals = width - 1 - point if point >= 0 else 0
+    values[hasdigits] = mantissas[hasdigits] / 10.0**decimals
+    negative = minusbits != 0
+    values[negative] = -values[negative]
+    return values, ok
+
+
+def _parse_samples(
+    arr: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    layout: SampleLayout,
+    eye: Optional[bytes],
+) -> np.ndarray:
+    """Parses the sample lines arr[starts[i]:ends[i]] of a chunk.
+
+    Edf2asc writes the columns of the sample lines with a fixed width, the
+    lines with the most common length are converted column by column with
+    _fixed_width. All bytes outside of the numeric columns of the other
+    lines are blanked, after which the remainder is converted to floats at
+    once. Lines with fewer columns than the layout announces are skipped.
+    """
+    ncols = layout.ncols
+    column = layout.offset(eye)
+    columns = [0, column, column + 1, column + 2]
+    values = np.empty((len(starts), len(columns)))
+    colsend = np.empty(len(starts), np.int64)
+    done = np.zeros(len(starts), bool)
+
+    lengths = ends - starts
+    same = np.flatnonzero(lengths == np.argmax(np.bincount(lengths)))
+    first = arr[starts[same[0]] : ends[same[0]]]
+    tabs = np.flatnonzero(first == _TAB)[:ncols]
+    if len(tabs) >= ncols - 1:
+        # The numeric columns end at the next tab or at the end of the line.
+        bounds = np.append(tabs, len(first))
+        windows = np.lib.stride_tricks.sliding_window_view(arr, bounds[ncols - 1])
+        lines = windows[starts[same]]
+        ok = (lines[:, tabs[: ncols - 1]] == _TAB).all(axis=1)
+        if len(tabs) == ncols:
+            ok &= arr[starts[same] + tabs[-1]] == _TAB
+        for i, k in enumerate(columns):
+            low = bounds[k - 1] + 1 if k else 0
+            values[same, i], converted = _fixed_width(lines[:, low : bounds[k]])
+            ok &= converted
+        colsend[same] = starts[same] + bounds[ncols - 1]
+        done[same[ok]] = True
+
+    keep = done.copy()
+    rest = np.flatnonzero(~done)
+    if len(rest):
+        low, high = starts[rest[0]], ends[rest[-1]] + 1
+        tabs = np.flatnonzero(arr[low:high] == _TAB) + low
+        first = np.searchsorted(tabs, starts[rest])
+        ntabs = np.searchsorted(tabs, ends[rest]) - first
+        ok = ntabs >= ncols - 1
+        rest, first, ntabs = rest[ok], first[ok], ntabs[ok]
+    if len(rest):
+        colsend[rest] = ends[rest]
+        more = ntabs >= ncols
+        colsend[rest[more]] = tabs[first[more] + ncols - 1]
+        converted = _floats(arr, starts[rest], colsend[rest])
+        values[rest] = converted.reshape(len(rest), ncols)[:, columns]
+        keep[rest] = True
+
+    starts, ends, colsend = starts[keep], ends[keep], colsend[keep]
+    samples = np.zeros(len(starts), SAMPLE_DTYPE)
+    if not len(starts):
+        return samples
+    values = values[keep]
+    samples["time"] = values[:, 0]
+    samples["x"] = values[:, 1]
+    samples["y"] = values[:, 2]
+    samples["pupil"] = values[:, 3]
+
+    # Bit k of flags is set when character k of the status field isn't "."
+    status = colsend + 1
+    valid = np.ones(len(starts), bool)
+    flags = np.zeros(len(starts), np.uint16)
+    for k in range(layout.status_width):
+        inline = status + k < ends
+        chars = np.where(inline, arr[np.minimum(status + k, len(arr) - 1)], _DOT)
+        valid &= _STATUS_CHARS[chars]
+        flags |= (chars != _DOT).astype(np.uint16) << k
+    samples["flags"] = np.where(valid, flags, 0)
+    return samples
+
+
+def _starting(
+    arr: np.ndarray, starts: np.ndarray, ends: np.ndarray, word: bytes
+) -> np.ndarray:
+    """Returns which of the lines arr[starts[i]:ends[i]] start with word
+    followed by whitespace.
+    """
+    match = ends - starts > len(word)
+    for k, char in enumerate(word):
+        match &= arr[np.where(match, starts + k, 0)] == char
+    after = arr[np.where(match, starts + len(word), 0)]
+    return match & ((after == _SPACE) | (after == _TAB))
+
+
+class _ChunkParser:
+    """Parses the chunks of one file, it keeps track of the sample layout
+    that is in effect at the end of the previous chunk.
+    """
+
+    def __init__(self, eye: Optional[bytes] = None):
+        self.eye = eye
+        self.layout = SampleLayout()
+
+    def parse(self, chunk: bytes) -> Recording:
+        """Parses the complete lines in chunk"""
+        arr = np.frombuffer(chunk, np.uint8)
+        newlines = np.flatnonzero(arr == _NEWLINE)
+        starts = np.empty(len(newlines), np.int64)
+        starts[:1] = 0
+        starts[1:] = newlines[:-1] + 1
+        ends = newlines - (arr[newlines - 1] == _CR)
+        firsts = arr[np.minimum(starts, len(arr) - 1)]
+        is_sample = (firsts >= _ZERO) & (firsts <= _NINE) & (ends > starts)
+        other = np.flatnonzero(~is_sample & (ends > starts))
+
+        def lines(word):
+            return other[_starting(arr, starts[other], ends[other], word)]
+
+        events = {}
+        for word in EVENT_DTYPES:
+            index = lines(word)
+            events[word] = self._events(chunk, arr, starts[index], ends[index], word)
+        messages = [self._message(chunk[starts[i] : ends[i]]) for i in lines(b"MSG")]
+        sample_parts = []
+        # The sample lines in between two SAMPLES lines share a layout, which
+        # usually is the same for all recording blocks.
+        group_start = 0
+        for index in lines(b"SAMPLES"):
+            layout = SampleLayout(chunk[starts[index] : ends[index]])
+            if layout == self.layout:
+                continue
+            sample_parts.append(
+                self._samples(arr, starts, ends, is_sample, group_start, index)
+            )
+            group_start = index
+            self.layout = layout
+        sample_parts.append(
+            self._samples(arr, starts, ends, is_sample, group_start, len(starts))
+        )
+
+        return Recording(
+            np.concatenate(sample_parts),
+            events[b"EFIX"],
+            events[b"ESACC"],
+            events[b"EBLINK"],
+            np.array(messages, MESSAGE_DTYPE),
+        )
+
+    def _samples(self, arr, starts, ends, is_sample, begin, end):
+        """Parses the sample lines from line begin up to line end"""
+        mask = is_sample[begin:end]
+        starts = starts[begin:end][mask]
+        ends = ends[begin:end][mask]
+        if not len(starts):
+            return np.zeros(0, SAMPLE_DTYPE)
+        return _parse_samples(arr, starts, ends, self.layout, self.eye)
+
+    @classmethod
+    def _events(cls, chunk, arr, starts, ends, word):
+        """Parses the EFIX, ESACC or EBLINK lines arr[starts[i]:ends[i]].
+
+        The eye follows the word after a single space, the values after it
+        are converted at once. When that yields an unexpected number of
+        values the lines are parsed one by one.
+        """
+        dtype = EVENT_DTYPES[word]
+        nfields = len(dtype)
+        if not len(starts):
+            return np.zeros(0, dtype)
+        eyes = arr[starts + len(word) + 1]
+        if ((eyes == ord("L")) | (eyes == ord("R"))).all():
+            values = _floats(arr, starts + len(word) + 2, ends)
+            if len(values) == len(starts) * (nfields - 1):
+                events = np.zeros(len(starts), dtype)
+                events["eye"] = eyes.view("S1")
+                values = values.reshape(len(starts), nfields - 1)
+                for i, name in enumerate(dtype.names[1:]):
+                    events[name] = values[:, i]
+                return events
+        lines = (chunk[start:end] for start, end in zip(starts, ends))
+        return np.array([cls._event(line, nfields) for line in lines], dtype)
+
+    @staticmethod
+    def _event(line: bytes, nfields: int) -> tuple:
+        """Parses the first nfields of an EFIX, ESACC or EBLINK line"""
+        fields = line.split()[1 : nfields + 1]
+        return (fields[0],) + tuple(_float(f) for f in fields[1:])
+
+    @staticmethod
+    def _message(line: bytes) -> tuple:
+        """Parses a MSG line into its time and text"""
+        fields = line.split(None, 2)
+        text = fields[2] if len(fields) > 2 else b""
+        return float(fields[1]), text.decode("utf8", "replace")
+
+
+def parse(data: bytes, eye: Optional[str] = None) -> Recording:
+    """Parses the complete lines in data, e.g. the lines of one trial, see
+    trialsplit. See iter_chunks for the meaning of eye.
+    """
+    return _ChunkParser(eye.encode() if eye else None).parse(data)
+
+
+def iter_chunks(
+    fn: str, chunk_size: int = CHUNK_SIZE, eye: Optional[str] = None
+) -> Iterator[Recording]:
+    """Yields a Recording for every chunk of about chunk_size bytes of the
+    .asc file fn.
+
+    @eye for binocular recordings, the eye ("L" or "R") whose samples are
+         returned, by default the first eye in the file.
+    """
+    parser = _ChunkParser(eye.encode() if eye else None)
+    remainder = b""
+    with ascfile.open_asc(fn) as f:
+        while True:
+            block = f.read(chunk_size)
+            if not block:
+                break
+            block = remainder + block
+            cut = block.rfind(b"\n") + 1
+            remainder = block[cut:]
+            if cut:
+                yield parser.parse(block[:cut])
+    if remainder:
+        yield parser.parse(remainder + b"\n")
+
+
+def concatenate(parts: List[Recording]) -> Recording:
+    """Concatenates the Recordings of several chunks"""
+    dtypes = (SAMPLE_DTYPE, FIXATION_DTYPE, SACCADE_DTYPE, BLINK_DTYPE, MESSAGE_DTYPE)
+    return Recording(
+        *(
+            np.concatenate([part[i] for part in parts]) if parts else np.empty(0, dtype)
+            for i, dtype in enumerate(dtypes)
+        )
+    )
+
+
+def read_asc(
+    fn: str, chunk_size: int = CHUNK_SIZE, eye: Optional[str] = None
+) -> Recording:
+    """Reads all samples and events of the .asc file fn
+
+    See iter_chunks for the meaning of the arguments.
+    """
+    return concatenate(list(iter_chunks(fn, chunk_size, eye)))
+
+
+if __name__ == "__main__":
+    import sys
+    import argparse as ap
+
+    parser = ap.ArgumentParser(_PROGRAM_NAME, description=_DESCRIPTION)
+    parser.add_argument("input_files", nargs="+", help="The input .asc file's")
+    args = parser.parse_args()
+
+    for fn in args.input_files:
+        if not os.path.exists(fn):
+            print('Skipping "{}" (it doesn\'t exist).'.format(fn), file=sys.stderr)
+            continue
+        try:
+            rec = read_asc(fn)
+        except ascfile.READ_ERRORS as error:
+            print('Skipping "{}" ({}).'.format(fn, error), file=sys.stderr)
+            continue
+        print("{}:".format(fn))
+        print("  samples:\t\t{}".format(len(rec.samples)))
+        print("  missing samples:\t{}".format(np.isnan(rec.samples["x"]).sum()))
+        print("  fixations:\t\t{}".format(len(rec.fixations)))
+        print("  saccades:\t\t{}".format(len(rec.saccades)))
+        print("  blinks:\t\t{}".format(len(rec.blinks)))
+        print("  messages:\t\t{}".format(len(rec.messages)))
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+
+"""ascstore keeps a columnar binary copy of an .asc file next to it, so
+that a converted recording doesn't have to be parsed again for every
+analysis.
+
+The sidecar of "name.asc" is the directory "name.asc.cols" containing a
+header.json with the EyeFileInfo of the recording and one file per column
+of the samples and of each event type. The columns are memory-mapped when
+loaded, so opening a recording is cheap, only the slices that are used are
+read from disk and several processes share the same pages.
+
+A sidecar records the size and modification time of its .asc file,
+load() regenerates it when the .asc file has changed.
+"""
+
+import os
+import os.path
+import json
+import shutil
+
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import ascreader
+import edfinfo
+
+_PROGRAM_NAME = "ascstore"
+_DESCRIPTION = """ascstore creates (or refreshes) the columnar sidecars of
+Eyelink .asc files."""
+
+SIDECAR_SUFFIX = ".cols"
+HEADER = "header.json"
+_FORMAT_VERSION = 1
+
+# The tables of a recording in the order of ascreader.Recording
+TABLES = {
+    "samples": ascreader.SAMPLE_DTYPE,
+    "fixations": ascreader.FIXATION_DTYPE,
+    "saccades": ascreader.SACCADE_DTYPE,
+    "blinks": ascreader.BLINK_DTYPE,
+    "messages": ascreader.MESSAGE_DTYPE,
+}
+
+# Columns that cannot be memory-mapped and are stored as a JSON list
+_TEXT_COLUMNS = {("messages", "text")}
+
+
+def sidecar_name(ascfn: str) -> str:
+    """Returns the name of the sidecar directory of ascfn"""
+    return ascfn + SIDECAR_SUFFIX
+
+
+def _column_file(dirname: str, table: str, column: str) -> str:
+    """Returns the name of the file of a column"""
+    suffix = ".json" if (table, column) in _TEXT_COLUMNS else ".bin"
+    return os.path.join(dirname, "{}.{}{}".format(table, column, suffix))
+
+
+def _source(ascfn: str) -> Dict:
+    """Returns the properties of ascfn that determine whether a sidecar
+    is up to date
+    """
+    stat = os.stat(ascfn)
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+class Table:
+    """A set of equally long columns of one kind of data"""
+
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        self.columns = columns
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def __len__(self) -> int:
+        return len(next(iter(self.columns.values()), ()))
+
+    def names(self) -> List[str]:
+        """Returns the names of the columns"""
+        return list(self.columns)
+
+    def slice(self, start: int, stop: int) -> "Table":
+        """Returns rows start up to stop, without copying"""
+        return Table({k: v[start:stop] for k, v in self.columns.items()})
+
+    def between(self, begin: float, end: float, key: str = "time") -> "Table":
+        """Returns the rows for which begin <= key < end, key must be a
+        sorted column such as the time of the samples or the start of
+        events.
+        """
+        column = self.columns[key]
+        start, stop = np.searchsorted(column, [begin, end])
+        return self.slice(start, stop)
+
+    def to_array(self, dtype: np.dtype) -> np.ndarray:
+        """Copies the table into a structured array of dtype"""
+        array = np.empty(len(self), dtype)
+        for name in dtype.names:
+            array[name] = self.columns[name]
+        return array
+
+
+class Session:
+    """A recording loaded from its sidecar"""
+
+    def __init__(self, info: edfinfo.EyeFileInfo, tables: Dict[str, Table]):
+        self.info = info
+        self.tables = tables
+        self.samples = tables["samples"]
+        self.fixations = tables["fixations"]
+        self.saccades = tables["saccades"]
+        self.blinks = tables["blinks"]
+        self.messages = tables["messages"]
+
+
+def is_current(ascfn: str) -> bool:
+    """Returns whether the sidecar of ascfn exists and is up to date"""
+    try:
+        with open(os.path.join(sidecar_name(ascfn), HEADER)) as f:
+            header = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return (
+        header.get("format") == _FORMAT_VERSION
+        and header.get("source") == _source(ascfn)
+    )
+
+
+def _write_tables(
+    ascfn: str, info: edfinfo.EyeFileInfo, source: Dict, tempdir: str
+):
+    """Writes the column files and the header of ascfn to tempdir
+
+    @source the _source() of ascfn before it was read
+    """
+    lengths = {table: 0 for table in TABLES}
+    texts: List[str] = []
+    files = {}
+    try:
+        for table, dtype in TABLES.items():
+            for column in dtype.names:
+                if (table, column) not in _TEXT_COLUMNS:
+                    files[table, column] = open(
+                        _column_file(tempdir, table, column), "wb"
+                    )
+
+        for chunk in ascreader.iter_chunks(ascfn):
+            for table, data in zip(TABLES, chunk):
+                lengths[table] += len(data)
+                for column in data.dtype.names:
+                    if (table, column) in _TEXT_COLUMNS:
+                        texts.extend(data[column])
+                    else:
+                        files[table, column].write(
+                            np.ascontiguousarray(data[column]).tobytes()
+                        )
+    finally:
+        for f in files.values():
+            f.close()
+
+    with open(_column_file(tempdir, "messages", "text"), "w") as f:
+        json.dump(texts, f)
+
+    header = {
+        "format": _FORMAT_VERSION,
+        "source": source,
+        "info": vars(info),
+        "tables": {
+            table: {
+                "length": lengths[table],
+                "columns": {
+                    name: dtype.fields[name][0].str for name in dtype.names
+                },
+            }
+            for table, dtype in TABLES.items()
+        },
+    }
+    with open(os.path.join(tempdir, HEADER), "w") as f:
+        json.dump(header, f, indent=1)
+
+
+def _replace(tempdir: str, dirname: str):
+    """Replaces the directory dirname by tempdir
+
+    The old sidecar is renamed aside first and only removed once tempdir is
+    in place, when that fails it is put back. Processes that mapped the old
+    columns keep their (unlinked) copy.
+    """
+    oldname = "{}.{}.old".format(dirname, os.getpid())
+    if os.path.exists(dirname):
+        os.rename(dirname, oldname)
+    try:
+        os.rename(tempdir, dirname)
+    except OSError:
+        if os.path.exists(oldname):
+            os.rename(oldname, dirname)
+        raise
+    shutil.rmtree(oldname, ignore_errors=True)
+
+
+def write(ascfn: str, info: Optional[edfinfo.EyeFileInfo] = None):
+    """(Re)creates the sidecar of ascfn
+
+    @info the info of the recording, it is obtained from ascfn by default
+
+    The .asc file is read in chunks and every chunk is appended to the
+    column files, so memory stays bounded. The sidecar is written to a
+    temporary directory that replaces the old sidecar when it is complete,
+    the temporary directory is removed when writing fails.
+    """
+    if info is None:
+        info = edfinfo.EyeFileInfo()
+        info.parse_file(ascfn)
+    source = _source(ascfn)
+
+    dirname = sidecar_name(ascfn)
+    tempdir = "{}.{}.tmp".format(dirname, os.getpid())
+    if os.path.exists(tempdir):
+        shutil.rmtree(tempdir)
+    os.makedirs(tempdir)
+    try:
+        _write_tables(ascfn, info, source, tempdir)
+        _replace(tempdir, dirname)
+    except BaseException:
+        shutil.rmtree(tempdir, ignore_errors=True)
+        raise
+
+
+def ensure(ascfn: str, info: Optional[edfinfo.EyeFileInfo] = None) -> bool:
+    """Writes the sidecar of ascfn unless it is up to date, returns
+    whether it has been written.
+    """
+    if is_current(ascfn):
+        return False
+    write(ascfn, info)
+    return True
+
+
+def _map_column(fn: str, dtype: str, length: int) -> np.ndarray:
+    """Memory-maps a column file, empty columns cannot be mapped"""
+    if not length:
+        return np.empty(0, dtype)
+    return np.memmap(fn, dtype=dtype, mode="r", shape=(length,))
+
+
+def load(ascfn: str, refresh: bool = True) -> Session:
+    """Loads the recording ascfn from its sidecar
+
+    @refresh when True the sidecar is (re)generated when it is missing or
+             older than ascfn.
+    """
+    if refresh:
+        ensure(ascfn)
+
+    dirname = sidecar_name(ascfn)
+    with open(os.path.join(dirname, HEADER)) as f:
+        header = json.load(f)
+
+    info = edfinfo.EyeFileInfo()
+    vars(info).update(header["info"])
+
+    tables = {}
+    for table, props in header["tables"].items():
+        columns = {}
+        for column, dtype in props["columns"].items():
+            fn = _column_file(dirname, table, column)
+            if (table, column) in _TEXT_COLUMNS:
+                with open(fn) as f:
+                    columns[column] = np.array(json.load(f), dtype=object)
+            else:
+                columns[column] = _map_column(fn, dtype, props["length"])
+        tables[table] = Table(columns)
+    return Session(info, tables)
+
+
+if __name__ == "__main__":
+    import sys
+    import argparse as ap
+    import ascfile
+
+    parser = ap.ArgumentParser(_PROGRAM_NAME, description=_DESCRIPTION)
+    parser.add_argument("input_files", nargs="+", help="The input .asc file's")
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="Recreate the sidecars even when they are up to date.",
+    )
+    args = parser.parse_args()
+
+    for fn in args.input_files:
+        if not (edfinfo.is_asc(fn) and os.path.exists(fn)):
+            print('Skipping "{}" (not an asc file).'.format(fn), file=sys.stderr)
+            continue
+        try:
+            if args.force:
+                write(fn)
+            elif not ensure(fn):
+                print('"{}" is up to date.'.format(sidecar_name(fn)))
+                continue
+        except ascfile.READ_ERRORS as error:
+            print('Skipping "{}" ({}).'.format(fn, error), file=sys.stderr)
+            continue
+        print('Created "{}".'.format(sidecar_name(fn)))
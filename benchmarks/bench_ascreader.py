@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Benchmark of ascreader against a line by line str.split parser
+
+Reads an .asc file, by default one of the example recordings repeated a
+number of times, with both and reports the samples per second and whether
+the speedup reaches TARGET.
+"""
+
+import os
+import sys
+import time
+import tempfile
+import argparse as ap
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+import ascreader  # noqa: E402
+
+PROG_NAME = "bench_ascreader"
+PROG_DESC = "Compares ascreader with a line by line parser."
+EXAMPLE = os.path.join(HERE, "..", "data", "reading", "dat", "0007_01_01.asc")
+# The speedup over str.split that ascreader was asked to reach
+TARGET = 10.0
+
+
+def split_parser(fn):
+    """Parses the samples of fn line by line with str.split"""
+    samples = []
+    with open(fn) as f:
+        for line in f:
+            if line[:1].isdigit():
+                fields = line.split("\t")
+                samples.append(
+                    tuple(
+                        float("nan") if v.strip() == "." else float(v)
+                        for v in fields[:4]
+                    )
+                )
+    return samples
+
+
+def best_time(func, fn, repeat):
+    """Returns the best time of func(fn) over repeat runs"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(fn)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    """runs the benchmark"""
+    parser = ap.ArgumentParser(PROG_NAME, description=PROG_DESC)
+    parser.add_argument("ascfile", nargs="?", help="the .asc file to read")
+    parser.add_argument(
+        "-c", "--copies", type=int, default=40, help="copies of the example file"
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=3, help="number of repetitions"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        fn = args.ascfile
+        if not fn:
+            fn = os.path.join(tempdir, "example.asc")
+            with open(EXAMPLE) as f:
+                text = f.read()
+            with open(fn, "w") as f:
+                f.write(text * args.copies)
+
+        nsamples = len(ascreader.read_asc(fn).samples)
+        split_time = best_time(split_parser, fn, args.repeat)
+        reader_time = best_time(ascreader.read_asc, fn, args.repeat)
+
+    print("samples:\t{:>12,}".format(nsamples))
+    print("str.split:\t{:>12,.0f} samples/s".format(nsamples / split_time))
+    print("ascreader:\t{:>12,.0f} samples/s".format(nsamples / reader_time))
+    speedup = split_time / reader_time
+    print("speedup:\t{:>12.1f}x".format(speedup))
+    print(
+        "target:\t\t{:>12.1f}x ({})".format(
+            TARGET, "met" if speedup >= TARGET else "not met"
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Benchmark of reading plain against compressed .asc files
+
+Writes an .asc file, by default one of the example recordings repeated a
+number of times, as plain text, gzip and (when zstandard is installed)
+zstd, then reports the size of each and how fast ascreader parses it and
+trialindex scans it. Use --dir to put the files on the share of interest,
+e.g. an NFS mounted data directory, where reading fewer bytes may make up
+for the decompression.
+"""
+
+import os
+import sys
+import time
+import tempfile
+import argparse as ap
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+import ascfile  # noqa: E402
+import ascreader  # noqa: E402
+import trialindex  # noqa: E402
+
+PROG_NAME = "bench_compression"
+PROG_DESC = "Compares reading plain and compressed .asc files."
+EXAMPLE = os.path.join(HERE, "..", "data", "reading", "dat", "0007_01_01.asc")
+
+
+def parse(fn):
+    """Parses all chunks of fn, returns the number of samples"""
+    return sum(len(chunk.samples) for chunk in ascreader.iter_chunks(fn))
+
+
+def best_time(func, fn, repeat):
+    """Returns the best time of func(fn) over repeat runs"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(fn)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    """runs the benchmark"""
+    parser = ap.ArgumentParser(PROG_NAME, description=PROG_DESC)
+    parser.add_argument("ascfile", nargs="?", help="the .asc file to read")
+    parser.add_argument(
+        "-c", "--copies", type=int, default=40, help="copies of the example file"
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=3, help="number of repetitions"
+    )
+    parser.add_argument("-d", "--dir", help="where to write the test files")
+    args = parser.parse_args()
+
+    names = [None] + [n for n in sorted(ascfile.COMPRESSIONS) if ascfile.available(n)]
+    rows = []
+    with tempfile.TemporaryDirectory(dir=args.dir) as tempdir:
+        plain = os.path.join(tempdir, "example.asc")
+        with open(args.ascfile or EXAMPLE) as f:
+            text = f.read()
+        with open(plain, "w") as f:
+            f.write(text * (1 if args.ascfile else args.copies))
+        size = os.path.getsize(plain)
+
+        for name in names:
+            fn = ascfile.compressed_name(plain, name)
+            start = time.perf_counter()
+            if name:
+                ascfile.compress(plain, fn)
+            write_time = time.perf_counter() - start
+            nsamples = parse(fn)
+            rows.append(
+                (
+                    name or "plain",
+                    os.path.getsize(fn),
+                    write_time,
+                    nsamples / best_time(parse, fn, args.repeat),
+                    size / best_time(trialindex.build, fn, args.repeat),
+                )
+            )
+
+    print("samples:\t{:>12,}".format(nsamples))
+    print(
+        "{:<8}{:>14}{:>8}{:>10}{:>16}{:>16}".format(
+            "format", "bytes", "ratio", "write s", "samples/s", "scan MB/s"
+        )
+    )
+    for name, nbytes, write_time, rate, scan in rows:
+        print(
+            "{:<8}{:>14,}{:>8.1f}{:>10.2f}{:>16,.0f}{:>16,.1f}".format(
+                name, nbytes, size / nbytes, write_time, rate, scan / 1e6
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
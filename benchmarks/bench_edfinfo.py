@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""Micro-benchmark of the line parsing in edfinfo.EyeFileInfo
+
+Generates a synthetic, MSG heavy, session and reports how many preamble
+and MSG lines per second EyeFileInfo classifies, compared to the chains of
+regexes that it used before, which RegexChain keeps.
+"""
+
+import os
+import re
+import sys
+import time
+import argparse as ap
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import edfinfo  # noqa: E402
+
+PROG_NAME = "bench_edfinfo"
+PROG_DESC = "Compares the lines per second parsed by edfinfo.EyeFileInfo."
+
+PREAMBLE = [
+    "** DATE: Wed Jan 12 15:12:08 2022",
+    "** TYPE: EDF_FILE BINARY EVENT SAMPLE TAGGED",
+    "** VERSION: EYELINK II 1",
+    "** SOURCE: EYELINK CL",
+    "** EYELINK II CL v4.594 Jul  6 2012",
+    "** CAMERA: EyeLink CL Version 1.4 Sensor=BJF",
+    "** SERIAL NUMBER: CL1-AAD41",
+    "** CAMERA_CONFIG: AAD41140.SCD",
+    "** RECORDED BY: Zep 2.5",
+    "**",
+]
+
+MESSAGES = [
+    "trialbeg {trial:03} {trial} {trial:03} CNDA",
+    "plafile CNDA{trial:03}.bmp",
+    "DRIFTCORRECT R RIGHT at 296,347  OFFSET 0.48 deg.  -5.1,26.0 pix.",
+    "SYNCTIME 0",
+    "0 DISPLAY ON",
+    "RECCFG CR 500 2 1 R",
+    "GAZE_COORDS 0.00 0.00 1439.00 1079.00",
+    "trialend {trial:03} {trial} {trial:03} CNDA",
+]
+
+FIELDS = [
+    "EXPERIMENT:reading",
+    "RESEARCHER:JD",
+    "PARTICIPANT:dummy",
+    "SESSION:1",
+    "LIST:1",
+    "RECORDING:1",
+]
+
+
+class RegexChain:
+    """The line parsing of EyeFileInfo before it used PREAMBLE_FIELDS and
+    MSG_FIELDS: a regex per attribute, tried one after the other. Only a MSG
+    RECORDED BY now fills out recorded_by instead of recording.
+    """
+
+    RE_START = r"^(\*\* )?"
+    RE_MSG_START = r"^(MSG\s+\d+\s+)"
+
+    PREAMBLE = [
+        (re.compile(RE_START + r"DATE: (.*)"), "date"),
+        (re.compile(RE_START + r"TYPE: (.*)"), "type"),
+        (re.compile(RE_START + r"VERSION: (.*)"), "version"),
+        (re.compile(RE_START + r"SOURCE: (.*)"), "source"),
+        (re.compile(RE_START + r"(EYELINK .*)"), "eyelink"),
+        (re.compile(RE_START + r"CAMERA: (.*)"), "camera"),
+        (re.compile(RE_START + r"SERIAL NUMBER: (.*)"), "serial"),
+        (re.compile(RE_START + r"CAMERA_CONFIG: (.*)"), "camera_conf"),
+        (re.compile(RE_START + r"RECORDED BY: (.*)"), "recorded_by"),
+        (re.compile(RE_START + r"EXPERIMENT: (.*)"), "experiment"),
+        (re.compile(RE_START + r"RESEARCHER: (.*)"), "researcher"),
+        (re.compile(RE_START + r"PARTICIPANT: (.*)"), "participant"),
+        (re.compile(RE_START + r"SESSION: (.*)"), "session"),
+        (re.compile(RE_START + r"LIST: (.*)"), "list"),
+        (re.compile(RE_START + r"RECORDING: (.*)"), "recording"),
+    ]
+
+    MSG = [
+        (re.compile(RE_MSG_START + r"RECORDED BY:(.*)"), "recorded_by"),
+        (re.compile(RE_MSG_START + r"EXPERIMENT:(.*)"), "experiment"),
+        (re.compile(RE_MSG_START + r"RESEARCHER:(.*)"), "researcher"),
+        (re.compile(RE_MSG_START + r"PARTICIPANT:(.*)"), "participant"),
+        (re.compile(RE_MSG_START + r"SESSION:(.*)"), "session"),
+        (re.compile(RE_MSG_START + r"LIST:(.*)"), "list"),
+        (re.compile(RE_MSG_START + r"RECORDING:(.*)"), "recording"),
+    ]
+
+    def _parse_preamble(self, lines):
+        """Stops at the first regex that matches a line"""
+        for line in lines:
+            for regex, attribute in self.PREAMBLE:
+                if obj := regex.match(line):
+                    setattr(self, attribute, obj.group(2))
+                    break
+
+    def _parse_msg_lines(self, lines):
+        """Tries every regex on every line"""
+        for line in lines:
+            for regex, attribute in self.MSG:
+                if obj := regex.match(line):
+                    setattr(self, attribute, obj.group(2))
+
+
+def synthetic_messages(nlines):
+    """Returns nlines MSG lines as edf2asc writes them"""
+    lines = ["MSG\t1000 {}".format(field) for field in FIELDS]
+    timestamp = 1000
+    while len(lines) < nlines:
+        trial = len(lines) // len(MESSAGES) % 1000
+        for msg in MESSAGES:
+            timestamp += 7
+            lines.append("MSG\t{} {}".format(timestamp, msg.format(trial=trial)))
+    return lines[:nlines]
+
+
+def lines_per_second(func, lines, repeat):
+    """Returns the best lines per second of func(lines) over repeat runs"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(lines)
+        best = min(best, time.perf_counter() - start)
+    return len(lines) / best
+
+
+def main():
+    """runs the benchmark"""
+    parser = ap.ArgumentParser(PROG_NAME, description=PROG_DESC)
+    parser.add_argument(
+        "-n", "--lines", type=int, default=200000, help="number of MSG lines"
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=5, help="number of repetitions"
+    )
+    args = parser.parse_args()
+
+    msgs = synthetic_messages(args.lines)
+    preamble = PREAMBLE * max(1, args.lines // len(PREAMBLE))
+    info = edfinfo.EyeFileInfo()
+    chain = RegexChain()
+
+    for name, lines, method in [
+        ("preamble", preamble, "_parse_preamble"),
+        ("messages", msgs, "_parse_msg_lines"),
+    ]:
+        before = lines_per_second(getattr(chain, method), lines, args.repeat)
+        after = lines_per_second(getattr(info, method), lines, args.repeat)
+        print("{}:".format(name))
+        print("  regex chain:\t{:>12,.0f} lines/s".format(before))
+        print("  EyeFileInfo:\t{:>12,.0f} lines/s".format(after))
+        print("  speedup:\t{:>12.1f}x".format(after / before))
+
+    # Both have to come to the same info
+    for attribute in vars(chain):
+        assert getattr(info, attribute) == getattr(chain, attribute), attribute
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""Start-up time of the eyetracker subcommands
+
+Runs "eyetracker.py CMD --help" a number of times for every command and
+compares the best time with its target. The targets are what a command
+may take on top of the interpreter itself ("python -c pass"); the light
+commands must stay clear of NumPy, Pillow and asyncio to meet theirs.
+Finally it shows what one "eyetracker info" of all example files saves
+compared to running it once per file in a shell loop.
+
+Exits with 1 when a command misses its target.
+"""
+
+import os
+import sys
+import glob
+import time
+import subprocess
+import argparse as ap
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+EYETRACKER = os.path.join(HERE, "..", "eyetracker.py")
+EXAMPLES = os.path.join(HERE, "..", "data", "reading", "dat")
+
+PROG_NAME = "bench_startup"
+PROG_DESC = "Checks the start-up time of the eyetracker subcommands."
+
+# The milliseconds a command may add to the start-up of the interpreter.
+# On a single core VM --help took 10 ms, the light commands 20-75 ms and
+# those that need asyncio or NumPy 70-170 ms.
+TARGETS = {
+    "": 25,
+    "info": 100,
+    "obt": 100,
+    "trials": 100,
+    "compress": 100,
+    "messages": 100,
+    "asc": 100,
+    "convert": 200,
+    "quality": 200,
+    "summary": 200,
+}
+
+
+def best_time(args, repeat):
+    """Returns the best wall time in seconds of running args"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False
+        )
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    """runs the benchmark"""
+    parser = ap.ArgumentParser(PROG_NAME, description=PROG_DESC)
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=10, help="number of repetitions"
+    )
+    args = parser.parse_args()
+
+    python = best_time([sys.executable, "-c", "pass"], args.repeat)
+    print("interpreter:{:>20.1f} ms".format(python * 1e3))
+    print("{:<16}{:>12}{:>12}".format("command", "ms", "target"))
+    missed = 0
+    for command, target in TARGETS.items():
+        cmd = [sys.executable, EYETRACKER] + ([command] if command else [])
+        ms = (best_time(cmd + ["--help"], args.repeat) - python) * 1e3
+        status = "" if ms <= target else "  missed"
+        missed += bool(status)
+        print("{:<16}{:>12.1f}{:>12}{}".format(command or "--help", ms, target, status))
+
+    files = sorted(glob.glob(os.path.join(EXAMPLES, "*.*")))
+    info = [sys.executable, EYETRACKER, "info", "--no-cache"]
+    batch = best_time(info + files, args.repeat)
+    loop = sum(best_time(info + [fn], args.repeat) for fn in files)
+    print(
+        "info of {} files:{:>10.1f} ms at once,{:>8.1f} ms in a loop".format(
+            len(files), batch * 1e3, loop * 1e3
+        )
+    )
+    exit(1 if missed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""End to end benchmarks of edfinfo, mkasczep and mkobtzep
+
+Generates a synthetic workload (see synthetic.py) of the requested size in
+a temporary directory, with a stand-in edf2asc of configurable latency, and
+times:
+
+    parse_file.*        edfinfo.EyeFileInfo.parse_file of Zep-1 and Zep-2
+                        style .asc and .edf files
+    deep_parse          edfinfo.EyeFileInfo.deep_parse of .edf files, i.e.
+                        including the edf2asc runs
+    process_files       mkasczep.process_files of all .edf files
+    process_lines.*     mkobtzep.process_lines of an objects csv, with an
+                        empty and with a filled image cache
+
+The best of --repeat runs is reported. The results are saved as JSON, and
+--compare prints them next to those of an earlier run.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import glob
+import shutil
+import platform
+import tempfile
+import contextlib
+import argparse as ap
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+import synthetic  # noqa: E402
+
+PROG_NAME = "bench_suite"
+PROG_DESC = "Times edfinfo, mkasczep and mkobtzep on a synthetic workload."
+FORMAT_VERSION = 1
+EXPNAME = "reading"
+
+
+class Workload:
+    """The synthetic files of a run in a temporary directory"""
+
+    def __init__(self, dirname, args):
+        self.dirname = dirname
+        self.sessions = {}
+        for zep in (1, 2):
+            subdir = os.path.join(dirname, "zep{}".format(zep))
+            os.makedirs(subdir)
+            self.sessions[zep] = [
+                synthetic.write_session(
+                    subdir,
+                    "{:04}_01_01".format(i),
+                    args.trials,
+                    args.samples,
+                    zep,
+                    participant=i,
+                )
+                for i in range(1, args.files + 1)
+            ]
+        nstimuli = -(-args.words // 60)
+        self.expdir = synthetic.write_experiment(
+            dirname, EXPNAME, args.words, nstimuli
+        )
+        self.objects = os.path.join(self.expdir, "obt", "objects1.csv")
+        bindir = os.path.join(dirname, "bin")
+        os.makedirs(bindir)
+        synthetic.write_fake_edf2asc(bindir, args.latency)
+        # Before edfinfo and friends look for edf2asc
+        os.environ["PATH"] = bindir + os.pathsep + os.environ.get("PATH", "")
+
+    def files(self, zep, ext):
+        """Returns the .edf (ext 0) or .asc (ext 1) files of a Zep version"""
+        return [pair[ext] for pair in self.sessions[zep]]
+
+
+def measure(func, repeat, setup=None):
+    """Returns the times of repeat runs of func, setup is run before every
+    run and isn't timed. The output of both is discarded.
+    """
+    times = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            if setup:
+                setup()
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+    return times
+
+
+def result(times, items, unit, nbytes=0):
+    """Returns the JSON record of a benchmark"""
+    best = min(times)
+    record = {
+        "seconds": best,
+        "times": times,
+        "items": items,
+        "unit": unit,
+        "per_second": items / best if best else None,
+    }
+    if nbytes:
+        record["bytes"] = nbytes
+        record["mb_per_second"] = nbytes / best / 1e6 if best else None
+    return record
+
+
+def bench_parse_file(work, args):
+    """Times EyeFileInfo.parse_file without edf2asc"""
+    import edfinfo
+
+    results = {}
+    for zep in (1, 2):
+        for ext, kind in ((1, "asc"), (0, "edf")):
+            files = work.files(zep, ext)
+
+            def parse_all():
+                for fn in files:
+                    edfinfo.EyeFileInfo().parse_file(fn, deep=False)
+
+            times = measure(parse_all, args.repeat)
+            nbytes = sum(os.path.getsize(fn) for fn in files)
+            name = "parse_file.{}.zep{}".format(kind, zep)
+            results[name] = result(times, len(files), "files", nbytes)
+    return results
+
+
+def bench_deep_parse(work, args):
+    """Times EyeFileInfo.deep_parse, which runs edf2asc on .edf files"""
+    import edfinfo
+
+    files = work.files(2, 0)
+
+    def parse_all():
+        for fn in files:
+            edfinfo.EyeFileInfo().deep_parse(fn)
+
+    return {"deep_parse": result(measure(parse_all, args.repeat), len(files), "files")}
+
+
+def bench_process_files(work, args):
+    """Times mkasczep.process_files on the .edf files of both Zep versions"""
+    import mkasczep
+
+    dirname = os.path.join(work.dirname, "asc")
+    os.makedirs(dirname)
+    for zep in (1, 2):
+        for i, fn in enumerate(work.files(zep, 0)):
+            # Both versions have the same participants, so use other names
+            shutil.copy(fn, os.path.join(dirname, "{}{:03}_01_01.edf".format(zep, i)))
+    files = sorted(os.path.basename(fn) for fn in glob.glob(dirname + "/*.edf"))
+
+    def clean():
+        for fn in glob.glob(os.path.join(dirname, "*.asc")):
+            os.unlink(fn)
+        for fn in glob.glob(os.path.join(dirname, ".*")):
+            os.unlink(fn)
+
+    def convert():
+        # A failed conversion would make the time meaningless
+        failures = mkasczep.process_files(files, args.jobs)
+        if failures:
+            sys.exit(
+                "process_files: {} of {} files failed".format(failures, len(files))
+            )
+
+    cwd = os.getcwd()
+    os.chdir(dirname)
+    try:
+        times = measure(convert, args.repeat, clean)
+    finally:
+        os.chdir(cwd)
+    return {"process_files": result(times, len(files), "files")}
+
+
+def bench_process_lines(work, args):
+    """Times mkobtzep.process_lines with and without cached images"""
+    import imgcache
+    import mkobtzep
+
+    imgdir = os.path.join(work.expdir, mkobtzep.IMGDIR)
+    obtdir = os.path.join(work.expdir, mkobtzep.OBTDIR)
+    with open(work.objects) as f:
+        lines = f.readlines()
+
+    def clean(cache=False):
+        outputs = glob.glob(os.path.join(imgdir, "*" + mkobtzep.BMP))
+        outputs += glob.glob(os.path.join(obtdir, "*" + mkobtzep.OBT))
+        for fn in outputs:
+            os.unlink(fn)
+        if cache:
+            shutil.rmtree(os.path.join(imgdir, imgcache.CACHE_DIR), ignore_errors=True)
+
+    def process():
+        cache = imgcache.ImageCache(imgdir, mkobtzep.BMP)
+        mkobtzep.process_lines(lines, EXPNAME, None, cache)
+
+    nstimuli = len(mkobtzep.group_rows(lines))
+    cwd = os.getcwd()
+    os.chdir(work.dirname)
+    try:
+        cold = measure(process, args.repeat, lambda: clean(cache=True))
+        cached = measure(process, args.repeat, clean)
+    finally:
+        os.chdir(cwd)
+    return {
+        "process_lines.cold": result(cold, nstimuli, "stimuli"),
+        "process_lines.cached": result(cached, nstimuli, "stimuli"),
+    }
+
+
+BENCHMARKS = {
+    "parse_file": bench_parse_file,
+    "deep_parse": bench_deep_parse,
+    "process_files": bench_process_files,
+    "process_lines": bench_process_lines,
+}
+
+
+def compare(old, new):
+    """Prints the best times of new next to those of old"""
+    print("{:<24}{:>12}{:>12}{:>10}".format("benchmark", "old s", "new s", "change"))
+    for name, record in new["results"].items():
+        before = old["results"].get(name)
+        if before is None:
+            continue
+        change = record["seconds"] / before["seconds"] - 1 if before["seconds"] else 0
+        print(
+            "{:<24}{:>12.4f}{:>12.4f}{:>+10.1%}".format(
+                name, before["seconds"], record["seconds"], change
+            )
+        )
+
+
+def main():
+    """runs the benchmarks"""
+    parser = ap.ArgumentParser(PROG_NAME, description=PROG_DESC)
+    parser.add_argument("-f", "--files", type=int, default=8, help="sessions per Zep")
+    parser.add_argument("-t", "--trials", type=int, default=40, help="per session")
+    parser.add_argument("-s", "--samples", type=int, default=1000, help="per trial")
+    parser.add_argument("-w", "--words", type=int, default=3000, help="objects")
+    parser.add_argument(
+        "-l", "--latency", type=float, default=0.05, help="edf2asc latency in s"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="jobs of mkasczep.process_files"
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=3, help="number of repetitions"
+    )
+    parser.add_argument(
+        "-b",
+        "--benchmark",
+        action="append",
+        choices=sorted(BENCHMARKS),
+        help="the benchmark to run, may be repeated (default all)",
+    )
+    parser.add_argument("-o", "--output", help="the JSON file for the results")
+    parser.add_argument("-c", "--compare", help="the JSON results of an earlier run")
+    args = parser.parse_args()
+
+    report = {
+        "format": FORMAT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("benchmark", "output", "compare")
+        },
+        "results": {},
+    }
+    with tempfile.TemporaryDirectory(prefix=PROG_NAME) as tempdir:
+        work = Workload(tempdir, args)
+        for name in args.benchmark or BENCHMARKS:
+            report["results"].update(BENCHMARKS[name](work, args))
+
+    print("{:<24}{:>12}{:>14}".format("benchmark", "best s", "per second"))
+    for name, record in report["results"].items():
+        print(
+            "{:<24}{:>12.4f}{:>14.1f} {}".format(
+                name, record["seconds"], record["per_second"], record["unit"]
+            )
+        )
+    output = args.output
+    if not output:
+        output = "{}-{}.json".format(PROG_NAME, time.strftime("%Y%m%d-%H%M%S"))
+    with open(output, "w") as f:
+        json.dump(report, f, indent=1)
+    print('results written to "{}"'.format(output))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
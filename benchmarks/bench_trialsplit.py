@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Benchmark of per-trial event detection on a pool of processes
+
+Writes one long synthetic session (see synthetic.py) and times fixation
+and saccade detection per trial, first serially in this process, then
+with trialsplit.map_trials on 1, 2, 4, ... worker processes up to --jobs.
+The speedup of the pool requires as many cores as workers.
+"""
+
+import os
+import sys
+import time
+import tempfile
+import argparse as ap
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+import synthetic  # noqa: E402
+import trialsplit  # noqa: E402
+
+PROG_NAME = "bench_trialsplit"
+PROG_DESC = "Times per-trial event detection serially and on a process pool."
+
+
+def serial(fn):
+    """Detects the events of every trial of fn in this process"""
+    return [trialsplit.detect_events(c) for c in trialsplit.iter_split(fn, False)]
+
+
+def pooled(fn, jobs):
+    """Detects the events of every trial of fn on jobs workers"""
+    return [
+        rows
+        for _, rows in trialsplit.map_trials(
+            trialsplit.detect_events, [fn], jobs, use_cache=False
+        )
+    ]
+
+
+def main():
+    """runs the benchmark"""
+    parser = ap.ArgumentParser(PROG_NAME, description=PROG_DESC)
+    parser.add_argument("-t", "--trials", type=int, default=200, help="per session")
+    parser.add_argument("-s", "--samples", type=int, default=5000, help="per trial")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=os.cpu_count() or 1, help="maximum workers"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix=PROG_NAME) as tempdir:
+        _, fn = synthetic.write_session(
+            tempdir, "0001_01_01", args.trials, args.samples
+        )
+        print(
+            "session: {} trials, {:,} bytes, {} cores".format(
+                args.trials, os.path.getsize(fn), os.cpu_count()
+            )
+        )
+        start = time.perf_counter()
+        serial(fn)
+        base = time.perf_counter() - start
+        print("{:<12}{:>10}{:>10}".format("workers", "s", "speedup"))
+        print("{:<12}{:>10.2f}{:>10.2f}".format("serial", base, 1.0))
+        jobs = 1
+        while jobs <= args.jobs:
+            start = time.perf_counter()
+            pooled(fn, jobs)
+            elapsed = time.perf_counter() - start
+            print("{:<12}{:>10.2f}{:>10.2f}".format(jobs, elapsed, base / elapsed))
+            jobs *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""Synthetic workloads for the benchmarks
+
+Generates sessions of any size in the formats the scripts read:
+
+    .edf    the plain text preamble and the MSG records, as far as
+            edfreader and edfinfo read them; there are no sample records.
+    .asc    what edf2asc would make of that .edf: the preamble, the
+            messages and, for every trial, a recording block with samples
+            and the SFIX/EFIX, SSACC/ESACC and SBLINK/EBLINK events of a
+            reading like scan path.
+    objectsN.csv and the png stimuli of a zep reading experiment.
+
+A session is either Zep-1 style, with the experiment, participant etc. in
+the preamble, or Zep-2 style with those fields in MSG's. write_fake_edf2asc()
+writes a stand-in for SR Research's edf2asc that converts the synthetic
+.edf files into the same .asc files after a configurable latency.
+"""
+
+import os
+import sys
+import time
+import stat
+import struct
+import heapq
+import random
+import argparse as ap
+
+from typing import Iterator, List, Tuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+import edfreader  # noqa: E402
+
+PROG_NAME = "synthetic"
+PROG_DESC = "Generates a synthetic workload for the benchmarks."
+
+RATE = 500
+SCREEN = (1440, 1080)
+IMAGE = (1024, 768)
+
+PREAMBLE = [
+    "DATE: Wed Jan 12 15:12:08 2022",
+    "TYPE: EDF_FILE BINARY EVENT SAMPLE TAGGED",
+    "VERSION: EYELINK II 1",
+    "SOURCE: EYELINK CL",
+    "EYELINK II CL v4.594 Jul  6 2012",
+    "CAMERA: EyeLink CL Version 1.4 Sensor=BJF",
+    "SERIAL NUMBER: CL1-AAD41",
+    "CAMERA_CONFIG: AAD41140.SCD",
+]
+
+# The message that starts a recording block of a trial, it ends at trialend
+RECORD_MSG = "!MODE RECORD CR {} 2 1 R"
+DRIFTCORRECT = "DRIFTCORRECT R RIGHT at 296,347  OFFSET 0.31 deg.  4.2,-9.8 pix."
+SAMPLE = "{}\t{:7.1f}\t{:7.1f}\t 1100.0\t...\n"
+MISSING = "{}\t   .\t   .\t    0.0\t...\n"
+EFIX = "EFIX R   {}\t{}\t{}\t{:7.1f}\t{:7.1f}\t   1100\n"
+ESACC = "ESACC R  {}\t{}\t{}\t{:7.1f}\t{:7.1f}\t{:7.1f}\t{:7.1f}\t{:7.2f}\t{:7d}\n"
+
+FAKE_EDF2ASC = """#!{python}
+# A stand-in for SR Research's edf2asc, see {module}
+import sys
+sys.path.insert(0, {here!r})
+import synthetic
+sys.exit(synthetic.fake_edf2asc(sys.argv[1:], {latency!r}))
+"""
+
+WORDS = "de het een en van in is dat op te zijn met voor niet aan er".split()
+WORDS += "onderzoek oogbewegingen lezen zinnen woorden proefpersoon".split()
+
+
+def fields(experiment: str, participant: int, listnum: int, session: int = 1):
+    """Returns the (key, value) pairs that identify a session"""
+    return [
+        ("EXPERIMENT", experiment),
+        ("RESEARCHER", "JD"),
+        ("PARTICIPANT", "{:03}".format(participant)),
+        ("SESSION", str(session)),
+        ("LIST", str(listnum)),
+        ("RECORDING", "1"),
+    ]
+
+
+def session(
+    ntrials: int,
+    nsamples: int,
+    zep: int = 2,
+    experiment: str = "reading",
+    participant: int = 1,
+    listnum: int = 1,
+    rate: int = RATE,
+) -> Tuple[List[str], List[Tuple[int, str]]]:
+    """Returns the preamble lines and the (time, text) messages of a
+    session of ntrials trials with nsamples samples each.
+    """
+    ident = fields(experiment, participant, listnum)
+    preamble = list(PREAMBLE)
+    preamble.append("RECORDED BY: Zep {}".format("1.17.1" if zep == 1 else "2.5"))
+    if zep == 1:
+        preamble += ["{}: {}".format(key, value) for key, value in ident]
+    t = 400000
+    messages = [(t, "FRAMERATE 59.99 Hz.")]
+    if zep != 1:
+        messages += [(t, "{}:{}".format(key, value)) for key, value in ident]
+    interval = 1000 // rate
+    for trial in range(1, ntrials + 1):
+        condition = "CND" + "AB"[trial % 2]
+        marker = "{:03} {} {:03} {}".format(trial, trial, trial, condition)
+        t += 500
+        messages += [
+            (t, "trialbeg " + marker),
+            (t + 1, "plafile {}{:03}.bmp".format(condition, trial)),
+            (t + 300, DRIFTCORRECT),
+            (t + 600, "RECCFG CR {} 2 1 R".format(rate)),
+            (t + 600, "GAZE_COORDS 0.00 0.00 1439.00 1079.00"),
+            (t + 601, RECORD_MSG.format(rate)),
+            (t + 700, "SYNCTIME 0"),
+            (t + 700, "0 DISPLAY ON"),
+        ]
+        t += 601 + nsamples * interval
+        messages.append((t, "trialend " + marker))
+    return preamble, messages
+
+
+def edf_bytes(preamble: List[str], messages: List[Tuple[int, str]]) -> bytes:
+    """Returns the contents of an .edf file with preamble and messages"""
+    parts = [edfreader.MAGIC + b"1000FILE\n"]
+    parts += [line.encode() + b"\n" for line in preamble]
+    parts.append(edfreader.ENDP + b"\n")
+    for t, text in messages:
+        data = text.encode() + b"\0"
+        parts.append(
+            struct.pack(">BBBIBH", edfreader.MSG_RECORD, 0, 0, t, 0, len(data)) + data
+        )
+    return b"".join(parts)
+
+
+def _fixations(rng: random.Random, nsamples: int, interval: int):
+    """Yields (kind, nsamples, x, y) of the fixations, saccades and blinks
+    of a scan path along lines of text.
+    """
+    left, top = (SCREEN[0] - IMAGE[0]) // 2 + 80, (SCREEN[1] - IMAGE[1]) // 2 + 160
+    x, y = left, top
+    remaining = nsamples
+    while remaining > 0:
+        count = min(remaining, rng.randint(90, 300) // interval)
+        kind = "blink" if rng.random() < 0.02 else "fix"
+        yield kind, count, x, y
+        remaining -= count
+        if remaining <= 0:
+            break
+        count = min(remaining, rng.randint(20, 40) // interval)
+        x += rng.randint(30, 120) if rng.random() > 0.15 else -rng.randint(30, 120)
+        if x > left + IMAGE[0] - 160:
+            x, y = left, y + 60
+        yield "sacc", count, x, y
+        remaining -= count
+
+
+def trial_lines(
+    rng: random.Random, start: int, nsamples: int, rate: int
+) -> Iterator[Tuple[int, str]]:
+    """Yields the (time, line) of the lines of the recording block of one
+    trial in order of time.
+    """
+    interval = 1000 // rate
+    header = "\tGAZE\tRIGHT\tRATE\t{:7.2f}\tTRACKING\tCR\tFILTER\t2\n".format(rate)
+    yield start, "START\t{} \tRIGHT\tSAMPLES\tEVENTS\n".format(start)
+    yield start, "EVENTS" + header
+    yield start, "SAMPLES" + header
+    t = start
+    px, py = None, None
+    for kind, count, x, y in _fixations(rng, nsamples, interval):
+        if px is None:
+            px, py = x, y
+        end = t + (count - 1) * interval
+        duration = end - t + interval
+        times = range(t, end + 1, interval)
+        if kind == "sacc":
+            yield t, "SSACC R  {}\n".format(t)
+            for i, ts in enumerate(times, 1):
+                f = i / count
+                yield ts, SAMPLE.format(ts, px + (x - px) * f, py + (y - py) * f)
+            amplitude = abs(x - px) / 54.0
+            yield end, ESACC.format(t, end, duration, px, py, x, y, amplitude, 250)
+        elif kind == "blink":
+            yield t, "SBLINK R {}\n".format(t)
+            for ts in times:
+                yield ts, MISSING.format(ts)
+            yield end, "EBLINK R {}\t{}\t{}\n".format(t, end, duration)
+        else:
+            yield t, "SFIX R   {}\n".format(t)
+            for i, ts in enumerate(times):
+                jitter = (i % 5) * 0.2
+                yield ts, SAMPLE.format(ts, x + jitter, y - jitter)
+            yield end, EFIX.format(t, end, duration, x, y)
+            px, py = x, y
+        t = end + interval
+    yield t, "END\t{} \tSAMPLES\tEVENTS\tRES\t  54.00\t  54.80\n".format(t)
+
+
+def asc_lines(
+    preamble: List[str],
+    messages: List[Tuple[int, str]],
+    samples: bool = True,
+    seed: int = 0,
+) -> Iterator[str]:
+    """Yields the lines of the .asc file of a session, like edf2asc"""
+    rng = random.Random(seed)
+    yield "** CONVERTED FROM synthetic.edf using {}\n".format(PROG_NAME)
+    for line in preamble:
+        yield "** {}\n".format(line)
+    yield "**\n\n"
+    # The messages during a recording block are merged with its lines
+    block = None
+    pending: List[Tuple[int, str]] = []
+    for t, text in messages:
+        line = "MSG\t{} {}\n".format(t, text)
+        if block is None:
+            yield line
+        elif text.startswith("trialend "):
+            start, rate = block
+            nsamples = (t - start) * rate // 1000
+            lines = trial_lines(rng, start, nsamples, rate)
+            for _, merged in heapq.merge(pending, lines, key=lambda item: item[0]):
+                if samples or not merged[:1].isdigit():
+                    yield merged
+            yield line
+            block = None
+        else:
+            pending.append((t, line))
+        if text.startswith("!MODE RECORD"):
+            block = t, int(text.split()[3])
+            pending = []
+
+
+def write_lines(fn: str, lines: Iterator[str]):
+    """Writes lines to fn in large blocks"""
+    with open(fn, "w") as f:
+        buf = []
+        for line in lines:
+            buf.append(line)
+            if len(buf) >= 10000:
+                f.write("".join(buf))
+                buf = []
+        f.write("".join(buf))
+
+
+def write_session(
+    dirname: str, name: str, ntrials: int, nsamples: int, zep: int = 2, **kwargs
+) -> Tuple[str, str]:
+    """Writes name.edf and name.asc to dirname, see session(), returns the
+    names of both.
+    """
+    preamble, messages = session(ntrials, nsamples, zep, **kwargs)
+    edf = os.path.join(dirname, name + ".edf")
+    asc = os.path.join(dirname, name + ".asc")
+    with open(edf, "wb") as f:
+        f.write(edf_bytes(preamble, messages))
+    write_lines(asc, asc_lines(preamble, messages))
+    return edf, asc
+
+
+def fake_edf2asc(argv: List[str], latency: float = 0.0) -> int:
+    """The stand-in for edf2asc: [options] in.edf [out.asc]
+
+    -ns leaves out the samples, other options are ignored. Without
+    arguments it prints a usage message with its version.
+    """
+    names = [arg for arg in argv if not arg.startswith("-")]
+    if not names:
+        print("EDF2ASC: EyeLink EDF file -> ASCII (text) file translator")
+        print("EDF2ASC version 4.2.1.0 (synthetic)")
+        return 255
+    edf = names[0]
+    asc = names[1] if len(names) > 1 else os.path.splitext(edf)[0] + ".asc"
+    try:
+        preamble = edfreader.read_preamble(edf)
+        messages = edfreader.read_messages(edf)
+    except (edfreader.NotAnEdfFile, OSError) as error:
+        print(error, file=sys.stderr)
+        return 1
+    time.sleep(latency)
+    write_lines(asc, asc_lines(preamble, messages, "-ns" not in argv))
+    print("Converted successfully: {} messages.".format(len(messages)))
+    return 0
+
+
+def write_fake_edf2asc(dirname: str, latency: float = 0.0) -> str:
+    """Writes an executable edf2asc that calls fake_edf2asc() to dirname
+    and returns its name.
+    """
+    fn = os.path.join(dirname, "edf2asc")
+    with open(fn, "w") as f:
+        f.write(
+            FAKE_EDF2ASC.format(
+                python=sys.executable, module=__file__, here=HERE, latency=latency
+            )
+        )
+    os.chmod(fn, os.stat(fn).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return fn
+
+
+def objects_lines(nwords: int, listnum: int = 1, words_per_stimulus: int = 60):
+    """Yields the lines of an objectsN.csv file with nwords objects"""
+    yield "### Object Information: list {} ###\n".format(listnum)
+    yield (
+        "id;completetype;nlines;linenum;objnumintext;nwordsinline;objnuminline;"
+        "x;y;width;height;linelength;wordlength;text\n"
+    )
+    per_line = 12
+    nlines = (words_per_stimulus + per_line - 1) // per_line
+    for n in range(nwords):
+        stimulus, index = divmod(n, words_per_stimulus)
+        line, inline = divmod(index, per_line)
+        word = WORDS[n % len(WORDS)]
+        width = 14 * len(word) + 10
+        yield "{:03};{};{};{};{};{};{};{};{};{};{};{};{};{}\n".format(
+            stimulus + 1,
+            "CND" + "AB"[(stimulus + 1) % 2],
+            nlines,
+            line,
+            index,
+            per_line,
+            inline,
+            82 + inline * 76,
+            166 + line * 60,
+            width,
+            50,
+            59,
+            len(word),
+            word,
+        )
+
+
+def write_stimuli(imgdir: str, nstimuli: int, size: Tuple[int, int] = IMAGE):
+    """Writes the png's of nstimuli stimuli, a few lines of word-like
+    blocks on a white background, to imgdir.
+    """
+    from PIL import Image, ImageDraw
+
+    for stimulus in range(1, nstimuli + 1):
+        image = Image.new("RGB", size, "white")
+        draw = ImageDraw.Draw(image)
+        for line in range(5):
+            for word in range(12):
+                x, y = 82 + word * 76, 166 + line * 60
+                width = 40 + (word * stimulus) % 30
+                draw.rectangle((x, y + 10, x + width, y + 40), "black")
+        name = "CND{}{:03}.png".format("AB"[stimulus % 2], stimulus)
+        image.save(os.path.join(imgdir, name))
+
+
+def write_experiment(dirname: str, expname: str, nwords: int, nstimuli: int) -> str:
+    """Writes the obt/objects1.csv and the img/*.png of an experiment to
+    dirname and returns the directory of the experiment.
+    """
+    expdir = os.path.join(dirname, expname)
+    for subdir in ("obt", "img", "dat"):
+        os.makedirs(os.path.join(expdir, subdir), exist_ok=True)
+    write_lines(os.path.join(expdir, "obt", "objects1.csv"), objects_lines(nwords))
+    write_stimuli(os.path.join(expdir, "img"), nstimuli)
+    return expdir
+
+
+def main():
+    """generates a workload"""
+    parser = ap.ArgumentParser(PROG_NAME, description=PROG_DESC)
+    parser.add_argument("dirname", help="the output directory")
+    parser.add_argument("-f", "--files", type=int, default=4, help="sessions")
+    parser.add_argument("-t", "--trials", type=int, default=40, help="per session")
+    parser.add_argument("-s", "--samples", type=int, default=2500, help="per trial")
+    parser.add_argument("-z", "--zep", type=int, choices=(1, 2), default=2)
+    parser.add_argument("-w", "--words", type=int, default=0, help="objects")
+    parser.add_argument("-i", "--images", type=int, default=0, help="png stimuli")
+    parser.add_argument(
+        "-l", "--latency", type=float, help="also write a fake edf2asc"
+    )
+    args = parser.parse_args()
+
+    os.makedirs(args.dirname, exist_ok=True)
+    for i in range(1, args.files + 1):
+        write_session(
+            args.dirname,
+            "{:04}_01_01".format(i),
+            args.trials,
+            args.samples,
+            args.zep,
+            participant=i,
+        )
+    if args.words or args.images:
+        write_experiment(args.dirname, "reading", args.words, args.images)
+    if args.latency is not None:
+        print(write_fake_edf2asc(args.dirname, args.latency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+
+"""dataquality reports the tracking quality of Eyelink .asc files per trial
+and per session, so a bad session is noticed right after it was recorded.
+
+For every trial, as marked by the trialbeg and trialend messages (see
+trialindex), and for the whole session it computes:
+
+    track loss      the percentage of samples without gaze position ("."),
+                    e.g. during blinks or when the tracker lost the eye.
+    blinks          the number and total duration of the EBLINK events.
+    drift           the offset in degrees of the DRIFTCORRECT that preceded
+                    the trial; for the session the mean and the maximum.
+    rate            the sample rate of the RECCFG messages and the effective
+                    rate, i.e. the samples per second actually recorded.
+                    Gaps of more than MAX_GAP ms, between recording blocks,
+                    don't count as recorded time.
+
+The file is streamed once, in chunks with ascreader.iter_chunks, so memory
+use doesn't depend on the length of the session. The trials are collected
+from the messages of the chunks along the way, no trial index is read or
+written. Several files are assessed in parallel processes.
+"""
+
+import os
+import os.path
+import re
+import csv
+
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+import ascfile
+import ascreader
+import trialindex
+
+_PROGRAM_NAME = "dataquality"
+_DESCRIPTION = """dataquality reports the track loss, blinks, drift correct
+offsets and effective sample rate of Eyelink .asc files. Directories are
+searched for .asc files. The exit status is 1 when a session needs to be
+checked."""
+
+# Longer intervals in between two samples (in ms) are breaks in recording
+MAX_GAP = 100.0
+
+# A session is marked for checking when it exceeds one of these
+MAX_TRACK_LOSS = 10.0  # percent
+MAX_DRIFT = 1.0  # degrees
+MIN_RATE = 0.95  # fraction of the configured rate
+
+RE_DRIFTCORRECT = re.compile(r"^DRIFTCORRECT\b.*\bOFFSET\s+(\S+)\s+deg\.")
+RE_RECCFG = re.compile(r"^RECCFG\s+\S+\s+(\d+)")
+
+
+class Quality:
+    """The data quality metrics of a trial or a session, the samples and
+    events are added chunk by chunk.
+    """
+
+    def __init__(self):
+        self.samples = 0
+        self.missing = 0
+        self.intervals = 0
+        self.recorded = 0.0  # ms
+        self.last = float("nan")
+        self.blinks = 0
+        self.blink_time = 0.0
+        self.drift: List[float] = []
+        self.rate = float("nan")
+
+    def add_samples(self, times: np.ndarray, missing: np.ndarray):
+        """Adds the samples at times of which missing lack a position"""
+        if not len(times):
+            return
+        self.samples += len(times)
+        self.missing += int(np.count_nonzero(missing))
+        diffs = np.diff(times, prepend=self.last)
+        recorded = diffs[diffs <= MAX_GAP]
+        self.intervals += len(recorded)
+        self.recorded += float(recorded.sum())
+        self.last = float(times[-1])
+
+    def add_blinks(self, blinks: np.ndarray):
+        """Adds EBLINK events"""
+        self.blinks += len(blinks)
+        self.blink_time += float(blinks["duration"].sum())
+
+    @property
+    def track_loss(self) -> float:
+        """The percentage of samples without position"""
+        return 100.0 * self.missing / self.samples if self.samples else float("nan")
+
+    @property
+    def effective_rate(self) -> float:
+        """The number of samples per second of recorded time"""
+        if not self.recorded:
+            return float("nan")
+        return 1000.0 * self.intervals / self.recorded
+
+    def checks(self) -> List[str]:
+        """Returns the metrics that exceed their limits"""
+        failed = []
+        if self.track_loss > MAX_TRACK_LOSS:
+            failed.append("loss")
+        if self.drift and max(self.drift) > MAX_DRIFT:
+            failed.append("drift")
+        if self.effective_rate < MIN_RATE * self.rate:
+            failed.append("rate")
+        return failed
+
+
+class Report(NamedTuple):
+    """The data quality of a file, the trials are in file order"""
+
+    file: str
+    session: Quality
+    trials: List[Tuple[trialindex.Trial, Quality]]
+
+
+def _after(times: np.ndarray, events: List[Tuple[float, float]]) -> np.ndarray:
+    """Returns for every time the index of the last of the (time, value)
+    events at or before it, -1 if there is none.
+    """
+    return np.searchsorted([t for t, _ in events], times, side="right") - 1
+
+
+def _time_ranges(trials: List[trialindex.Trial]) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the begin and end times of trials, a trial that hasn't ended
+    (yet) ends at infinity.
+    """
+    begins = np.array([t.begin_time for t in trials])
+    ends = np.array([t.end_time for t in trials])
+    ends[np.isnan(ends)] = np.inf
+    return begins, ends
+
+
+def assess(fn: str, chunk_size: int = ascreader.CHUNK_SIZE) -> Report:
+    """Computes the data quality of the .asc file fn"""
+    builder = trialindex.Builder()
+    session = Quality()
+    qualities: List[Quality] = []
+    drifts: List[Tuple[float, float]] = []
+    rates: List[Tuple[float, float]] = []
+
+    for chunk in ascreader.iter_chunks(fn, chunk_size):
+        for time, text in chunk.messages:
+            mobj = RE_DRIFTCORRECT.match(text)
+            if mobj:
+                drifts.append((time, abs(float(mobj.group(1)))))
+                continue
+            mobj = RE_RECCFG.match(text)
+            if mobj:
+                rates.append((time, float(mobj.group(1))))
+        # The trials known so far, a trial that continues in the next chunk
+        # gets the rest of its samples there.
+        builder.add_messages(chunk.messages)
+        trials = builder.trials + [t for t in [builder.open_trial()] if t]
+        qualities += [Quality() for _ in trials[len(qualities) :]]
+        begins, ends = _time_ranges(trials)
+        samples = chunk.samples
+        times = samples["time"]
+        missing = np.isnan(samples["x"]) | np.isnan(samples["y"])
+        session.add_samples(times, missing)
+        session.add_blinks(chunk.blinks)
+        # The samples are sorted by time, so every trial is a slice
+        low = np.searchsorted(times, begins)
+        high = np.searchsorted(times, ends, side="right")
+        for i in np.flatnonzero(high > low):
+            part = slice(low[i], high[i])
+            qualities[i].add_samples(times[part], missing[part])
+        starts = chunk.blinks["start"]
+        first = np.searchsorted(starts, begins)
+        for i in np.flatnonzero(np.searchsorted(starts, ends, side="right") > first):
+            qualities[i].add_blinks(
+                chunk.blinks[(starts >= begins[i]) & (starts <= ends[i])]
+            )
+
+    builder.close(float("nan"), None)
+    trials = builder.trials
+    begins, ends = _time_ranges(trials)
+    # A drift correct belongs to the trial it occurs in, or else to the
+    # next trial.
+    session.drift = [offset for _, offset in drifts]
+    for time, offset in drifts:
+        i = np.searchsorted(begins, time, side="right") - 1
+        if i < 0 or time > ends[i]:
+            i += 1
+        if i < len(trials):
+            qualities[i].drift.append(offset)
+    if rates:
+        session.rate = max(rate for _, rate in rates)
+        if len(trials):
+            for i, j in enumerate(_after(begins, rates)):
+                qualities[i].rate = rates[max(j, 0)][1]
+    return Report(fn, session, list(zip(trials, qualities)))
+
+
+def try_assess(fn: str) -> Tuple[Optional[Report], Optional[str]]:
+    """Returns the Report of fn and None, or None and an error message when
+    fn can't be read, e.g. a truncated .asc.gz file.
+    """
+    try:
+        return assess(fn), None
+    except ascfile.READ_ERRORS as error:
+        return None, 'Skipping "{}" ({}).'.format(fn, error)
+
+
+def find_asc_files(paths: List[str]) -> List[str]:
+    """Returns the files in paths and the .asc files in the directories
+    (and subdirectories) of paths.
+    """
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            names = sorted(fn for fn in filenames if ascfile.is_asc(fn))
+            files.extend(os.path.join(dirpath, fn) for fn in names)
+    return files
+
+
+def _fmt(value: float, spec: str = ".1f") -> str:
+    """Formats a metric, NaN (not available) becomes "-" """
+    return "-" if value != value else format(value, spec)
+
+
+TABLE_FIELDS = ["file", "trials", "samples", "loss%", "blinks", "blink_ms"]
+TABLE_FIELDS += ["drift", "max_drift", "rate", "eff_rate", "check"]
+
+
+def table_row(report: Report) -> List[str]:
+    """Returns the summary of report as a row of TABLE_FIELDS"""
+    q = report.session
+    return [
+        report.file,
+        str(len(report.trials)),
+        str(q.samples),
+        _fmt(q.track_loss),
+        str(q.blinks),
+        _fmt(q.blink_time, ".0f"),
+        _fmt(float(np.mean(q.drift)) if q.drift else float("nan"), ".2f"),
+        _fmt(max(q.drift) if q.drift else float("nan"), ".2f"),
+        _fmt(q.rate, ".0f"),
+        _fmt(q.effective_rate),
+        ",".join(q.checks()) or "ok",
+    ]
+
+
+def write_table(out, rows: List[List[str]]):
+    """Writes rows as a table with aligned columns"""
+    rows = [TABLE_FIELDS] + rows
+    widths = [max(len(row[i]) for row in rows) for i in range(len(TABLE_FIELDS))]
+    for row in rows:
+        cells = [row[0].ljust(widths[0])]
+        cells += [cell.rjust(width) for cell, width in zip(row[1:-1], widths[1:-1])]
+        cells.append(row[-1])
+        print("  ".join(cells), file=out)
+
+
+TRIAL_FIELDS = ["file", "trial", "item", "condition", "samples", "missing"]
+TRIAL_FIELDS += ["loss", "blinks", "blink_time", "drift", "rate", "effective_rate"]
+
+
+def write_trials_csv(out, report: Report, header: bool = True):
+    """Writes the quality of the trials of report as csv rows to out"""
+    writer = csv.writer(out, lineterminator="\n")
+    if header:
+        writer.writerow(TRIAL_FIELDS)
+    for trial, q in report.trials:
+        writer.writerow(
+            [
+                os.path.basename(report.file),
+                trial.trial,
+                trial.item,
+                trial.condition,
+                q.samples,
+                q.missing,
+                _fmt(q.track_loss, ".2f"),
+                q.blinks,
+                _fmt(q.blink_time, ".0f"),
+                _fmt(q.drift[-1], ".2f") if q.drift else "",
+                _fmt(q.rate, ".0f"),
+                _fmt(q.effective_rate, ".2f"),
+            ]
+        )
+
+
+if __name__ == "__main__":
+    import sys
+    import argparse as ap
+    import concurrent.futures as cf
+
+    parser = ap.ArgumentParser(_PROGRAM_NAME, description=_DESCRIPTION)
+    parser.add_argument(
+        "input_files", nargs="+", help="The input .asc file's or directories"
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="The number of files to assess in parallel (default the number "
+        "of cpu's).",
+    )
+    parser.add_argument(
+        "-t",
+        "--trials",
+        metavar="CSV",
+        help="Also write the quality per trial to this csv file.",
+    )
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be 1 or greater")
+
+    files = []
+    for fn in find_asc_files(args.input_files):
+        if os.path.exists(fn):
+            files.append(fn)
+        else:
+            print('Skipping "{}" (it doesn\'t exist).'.format(fn), file=sys.stderr)
+
+    if args.jobs > 1 and len(files) > 1:
+        executor = cf.ProcessPoolExecutor(max_workers=min(args.jobs, len(files)))
+        reports = executor.map(try_assess, files)
+    else:
+        executor = None
+        reports = map(try_assess, files)
+
+    rows = []
+    trials_out = open(args.trials, "w", newline="") if args.trials else None
+    try:
+        for report, error in reports:
+            if error:
+                print(error, file=sys.stderr)
+                continue
+            rows.append(table_row(report))
+            if trials_out:
+                write_trials_csv(trials_out, report, header=len(rows) == 1)
+    finally:
+        if trials_out:
+            trials_out.close()
+        if executor:
+            executor.shutdown()
+    write_table(sys.stdout, rows)
+    exit(1 if any(row[-1] != "ok" for row in rows) else 0)
@@ -4,30 +4,39 @@
 
 import re
 import os.path
-import shutil
-import subprocess
 import tempfile
-import pathlib
 
-from typing import List
+import ascfile
+import edfreader
+import instrument
+
+from typing import Dict, Iterable, Iterator, List, Optional
 
 _PROGRAM_NAME = "edfinfo"
 _DESCRIPTION = """edfinfo provides some helpful information about SR-Reseach/Eyelink
 edf files (.edf)"""
 
-_EDF2ASC = "edf2asc"
-_HAVE_EDF2ASC = shutil.which(_EDF2ASC) is not None
 MSG = "MSG"
 
 
+def _edfrunner():
+    """Imports edfrunner, which is only needed to deep parse .edf files,
+    so the asyncio it loads and the search for edf2asc are skipped when
+    the MSG's suffice.
+    """
+    import edfrunner
+
+    return edfrunner
+
+
 def is_edf(fn: str):
     """Returns whether or not the file is a edf file"""
     return os.path.splitext(fn)[1] == ".edf"
 
 
 def is_asc(fn: str):
-    """Returns whether or not the file is a asc file"""
-    return os.path.splitext(fn)[1] == ".asc"
+    """Returns whether or not the file is a (compressed) asc file"""
+    return ascfile.is_asc(fn)
 
 
 def is_eytracker_fn(fn: str):
@@ -41,38 +50,54 @@ class NotAnEyetrackerFile(Exception):
     """Raised by EdfInfo when it thinks it is parsing an invalid file"""
 
 
+class DeepParseError(Exception):
+    """Raised when edf2asc fails or times out during a deep parse"""
+
+
 class EyeFileInfo:
     """
     Obtains general info about a eyelink data file (.edf file).
     """
 
-    RE_START = r"^(\*\* )?"
-    RE_MSG_START = r"^(MSG\s+\d+\s+)"
-
-    RE_DATE = re.compile(RE_START + r"DATE: (.*)")
-    RE_TYPE = re.compile(RE_START + r"TYPE: (.*)")
-    RE_VERSION = re.compile(RE_START + r"VERSION: (.*)")
-    RE_SOURCE = re.compile(RE_START + r"SOURCE: (.*)")
-    RE_EYELINK = re.compile(RE_START + r"(EYELINK .*)")
-    RE_CAMERA = re.compile(RE_START + r"CAMERA: (.*)")
-    RE_SERIAL = re.compile(RE_START + r"SERIAL NUMBER: (.*)")
-    RE_CAMERA_CONF = re.compile(RE_START + r"CAMERA_CONFIG: (.*)")
-    RE_RECORDED_BY = re.compile(RE_START + r"RECORDED BY: (.*)")
-    RE_EXPERIMENT = re.compile(RE_START + r"EXPERIMENT: (.*)")
-    RE_RESEARCHER = re.compile(RE_START + r"RESEARCHER: (.*)")
-    RE_PARTICIPANT = re.compile(RE_START + r"PARTICIPANT: (.*)")
-    RE_SESSION = re.compile(RE_START + r"SESSION: (.*)")
-    RE_LIST = re.compile(RE_START + r"LIST: (.*)")
-    RE_RECORDING = re.compile(RE_START + r"RECORDING: (.*)")
+    # Maps the keywords in the preamble to the attribute they fill out
+    PREAMBLE_FIELDS = {
+        "DATE": "date",
+        "TYPE": "type",
+        "VERSION": "version",
+        "SOURCE": "source",
+        "CAMERA": "camera",
+        "SERIAL NUMBER": "serial",
+        "CAMERA_CONFIG": "camera_conf",
+        "RECORDED BY": "recorded_by",
+        "EXPERIMENT": "experiment",
+        "RESEARCHER": "researcher",
+        "PARTICIPANT": "participant",
+        "SESSION": "session",
+        "LIST": "list",
+        "RECORDING": "recording",
+    }
 
     # These are added because Zep-2 output this info in messages instead of preamble
-    RE_M_RECORDED_BY = re.compile(RE_MSG_START + r"RECORDED BY:(.*)")
-    RE_M_EXPERIMENT = re.compile(RE_MSG_START + r"EXPERIMENT:(.*)")
-    RE_M_RESEARCHER = re.compile(RE_MSG_START + r"RESEARCHER:(.*)")
-    RE_M_PARTICIPANT = re.compile(RE_MSG_START + r"PARTICIPANT:(.*)")
-    RE_M_SESSION = re.compile(RE_MSG_START + r"SESSION:(.*)")
-    RE_M_LIST = re.compile(RE_MSG_START + r"LIST:(.*)")
-    RE_M_RECORDING = re.compile(RE_MSG_START + r"RECORDING:(.*)")
+    MSG_FIELDS = {
+        "RECORDED BY": "recorded_by",
+        "EXPERIMENT": "experiment",
+        "RESEARCHER": "researcher",
+        "PARTICIPANT": "participant",
+        "SESSION": "session",
+        "LIST": "list",
+        "RECORDING": "recording",
+    }
+
+    # A line is classified by one match, group "key" selects the attribute
+    # from the tables above. The eyelink line has no keyword.
+    RE_PREAMBLE = re.compile(
+        r"^(\*\* )?(?:(?P<key>"
+        + "|".join(PREAMBLE_FIELDS)
+        + r"): (?P<value>.*)|(?P<eyelink>EYELINK .*))"
+    )
+    RE_M_FIELD = re.compile(
+        r"^MSG\s+\d+\s+(?P<key>" + "|".join(MSG_FIELDS) + r"):(?P<value>.*)"
+    )
 
     # If the next two regexes match we've parsing of eyefileinfo
     # should be completed.
@@ -114,66 +139,21 @@ class EyeFileInfo:
         EdfInfo.is_complete() to check whether additional info
         should be obtained from the file.
         """
+        fields = self.PREAMBLE_FIELDS
+        match = self.RE_PREAMBLE.match
         for line in lines:
-            if obj := self.RE_DATE.match(line):
-                self.date = obj.group(2)
-                continue
-
-            if obj := self.RE_TYPE.match(line):
-                self.type = obj.group(2)
-                continue
-
-            if obj := self.RE_VERSION.match(line):
-                self.version = obj.group(2)
-                continue
-
-            if obj := self.RE_SOURCE.match(line):
-                self.source = obj.group(2)
-                continue
-
-            if obj := self.RE_EYELINK.match(line):
-                self.eyelink = obj.group(2)
-                continue
-
-            if obj := self.RE_CAMERA.match(line):
-                self.camera = obj.group(2)
-                continue
-
-            if obj := self.RE_SERIAL.match(line):
-                self.serial = obj.group(2)
-                continue
-
-            if obj := self.RE_CAMERA_CONF.match(line):
-                self.camera_conf = obj.group(2)
-                continue
-
-            if obj := self.RE_RECORDED_BY.match(line):
-                self.recorded_by = obj.group(2)
-                continue
-
-            if obj := self.RE_EXPERIMENT.match(line):
-                self.experiment = obj.group(2)
-                continue
-
-            if obj := self.RE_RESEARCHER.match(line):
-                self.researcher = obj.group(2)
-                continue
-
-            if obj := self.RE_PARTICIPANT.match(line):
-                self.participant = obj.group(2)
-                continue
-
-            if obj := self.RE_SESSION.match(line):
-                self.session = obj.group(2)
-                continue
-
-            if obj := self.RE_LIST.match(line):
-                self.list = obj.group(2)
-                continue
-
-            if obj := self.RE_RECORDING.match(line):
-                self.recording = obj.group(2)
-                continue
+            if obj := match(line):
+                if obj.group("eyelink"):
+                    self.eyelink = obj.group("eyelink")
+                else:
+                    setattr(self, fields[obj.group("key")], obj.group("value"))
+
+    def _parse_msg_line(self, line: str) -> bool:
+        """Parses one message, returns True if it filled out an attribute"""
+        if obj := self.RE_M_FIELD.match(line):
+            setattr(self, self.MSG_FIELDS[obj.group("key")], obj.group("value"))
+            return True
+        return False
 
     def _parse_msg_lines(self, lines: List[str]):
         """Parses the messages to collect info
@@ -184,31 +164,16 @@ class EyeFileInfo:
         it's overwritten, hence the messages are treated
         as leading.
         """
+        instrument.count("edfinfo.msg_lines", len(lines))
         for line in lines:
-            if obj := self.RE_M_RECORDED_BY.match(line):
-                self.recording = obj.group(2)
-
-            if obj := self.RE_M_EXPERIMENT.match(line):
-                self.experiment = obj.group(2)
-
-            if obj := self.RE_M_RESEARCHER.match(line):
-                self.researcher = obj.group(2)
-
-            if obj := self.RE_M_PARTICIPANT.match(line):
-                self.participant = obj.group(2)
-
-            if obj := self.RE_M_SESSION.match(line):
-                self.session = obj.group(2)
-
-            if obj := self.RE_M_LIST.match(line):
-                self.list = obj.group(2)
+            self._parse_msg_line(line)
 
-            if obj := self.RE_M_RECORDING.match(line):
-                self.recording = obj.group(2)
-
-    def parse_file(self, fn: str):
+    def parse_file(self, fn: str, deep: bool = True):
         """Parses the file fn
         @fn a valid eyetracker file
+        @deep when True and the MSG's of an .edf file cannot be read
+              directly, edf2asc is used to obtain them, see
+              EyeFileInfo.deep_parse()
 
         Raises NotAnEyetrackerFile when we think it is not an eyetracker
         file.
@@ -218,57 +183,101 @@ class EyeFileInfo:
 
         lines = []
 
-        with open(fn, "rb") as f:
-            # If these match, than we should have everything we need.
-            for l in f:
-                line = l.decode("utf8")
-                obj = self.RE_MSG.match(line)
-                if obj:
-                    break
-                obj = self.RE_ENDP.match(line)
-                if obj:
-                    break
-                lines.append(line)
+        with instrument.timed("edfinfo.preamble"):
+            with ascfile.open_asc(fn) as f:
+                # If these match, than we should have everything we need.
+                for l in f:
+                    line = l.decode("utf8")
+                    obj = self.RE_MSG.match(line)
+                    if obj:
+                        break
+                    obj = self.RE_ENDP.match(line)
+                    if obj:
+                        break
+                    lines.append(line)
+
+            self._parse_preamble(lines)
+        instrument.count("edfinfo.preamble_lines", len(lines))
+
+        if self.is_complete():
+            return
+
+        # Zep-2 stores some of the info in MSG's
+        if is_asc(fn):
+            self.parse_asc_messages(fn)
+            return
+
+        try:
+            msg_lines = edfreader.msg_lines(fn)
+        except edfreader.NotAnEdfFile as error:
+            raise NotAnEyetrackerFile(str(error)) from error
+
+        if msg_lines:
+            self._parse_msg_lines(msg_lines)
+        elif deep and _edfrunner().find_edf2asc():
+            self.deep_parse(fn)
+
+    def _parse_msg_stream(self, lines: Iterable[str], stop: bool = False) -> bool:
+        """Parses the MSG lines in lines, like _parse_msg_lines a later
+        message overwrites an earlier one.
+
+        @param stop whether to stop at the first message that makes self
+               complete, lines is then not consumed further.
+        @return whether self is complete
+        """
+        for line in lines:
+            if line[: len(MSG)] == MSG and self._parse_msg_line(line.strip()):
+                if stop and self.is_complete():
+                    return True
+        return self.is_complete()
+
+    def parse_asc_messages(self, fn: str):
+        """Parses the MSG lines of the .asc file fn in place, this is
+        usefull when an .asc file has been created already.
+        """
+        with instrument.timed("edfinfo.asc_messages"):
+            with ascfile.open_asc(fn, "r", errors="replace") as myfile:
+                self._parse_msg_stream(myfile)
 
-        self._parse_preamble(lines)
+    def deep_parse(self, fn: str):
+        """Inspects whether the eyelink MSG's can fill out the missing values.
 
-        if not self.is_complete():
-            if _HAVE_EDF2ASC:
-                self.deep_parse(fn)
+        An .asc file is read in place, an .edf file is converted by edf2asc
+        and its output is parsed while it is being written. edf2asc is
+        terminated as soon as self is complete, so unlike for an .asc file
+        a later message doesn't overwrite an attribute that's already set.
 
-    def deep_parse(self, fn: str):
-        """Extracts the .edf file to .asc and inspects whether the eyelink MSG
-        can fill out the missing values"""
+        Raises DeepParseError when edf2asc fails or times out.
+        """
 
         if not is_eytracker_fn(fn):
             raise ValueError(f'Not a valid filename: "${fn}"')
 
-        tempname = os.path.join(
-            tempfile.gettempdir(), os.path.splitext(os.path.basename(fn))[0] + ".asc"
-        )
+        if is_asc(fn):
+            self.parse_asc_messages(fn)
+            return
 
-        if is_edf(fn):
-            if not _HAVE_EDF2ASC:
-                raise RuntimeError("the SR research edf2asc program wasn't found")
+        edfrunner = _edfrunner()
+        if not edfrunner.find_edf2asc():
+            raise RuntimeError("the SR research edf2asc program wasn't found")
 
-            # Create a temporary output file in .asc format
+        # edf2asc can only write to a named file, a private directory
+        # makes sure concurrent runs don't clobber each others output.
+        with tempfile.TemporaryDirectory(prefix=_PROGRAM_NAME) as tempdir:
+            tempname = os.path.join(
+                tempdir, os.path.splitext(os.path.basename(fn))[0] + ".asc"
+            )
             # edf2asc The SR research edf -> asc converter
             #   -y  : overwrite .asc if exists
             #   -ns : no samples
-            subprocess.run(
-                [_EDF2ASC, "-y", "-ns", fn, tempname], stdout=subprocess.DEVNULL
+            result = edfrunner.default_runner().convert(
+                fn,
+                tempname,
+                ("-y", "-ns"),
+                follow=lambda line: self._parse_msg_stream([line], stop=True),
             )
-        else:
-            shutil.copy(fn, tempname)
-
-        msg_lines = []
-        with open(tempname) as myfile:
-            msg_lines = [line.strip() for line in myfile if line[: len(MSG)] == MSG]
-        self._parse_msg_lines(msg_lines)
-
-        # Cleanup after use
-        temppath = pathlib.Path(tempname)
-        temppath.unlink()
+            if not result.ok:
+                raise DeepParseError(result.error())
 
     def __str__(self):
         """Return a string representation of self compatible with the
@@ -308,19 +317,189 @@ class EyeFileInfo:
         return s
 
 
+# The fields of a record of the machine readable output formats
+RECORD_FIELDS = ["file", "size"] + list(vars(EyeFileInfo())) + ["trials"]
+FORMATS = ("text", "json", "csv", "tsv")
+
+
+def find_files(paths: Iterable[str], recursive: bool = False) -> Iterator[str]:
+    """Yields the files in paths. The eyetracker files in a directory are
+    yielded in sorted order, including those in subdirectories when
+    recursive is True.
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+        elif recursive:
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for fn in sorted(filenames):
+                    if is_eytracker_fn(fn):
+                        yield os.path.join(dirpath, fn)
+        else:
+            for fn in sorted(os.listdir(path)):
+                if is_eytracker_fn(fn) and os.path.isfile(os.path.join(path, fn)):
+                    yield os.path.join(path, fn)
+
+
+def info_record(fn: str, info: EyeFileInfo, trials: Optional[int]) -> Dict:
+    """Returns a dict with the RECORD_FIELDS of fn"""
+    record = {"file": fn, "size": os.path.getsize(fn)}
+    record.update(vars(info))
+    record["trials"] = trials
+    return record
+
+
 if __name__ == "__main__":
     import sys
+    import csv
+    import json
     import argparse as ap
+    import infocache
+    import trialindex
+
+    # infocache parses with the classes of the module edfinfo, not with
+    # those of this script, so its exceptions are caught by those names.
+    from edfinfo import DeepParseError, NotAnEyetrackerFile
 
     parser = ap.ArgumentParser(_PROGRAM_NAME, description=_DESCRIPTION)
-    parser.add_argument("input_files", nargs="+", help="The input .edf file's")
+    parser.add_argument(
+        "input_files",
+        nargs="+",
+        help="The input .edf or .asc file's, or directories with them",
+    )
+    parser.add_argument(
+        "-t",
+        "--trials",
+        action="store_true",
+        help="Also print the number of trials and the trials per condition.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Don't use or update the cache of previously parsed files.",
+    )
+    parser.add_argument(
+        "--clear-cache",
+        action="store_true",
+        help="Remove all cached info of the directories of the input files.",
+    )
+    parser.add_argument(
+        "--cache-hash",
+        action="store_true",
+        help="Also compare a hash of the file contents with the cached info.",
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=FORMATS,
+        default="text",
+        help="The output format: text (default), json (one object per line), "
+        "csv or tsv. The machine readable formats include the file size and "
+        "the number of trials.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="The number of files to read at once (default 1). This helps "
+        "when the files are on a network share or edf2asc has to run, the "
+        "parsing itself doesn't run in parallel. The output stays in input "
+        "order.",
+    )
+    parser.add_argument(
+        "-r",
+        "--recursive",
+        action="store_true",
+        help="Also search the subdirectories of the directories given.",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print the time spent per stage and the counters to stderr.",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="Write the stages, counters and a timeline of the run as JSON "
+        "(Chrome trace format) to FILE.",
+    )
     args = parser.parse_args()
-
-    for fn in args.input_files:
-        if is_eytracker_fn(fn) and os.path.exists(fn):
-            info = EyeFileInfo()
-            info.parse_file(fn)
-            print("{}:".format(fn))
-            print(str(info))
-        else:
-            print('Skipping "{}" (not an edf or asc file).'.format(fn), file=sys.stderr)
+    if args.jobs < 1:
+        parser.error("--jobs must be 1 or greater")
+    if args.no_cache and (args.clear_cache or args.cache_hash):
+        parser.error("--clear-cache and --cache-hash cannot be used with --no-cache")
+    instrument.setup(args.profile, args.trace)
+
+    files = list(find_files(args.input_files, args.recursive))
+    if args.clear_cache:
+        # infocache.clear() clears the cache of the directory of a file, so
+        # pass it one file of every directory.
+        by_dir = {os.path.dirname(os.path.abspath(fn)): fn for fn in files}
+        for fn in by_dir.values():
+            infocache.clear(fn)
+
+    def inspect(fn):
+        """Returns the (text or record) output of fn and an error message"""
+        if not (is_eytracker_fn(fn) and os.path.exists(fn)):
+            return None, 'Skipping "{}" (not an edf or asc file).'.format(fn)
+        try:
+            info = infocache.parse_file(
+                fn, use_cache=not args.no_cache, use_hash=args.cache_hash
+            )
+        except (NotAnEyetrackerFile, DeepParseError) + ascfile.READ_ERRORS as error:
+            return None, 'Skipping "{}" ({}).'.format(fn, error)
+        if args.format != "text":
+            trials = infocache.trial_count(
+                fn, use_cache=not args.no_cache, use_hash=args.cache_hash
+            )
+            return info_record(fn, info, trials), None
+        text = "{}:".format(fn) + os.linesep + str(info)
+        if args.trials:
+            try:
+                text += os.linesep + trialindex.summary(trialindex.trials_of(fn))
+            except (edfreader.NotAnEdfFile,) + ascfile.READ_ERRORS:
+                pass
+        return text, None
+
+    if args.jobs > 1:
+        import concurrent.futures as cf
+
+        executor = cf.ThreadPoolExecutor(max_workers=args.jobs)
+        futures = [executor.submit(inspect, fn) for fn in files]
+        results = (future.result() for future in futures)
+    else:
+        executor = None
+        results = map(inspect, files)
+
+    writer = None
+    if args.format in ("csv", "tsv"):
+        writer = csv.DictWriter(
+            sys.stdout,
+            RECORD_FIELDS,
+            delimiter="," if args.format == "csv" else "\t",
+            lineterminator="\n",
+        )
+        writer.writeheader()
+    try:
+        for output, error in results:
+            if error:
+                print(error, file=sys.stderr)
+            elif writer:
+                writer.writerow(output)
+            elif args.format == "json":
+                print(json.dumps(output))
+            else:
+                print(output)
+    except BrokenPipeError:
+        # The reader, e.g. head, has seen enough. The output that's still
+        # buffered goes to devnull, so flushing it at exit doesn't fail again.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+    finally:
+        if executor:
+            # The files that haven't been started aren't needed anymore.
+            for future in futures:
+                future.cancel()
+            executor.shutdown()
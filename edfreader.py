@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+"""edfreader reads the preamble and the MSG events of SR-Research/Eyelink
+edf files (.edf) without the need for edf2asc.
+
+The edf format isn't documented by SR-Research. The samples are stored
+in compressed records of varying size, so instead of decoding those, the
+record stream is scanned for message records. A message record looks like:
+
+    0x18 <2 bytes> <timestamp: uint32 big endian> <1 byte>
+    <length: uint16 big endian> <text of length bytes, NUL terminated>
+
+Only records whose text is NUL terminated at exactly the given length and
+contains no control characters are accepted as messages, this has been
+verified against the output of edf2asc.
+"""
+
+import struct
+
+from typing import Iterator, List, Tuple
+
+import instrument
+
+_PROGRAM_NAME = "edfreader"
+_DESCRIPTION = """edfreader prints the MSG events of SR-Reseach/Eyelink edf
+files (.edf) in the same format as edf2asc does."""
+
+MAGIC = b"SR_RESEARCH_"
+ENDP = b"ENDP:"
+
+MSG_RECORD = 0x18
+_MSG_HEADER = struct.Struct(">xxxIxH")
+
+
+class NotAnEdfFile(Exception):
+    """Raised when a file doesn't start like a edf file"""
+
+
+def _read(fn: str) -> bytes:
+    """Reads fn and checks whether it looks like a edf file"""
+    with instrument.timed("edfreader.read"), open(fn, "rb") as f:
+        data = f.read()
+    instrument.count("edfreader.bytes_read", len(data))
+    if not data.startswith(MAGIC):
+        raise NotAnEdfFile(f'"{fn}" doesn\'t look like an edf file')
+    return data
+
+
+def _end_of_preamble(data: bytes) -> int:
+    """Returns the offset of the first byte after the preamble"""
+    endp = data.find(ENDP)
+    if endp < 0:
+        return len(MAGIC)
+    newline = data.find(b"\n", endp)
+    return len(data) if newline < 0 else newline + 1
+
+
+def _is_text(text: bytes) -> bool:
+    """Returns whether text might be the text of a message."""
+    for c in text:
+        if c < 32 and c not in (9, 10, 13):
+            return False
+    return True
+
+
+def _iter_messages(data: bytes, start: int) -> Iterator[Tuple[int, str]]:
+    """Yields (timestamp, text) for all message records in data after
+    offset start.
+    """
+    size = len(data)
+    pos = data.find(MSG_RECORD, start)
+    while 0 <= pos and pos + _MSG_HEADER.size <= size:
+        timestamp, length = _MSG_HEADER.unpack_from(data, pos)
+        textstart = pos + _MSG_HEADER.size
+        textend = textstart + length - 1
+        if length and textend < size and data[textend] == 0:
+            text = data[textstart:textend]
+            if _is_text(text):
+                yield timestamp, text.decode("utf8", "replace").rstrip("\r\n")
+                pos = data.find(MSG_RECORD, textend + 1)
+                continue
+        pos = data.find(MSG_RECORD, pos + 1)
+
+
+def read_preamble(fn: str) -> List[str]:
+    """Returns the lines of the plain text preamble of the edf file fn,
+    without the SR_RESEARCH_ magic and the ENDP: line.
+
+    Raises NotAnEdfFile when fn doesn't start like an edf file.
+    """
+    data = _read(fn)
+    preamble = data[: _end_of_preamble(data)].decode("utf8", "replace")
+    return [
+        line
+        for line in preamble.splitlines()
+        if not line.startswith(MAGIC.decode()) and not line.startswith(ENDP.decode())
+    ]
+
+
+def read_messages(fn: str) -> List[Tuple[int, str]]:
+    """Returns a list of (timestamp, text) tuples of all MSG events in the
+    edf file fn in the order in which they were recorded.
+
+    Raises NotAnEdfFile when fn doesn't start like an edf file.
+    """
+    data = _read(fn)
+    with instrument.timed("edfreader.messages"):
+        return list(_iter_messages(data, _end_of_preamble(data)))
+
+
+def msg_lines(fn: str) -> List[str]:
+    """Returns the MSG events of the edf file fn formatted as the MSG lines
+    in an .asc file created by edf2asc.
+    """
+    return ["MSG\t{} {}".format(t, text) for t, text in read_messages(fn)]
+
+
+if __name__ == "__main__":
+    import sys
+    import argparse as ap
+
+    parser = ap.ArgumentParser(_PROGRAM_NAME, description=_DESCRIPTION)
+    parser.add_argument("input_files", nargs="+", help="The input .edf file's")
+    args = parser.parse_args()
+
+    for fn in args.input_files:
+        try:
+            for line in msg_lines(fn):
+                print(line)
+        except (NotAnEdfFile, OSError) as error:
+            print('Skipping "{}": {}'.format(fn, error), file=sys.stderr)
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+
+"""edfrunner runs SR Research's edf2asc for edfinfo and mkasczep.
+
+The conversions run as asyncio subprocesses on an event loop in a
+background thread, so they can be started from ordinary (threaded) code:
+
+    runner = Runner(concurrency=4, timeout=60)
+    result = runner.convert("0001_01_01.edf", "out.asc")
+    if not result.ok:
+        print(result.error())
+
+edf2asc is started with an argument list, never via a shell. At most
+concurrency conversions run at once, a conversion that takes longer than
+timeout seconds is killed, so a corrupt file that makes edf2asc hang
+doesn't hold up a batch. The output of edf2asc is captured and returned
+in a Result.
+"""
+
+import asyncio
+import functools
+import os
+import os.path
+import shutil
+import threading
+import time
+
+from typing import Callable, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import instrument
+
+_PROGRAM_NAME = "edfrunner"
+_DESCRIPTION = """edfrunner converts .edf files to .asc files next to them
+with edf2asc."""
+
+EDF2ASC_NAME = "edf2asc"
+
+# The default seconds after which a conversion is killed
+TIMEOUT = 300.0
+
+# The default options: -y overwrite the .asc if it exists
+OPTIONS = ("-y",)
+
+# The interval in seconds at which a followed output file is polled
+_POLL_INTERVAL = 0.01
+
+
+class Result(NamedTuple):
+    """The outcome of one run of edf2asc
+
+    returncode is None when edf2asc was killed because it timed out or
+    stopped because the caller had read enough of its output.
+    """
+
+    edf: str
+    asc: str
+    returncode: Optional[int]
+    stdout: str
+    stderr: str
+    elapsed: float
+    timed_out: bool = False
+    stopped: bool = False
+
+    @property
+    def ok(self) -> bool:
+        """Whether the conversion succeeded or was stopped on request"""
+        return self.stopped or (self.returncode == 0 and not self.timed_out)
+
+    def error(self) -> str:
+        """Returns a message that describes why the conversion failed"""
+        if self.timed_out:
+            return "{} timed out on {} after {:.0f}s".format(
+                EDF2ASC_NAME, self.edf, self.elapsed
+            )
+        message = "{} failed on {} with exit status {}".format(
+            EDF2ASC_NAME, self.edf, self.returncode
+        )
+        if self.stderr.strip():
+            message += ": " + self.stderr.strip()
+        return message
+
+
+async def _follow(fn: str, running: asyncio.Future, follow: Callable[[str], bool]):
+    """Passes the lines of fn to follow while it is being written, until
+    running is done or follow returns True. Returns whether follow did.
+    """
+    f = None
+    partial = ""
+    try:
+        while True:
+            finished = running.done()
+            if f is None and os.path.exists(fn):
+                f = open(fn, errors="replace")
+            if f is not None:
+                for line in iter(f.readline, ""):
+                    if not line.endswith("\n"):
+                        partial += line
+                        break
+                    if follow(partial + line):
+                        return True
+                    partial = ""
+            if finished:
+                return bool(partial) and follow(partial)
+            await asyncio.sleep(_POLL_INTERVAL)
+    finally:
+        if f is not None:
+            f.close()
+
+
+@functools.lru_cache(maxsize=None)
+def find_edf2asc() -> Optional[str]:
+    """Returns the path of edf2asc or None when it isn't in PATH
+
+    It's looked up when a conversion needs it, not at import, so tools
+    that never convert an .edf file don't pay for searching PATH.
+    """
+    return shutil.which(EDF2ASC_NAME)
+
+
+class Runner:
+    """Runs edf2asc with a limited concurrency and a timeout per run"""
+
+    def __init__(
+        self,
+        concurrency: int = 1,
+        timeout: Optional[float] = TIMEOUT,
+        program: Optional[str] = None,
+    ):
+        """
+        @concurrency the maximum number of edf2asc processes at once
+        @timeout the seconds after which a run is killed, None waits forever
+        @program the edf2asc executable, by default it's looked up in PATH
+                 at the first run
+        """
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.program = program
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._lock = threading.Lock()
+
+    async def convert_async(
+        self,
+        edf: str,
+        asc: str,
+        options: Sequence[str] = OPTIONS,
+        follow: Optional[Callable[[str], bool]] = None,
+    ) -> Result:
+        """Converts edf into asc
+
+        @options the options passed to edf2asc before the file names
+        @follow a callable that gets every line of asc while it's being
+                written; when it returns True, edf2asc is stopped.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            with instrument.timed("edf2asc.run"):
+                return await self._run(edf, asc, options, follow)
+
+    async def _run(self, edf, asc, options, follow) -> Result:
+        """Runs edf2asc once, see convert_async"""
+        start = time.monotonic()
+        program = self.program or find_edf2asc()
+        if not program:
+            raise FileNotFoundError("the SR research edf2asc program wasn't found")
+        instrument.count("edf2asc.spawns")
+        proc = await asyncio.create_subprocess_exec(
+            program,
+            *options,
+            edf,
+            asc,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        running = asyncio.ensure_future(proc.communicate())
+
+        async def supervise():
+            if follow and await _follow(asc, running, follow):
+                return True
+            await asyncio.shield(running)
+            return False
+
+        timed_out = stopped = False
+        try:
+            stopped = await asyncio.wait_for(supervise(), self.timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+        if (stopped or timed_out) and proc.returncode is None:
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+        stdout, stderr = await running
+        if instrument.ENABLED and os.path.exists(asc):
+            instrument.count("edf2asc.bytes_written", os.path.getsize(asc))
+        return Result(
+            edf,
+            asc,
+            None if (stopped or timed_out) else proc.returncode,
+            stdout.decode(errors="replace"),
+            stderr.decode(errors="replace"),
+            time.monotonic() - start,
+            timed_out,
+            stopped,
+        )
+
+    def _submit(self, coro):
+        """Runs coro on the event loop of this runner and returns its result"""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name=_PROGRAM_NAME, daemon=True
+                )
+                self._thread.start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def convert(
+        self,
+        edf: str,
+        asc: str,
+        options: Sequence[str] = OPTIONS,
+        follow: Optional[Callable[[str], bool]] = None,
+    ) -> Result:
+        """Converts edf into asc and waits for the result, it may be called
+        from several threads at once. See convert_async.
+        """
+        return self._submit(self.convert_async(edf, asc, options, follow))
+
+    def convert_all(
+        self, pairs: Iterable[Tuple[str, str]], options: Sequence[str] = OPTIONS
+    ) -> List[Result]:
+        """Converts all (edf, asc) pairs and returns their results in order"""
+
+        async def convert_all():
+            return await asyncio.gather(
+                *(self.convert_async(edf, asc, options) for edf, asc in pairs)
+            )
+
+        return self._submit(convert_all())
+
+    def close(self):
+        """Stops the event loop of this runner"""
+        with self._lock:
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._thread.join()
+                self._loop.close()
+                self._loop = self._thread = self._semaphore = None
+
+
+_default: Optional[Runner] = None
+_default_lock = threading.Lock()
+
+
+def default_runner() -> Runner:
+    """Returns the runner that is shared by the users of this module that
+    don't need their own settings.
+    """
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Runner(concurrency=os.cpu_count() or 1)
+        return _default
+
+
+if __name__ == "__main__":
+    import sys
+    import argparse as ap
+
+    parser = ap.ArgumentParser(_PROGRAM_NAME, description=_DESCRIPTION)
+    parser.add_argument("input_files", nargs="+", help="The input .edf file's")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="The number of conversions at once.",
+    )
+    parser.add_argument(
+        "-t",
+        "--timeout",
+        type=float,
+        default=TIMEOUT,
+        help="The seconds after which a conversion is killed (default {:g}).".format(
+            TIMEOUT
+        ),
+    )
+    args = parser.parse_args()
+
+    if not find_edf2asc():
+        print("Unable to find {}".format(EDF2ASC_NAME), file=sys.stderr)
+        exit(1)
+    runner = Runner(args.jobs, args.timeout)
+    pairs = [(fn, os.path.splitext(fn)[0] + ".asc") for fn in args.input_files]
+    failures = 0
+    for result in runner.convert_all(pairs):
+        if result.ok:
+            print('converted "{}" in {:.1f}s.'.format(result.edf, result.elapsed))
+        else:
+            failures += 1
+            print(result.error(), file=sys.stderr)
+    runner.close()
+    exit(1 if failures else 0)
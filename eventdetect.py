@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+
+"""eventdetect detects fixations and saccades offline in the raw samples of
+a recording, e.g. to re-analyze a session with other thresholds than the
+online parser of the tracker used.
+
+Two algorithms are available:
+
+    ivt     velocity threshold identification: samples slower than the
+            velocity threshold are fixation samples.
+    idt     dispersion threshold identification: samples covered by a window
+            of min_duration whose dispersion (the sum of the x and y range)
+            is below the dispersion threshold are fixation samples.
+
+A fixation is a run of fixation samples lasting at least min_duration. A
+run ends at a missing sample (".", e.g. during a blink) and at a gap in
+the sample times, e.g. between two recording blocks. The movement in
+between two fixations becomes a saccade, unless samples are missing
+there. Everything is computed with array operations over the whole
+recording.
+
+The results are structured arrays of ascreader.FIXATION_DTYPE and
+ascreader.SACCADE_DTYPE, so they can be used in place of the EFIX and
+ESACC events of the tracker.
+"""
+
+from typing import NamedTuple, Tuple
+
+import numpy as np
+
+import ascreader
+
+_PROGRAM_NAME = "eventdetect"
+_DESCRIPTION = """eventdetect detects the fixations and saccades in Eyelink
+.asc files and compares them with the EFIX events of the tracker."""
+
+# The defaults resemble those of the Eyelink parser for cognitive research
+VELOCITY_THRESHOLD = 30.0  # degrees per second
+DISPERSION_THRESHOLD = 1.0  # degrees
+MIN_DURATION = 40.0  # ms
+PIXELS_PER_DEGREE = 40.0
+
+
+class Events(NamedTuple):
+    """The fixations and saccades detected in a recording"""
+
+    fixations: np.ndarray
+    saccades: np.ndarray
+
+
+def sample_interval(times: np.ndarray) -> float:
+    """Returns the interval between samples in ms"""
+    if len(times) < 2:
+        return 1.0
+    return float(np.median(np.diff(times)))
+
+
+def velocity(samples: np.ndarray, ppd: float = PIXELS_PER_DEGREE) -> np.ndarray:
+    """Returns the velocity of every sample in degrees per second
+
+    The velocity is the central difference of the neighbouring samples, it
+    is NaN for the first and last sample and next to missing samples.
+    """
+    t = samples["time"]
+    x = samples["x"].astype(np.float64)
+    y = samples["y"].astype(np.float64)
+    vel = np.full(len(samples), np.nan)
+    if len(samples) > 2:
+        dist = np.hypot(x[2:] - x[:-2], y[2:] - y[:-2])
+        vel[1:-1] = dist / (t[2:] - t[:-2]) * 1000.0 / ppd
+    return vel
+
+
+def _breaks(samples: np.ndarray) -> np.ndarray:
+    """Returns a mask of the samples that cannot continue the run of the
+    previous sample, because that sample is missing or too long ago.
+    """
+    t = samples["time"]
+    valid = ~(np.isnan(samples["x"]) | np.isnan(samples["y"]))
+    breaks = np.ones(len(samples), bool)
+    breaks[1:] = (np.diff(t) > 1.5 * sample_interval(t)) | ~valid[:-1]
+    return breaks
+
+
+def _runs(mask: np.ndarray, breaks: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the first and last index of the runs of True in mask, a run
+    also ends before a break.
+    """
+    prev = np.zeros(len(mask), bool)
+    prev[1:] = mask[:-1]
+    first = np.flatnonzero(mask & (~prev | breaks))
+    nxt = np.zeros(len(mask), bool)
+    nxt[:-1] = mask[1:] & ~breaks[1:]
+    last = np.flatnonzero(mask & ~nxt)
+    return first, last
+
+
+def _mean(values: np.ndarray, first: np.ndarray, last: np.ndarray) -> np.ndarray:
+    """Returns the mean of values[first[i]:last[i] + 1]"""
+    csum = np.concatenate(([0.0], np.cumsum(values, dtype=np.float64)))
+    sums = csum[last + 1] - csum[first]
+    return sums / (last - first + 1)
+
+
+def _max(values: np.ndarray, first: np.ndarray, last: np.ndarray) -> np.ndarray:
+    """Returns the maximum of values[first[i]:last[i] + 1], NaN's ignored"""
+    if not len(first):
+        return np.zeros(0)
+    # reduceat reduces up to the next index, so interleave the slice ends
+    # and drop the reductions over the gaps in between.
+    padded = np.append(np.nan_to_num(values, nan=0.0), 0.0)
+    bounds = np.empty(2 * len(first), np.int64)
+    bounds[0::2] = first
+    bounds[1::2] = last + 1
+    return np.maximum.reduceat(padded, bounds)[0::2]
+
+
+def _events(
+    samples,
+    is_fixation: np.ndarray,
+    min_duration: float,
+    ppd: float,
+    vel: np.ndarray,
+    eye: str,
+) -> Events:
+    """Turns the fixation samples into fixation and saccade tables"""
+    t = samples["time"]
+    dt = sample_interval(t)
+    valid = ~(np.isnan(samples["x"]) | np.isnan(samples["y"]))
+    breaks = _breaks(samples)
+
+    first, last = _runs(is_fixation & valid, breaks)
+    keep = t[last] - t[first] + dt >= min_duration
+    first, last = first[keep], last[keep]
+
+    fixations = np.zeros(len(first), ascreader.FIXATION_DTYPE)
+    fixations["eye"] = eye
+    fixations["start"] = t[first]
+    fixations["end"] = t[last]
+    fixations["duration"] = t[last] - t[first] + dt
+    fixations["x"] = _mean(samples["x"], first, last)
+    fixations["y"] = _mean(samples["y"], first, last)
+    fixations["pupil"] = _mean(samples["pupil"], first, last)
+
+    # A saccade runs from the sample after a fixation up to the sample
+    # before the next one, provided that no sample from there up to the
+    # next fixation is missing or preceded by a gap.
+    begin = last[:-1] + 1
+    end = first[1:] - 1
+    bad = np.concatenate(([0], np.cumsum(breaks | ~valid)))
+    ok = (end >= begin) & (bad[end + 2] == bad[begin])
+    begin, end = begin[ok], end[ok]
+
+    saccades = np.zeros(len(begin), ascreader.SACCADE_DTYPE)
+    saccades["eye"] = eye
+    saccades["start"] = t[begin]
+    saccades["end"] = t[end]
+    saccades["duration"] = t[end] - t[begin] + dt
+    saccades["x_start"] = samples["x"][begin]
+    saccades["y_start"] = samples["y"][begin]
+    saccades["x_end"] = samples["x"][end]
+    saccades["y_end"] = samples["y"][end]
+    saccades["amplitude"] = (
+        np.hypot(
+            saccades["x_end"] - saccades["x_start"],
+            saccades["y_end"] - saccades["y_start"],
+        )
+        / ppd
+    )
+    saccades["peak_velocity"] = _max(vel, begin, end)
+    return Events(fixations, saccades)
+
+
+def ivt(
+    samples,
+    velocity_threshold: float = VELOCITY_THRESHOLD,
+    min_duration: float = MIN_DURATION,
+    ppd: float = PIXELS_PER_DEGREE,
+    eye: str = "R",
+) -> Events:
+    """Detects fixations and saccades by velocity threshold identification
+
+    @samples the samples as returned by ascreader or an ascstore Table
+    @velocity_threshold the maximum velocity in degrees/s of a fixation
+    @min_duration the minimum duration of a fixation in ms
+    @ppd the number of pixels per degree of visual angle
+    @eye the eye stored in the events
+    """
+    vel = velocity(samples, ppd)
+    return _events(samples, vel < velocity_threshold, min_duration, ppd, vel, eye)
+
+
+def idt(
+    samples,
+    dispersion_threshold: float = DISPERSION_THRESHOLD,
+    min_duration: float = MIN_DURATION,
+    ppd: float = PIXELS_PER_DEGREE,
+    eye: str = "R",
+) -> Events:
+    """Detects fixations and saccades by dispersion threshold identification
+
+    Every window of min_duration is tested at once, a sample belongs to a
+    fixation when it lies in a window whose dispersion is below the
+    threshold. See ivt for the other arguments.
+
+    @dispersion_threshold the maximum dispersion in degrees of a window
+    """
+    t = samples["time"]
+    n = len(t)
+    width = max(1, int(round(min_duration / sample_interval(t))))
+    is_fixation = np.zeros(n, bool)
+    if n >= width:
+        x = samples["x"]
+        y = samples["y"]
+        windows_x = np.lib.stride_tricks.sliding_window_view(x, width)
+        windows_y = np.lib.stride_tricks.sliding_window_view(y, width)
+        # Missing samples are NaN, which makes the dispersion NaN as well
+        dispersion = (windows_x.max(axis=1) - windows_x.min(axis=1)) + (
+            windows_y.max(axis=1) - windows_y.min(axis=1)
+        )
+        # A window may not span a gap in the sample times
+        breaks = np.concatenate(([0], np.cumsum(_breaks(samples)[1:])))
+        gapless = breaks[width - 1 :] == breaks[: n - width + 1]
+        core = (dispersion <= dispersion_threshold * ppd) & gapless
+        # Sample j is covered by the windows that start from width - 1
+        # samples before it up to sample j.
+        started = np.concatenate(([0], np.cumsum(core)))
+        index = np.arange(n)
+        covered = (
+            started[np.minimum(index, len(core) - 1) + 1]
+            - started[np.maximum(index - width + 1, 0)]
+        )
+        is_fixation = covered > 0
+    vel = velocity(samples, ppd)
+    return _events(samples, is_fixation, min_duration, ppd, vel, eye)
+
+
+ALGORITHMS = {"ivt": ivt, "idt": idt}
+
+
+def estimate_ppd(saccades: np.ndarray) -> float:
+    """Estimates the pixels per degree from the amplitudes of the ESACC
+    events of the tracker, PIXELS_PER_DEGREE is returned when there are no
+    suitable saccades.
+    """
+    saccades = saccades[saccades["amplitude"] > 0.5]
+    if not len(saccades):
+        return PIXELS_PER_DEGREE
+    dist = np.hypot(
+        saccades["x_end"] - saccades["x_start"], saccades["y_end"] - saccades["y_start"]
+    )
+    return float(np.nanmedian(dist / saccades["amplitude"]))
+
+
+def _coverage(times: np.ndarray, events: np.ndarray) -> np.ndarray:
+    """Returns a mask of the times that fall within one of the events"""
+    inside = np.zeros(len(times) + 1, np.int64)
+    np.add.at(inside, np.searchsorted(times, events["start"]), 1)
+    np.add.at(inside, np.searchsorted(times, events["end"], side="right"), -1)
+    return np.cumsum(inside[:-1]) > 0
+
+
+def compare(times: np.ndarray, detected: np.ndarray, reference: np.ndarray) -> dict:
+    """Compares detected fixations with reference fixations, e.g. EFIX events
+
+    @times the times of the samples
+    @return a dict with the number of fixations of both, the fraction of
+            the reference fixations that overlap for at least half their
+            duration with a detected fixation, the mean absolute difference
+            of the onsets and offsets of those and the fraction of samples
+            on which both agree whether it is part of a fixation.
+    """
+    result = {
+        "detected": len(detected),
+        "reference": len(reference),
+        "matched": 0.0,
+        "onset_diff": float("nan"),
+        "offset_diff": float("nan"),
+        "agreement": float(
+            np.mean(_coverage(times, detected) == _coverage(times, reference))
+        )
+        if len(times)
+        else float("nan"),
+    }
+    if not (len(detected) and len(reference)):
+        return result
+    # The first detected fixation that ends after a reference one starts
+    index = np.minimum(
+        np.searchsorted(detected["end"], reference["start"]), len(detected) - 1
+    )
+    candidate = detected[index]
+    overlap = np.minimum(candidate["end"], reference["end"]) - np.maximum(
+        candidate["start"], reference["start"]
+    )
+    matched = overlap >= 0.5 * (reference["end"] - reference["start"])
+    result["matched"] = float(matched.mean())
+    if matched.any():
+        result["onset_diff"] = float(
+            np.abs(candidate["start"] - reference["start"])[matched].mean()
+        )
+        result["offset_diff"] = float(
+            np.abs(candidate["end"] - reference["end"])[matched].mean()
+        )
+    return result
+
+
+if __name__ == "__main__":
+    import os.path
+    import sys
+    import time
+    import argparse as ap
+    import ascfile
+
+    parser = ap.ArgumentParser(_PROGRAM_NAME, description=_DESCRIPTION)
+    parser.add_argument("input_files", nargs="+", help="The input .asc file's")
+    parser.add_argument(
+        "-a",
+        "--algorithm",
+        choices=sorted(ALGORITHMS),
+        default="ivt",
+        help="The detection algorithm (default ivt).",
+    )
+    parser.add_argument(
+        "--velocity",
+        type=float,
+        default=VELOCITY_THRESHOLD,
+        help="The velocity threshold of ivt in degrees/s.",
+    )
+    parser.add_argument(
+        "--dispersion",
+        type=float,
+        default=DISPERSION_THRESHOLD,
+        help="The dispersion threshold of idt in degrees.",
+    )
+    parser.add_argument(
+        "--min-duration",
+        type=float,
+        default=MIN_DURATION,
+        help="The minimum duration of a fixation in ms.",
+    )
+    parser.add_argument(
+        "--ppd",
+        type=float,
+        help="Pixels per degree, by default estimated from the ESACC events.",
+    )
+    args = parser.parse_args()
+
+    for fn in args.input_files:
+        if not os.path.exists(fn):
+            print('Skipping "{}" (it doesn\'t exist).'.format(fn), file=sys.stderr)
+            continue
+        try:
+            rec = ascreader.read_asc(fn)
+        except ascfile.READ_ERRORS as error:
+            print('Skipping "{}" ({}).'.format(fn, error), file=sys.stderr)
+            continue
+        ppd = args.ppd or estimate_ppd(rec.saccades)
+        threshold = args.velocity if args.algorithm == "ivt" else args.dispersion
+        start = time.perf_counter()
+        events = ALGORITHMS[args.algorithm](
+            rec.samples, threshold, args.min_duration, ppd
+        )
+        elapsed = time.perf_counter() - start
+        result = compare(rec.samples["time"], events.fixations, rec.fixations)
+        print("{}:".format(fn))
+        print("  samples:\t\t{} ({:.1f} ms)".format(len(rec.samples), elapsed * 1000))
+        print("  pixels per degree:\t{:.1f}".format(ppd))
+        print(
+            "  fixations:\t\t{} (EFIX {})".format(
+                result["detected"], result["reference"]
+            )
+        )
+        print(
+            "  saccades:\t\t{} (ESACC {})".format(
+                len(events.saccades), len(rec.saccades)
+            )
+        )
+        print("  EFIX matched:\t\t{:.1%}".format(result["matched"]))
+        print("  onset difference:\t{:.1f} ms".format(result["onset_diff"]))
+        print("  offset difference:\t{:.1f} ms".format(result["offset_diff"]))
+        print("  sample agreement:\t{:.1%}".format(result["agreement"]))
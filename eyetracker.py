@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+"""eyetracker runs the tools of this repository as subcommands of one
+program, e.g.:
+
+    eyetracker info -f csv data/reading/dat
+    eyetracker asc -j 4 *.edf
+    eyetracker obt reading 1 2 3
+
+Only the module of the subcommand is imported, and that module in turn
+imports heavy dependencies such as NumPy, Pillow or asyncio and looks up
+edf2asc only when the work at hand needs them. "eyetracker CMD --help"
+prints the options of a subcommand.
+
+Every subcommand accepts many files at once, which is much faster than
+running it once per file in a shell loop, since the interpreter and the
+imports are started only once. An argument "@FILE" is replaced by the
+lines of FILE, "@-" by those of stdin, e.g.:
+
+    find /data -name '*.edf' | eyetracker info -j 8 -f json @-
+
+benchmarks/bench_startup.py checks the start-up time against its target.
+"""
+
+import sys
+import runpy
+
+_PROGRAM_NAME = "eyetracker"
+
+# The subcommands: name -> (module, summary)
+COMMANDS = {
+    "info": ("edfinfo", "show the info of .edf and .asc files"),
+    "asc": ("mkasczep", "convert .edf files to .asc files for Zep"),
+    "obt": ("mkobtzep", "create the .obt files and images of an experiment"),
+    "quality": ("dataquality", "report the data quality of .asc files"),
+    "trials": ("trialindex", "list the trials in .asc files"),
+    "split": ("trialsplit", "split .asc files per trial or detect events per trial"),
+    "summary": ("ascreader", "summarize the samples and events of .asc files"),
+    "compress": ("ascfile", "(de)compress .asc files"),
+    "sidecar": ("ascstore", "write the columnar sidecars of .asc files"),
+    "events": ("eventdetect", "detect fixations and saccades in .asc files"),
+    "dwell": ("aoidwell", "compute the dwell time per area of interest"),
+    "measures": ("readmeasures", "compute the reading measures per word"),
+    "messages": ("edfreader", "print the MSG events of .edf files"),
+    "convert": ("edfrunner", "run edf2asc on .edf files"),
+}
+
+_USAGE = "usage: {} [-h] COMMAND [ARGS ...]".format(_PROGRAM_NAME)
+
+
+def usage(out=sys.stdout):
+    """Prints the usage and the subcommands to out"""
+    print(_USAGE, file=out)
+    print(
+        "\nRuns one of the eye tracker tools, see {} COMMAND --help.".format(
+            _PROGRAM_NAME
+        ),
+        file=out,
+    )
+    print("\ncommands:", file=out)
+    for name, (module, summary) in COMMANDS.items():
+        print("  {:<10}{} ({})".format(name, summary, module), file=out)
+
+
+def die(msg):
+    """Prints msg and the usage to stderr and exits"""
+    print(_USAGE, file=sys.stderr)
+    print("{}: error: {}".format(_PROGRAM_NAME, msg), file=sys.stderr)
+    exit(2)
+
+
+def expand_args(args):
+    """Returns args with every "@FILE" replaced by the non empty lines of
+    FILE, "@-" reads stdin.
+    """
+    expanded = []
+    for arg in args:
+        if not arg.startswith("@") or len(arg) == 1:
+            expanded.append(arg)
+            continue
+        fn = arg[1:]
+        try:
+            if fn == "-":
+                lines = sys.stdin.read().splitlines()
+            else:
+                with open(fn) as f:
+                    lines = f.read().splitlines()
+        except OSError as error:
+            die('unable to read "{}": {}'.format(fn, error))
+        expanded.extend(line.strip() for line in lines if line.strip())
+    return expanded
+
+
+def run(command, args):
+    """Runs the module of command as if it was started with args"""
+    module = COMMANDS[command][0]
+    sys.argv = [module] + args
+    runpy.run_module(module, run_name="__main__", alter_sys=True)
+
+
+def main():
+    """runs the program"""
+    args = sys.argv[1:]
+    if not args or args[0] in ("-h", "--help"):
+        usage(sys.stdout if args else sys.stderr)
+        exit(0 if args else 2)
+    command = args[0]
+    if command not in COMMANDS:
+        die(
+            "invalid command '{}' (choose from {})".format(
+                command, ", ".join(COMMANDS)
+            )
+        )
+    run(command, expand_args(args[1:]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+"""imgcache keeps the images converted by mkobtzep by the contents of their
+source, so that an image is only encoded again when its source changes.
+
+The cache lives in the directory ".bmpcache" next to the images. A converted
+image is stored under a hash of the bytes of the source and of the output
+settings. An output is served from the cache by copying it, hence identical
+sources, e.g. the same picture in several conditions, are encoded once. The
+outputs aren't hardlinks to the cache, so editing one can't change the
+cached image.
+
+Every use of a cached image updates its modification time, prune() removes
+the images that haven't been used for a while.
+"""
+
+import os
+import os.path
+import time
+import shutil
+import hashlib
+import filecmp
+
+from typing import Tuple
+
+import instrument
+
+CACHE_DIR = ".bmpcache"
+
+# Change the settings when the way images are converted changes, that
+# invalidates all cached images.
+SETTINGS = "format=BMP;version=1"
+
+_HASH_BLOCKSIZE = 1 << 20
+
+
+def image_key(fn: str, settings: str = SETTINGS) -> str:
+    """Returns a hexadecimal hash of the contents of fn and settings"""
+    digest = hashlib.sha1(settings.encode("utf8") + b"\0")
+    with instrument.timed("imgcache.hash"), open(fn, "rb") as f:
+        while block := f.read(_HASH_BLOCKSIZE):
+            digest.update(block)
+            instrument.count("imgcache.bytes_read", len(block))
+    return digest.hexdigest()
+
+
+def copy(src: str, dst: str) -> int:
+    """Copies src to dst via a temporary file, so dst is never left
+    incomplete, and returns the number of bytes written.
+    """
+    tempname = "{}.{}.tmp".format(dst, os.getpid())
+    shutil.copyfile(src, tempname)
+    os.replace(tempname, dst)
+    return os.path.getsize(dst)
+
+
+def place(cachefile: str, outfile: str) -> int:
+    """Copies cachefile to outfile and returns the number of bytes written"""
+    with instrument.timed("imgcache.place"):
+        written = copy(cachefile, outfile)
+    instrument.count("imgcache.placed")
+    return written
+
+
+class ImageCache:
+    """The cache of the converted images of one image directory"""
+
+    def __init__(self, dirname: str, suffix: str, settings: str = SETTINGS):
+        self.dirname = os.path.join(dirname, CACHE_DIR)
+        self.suffix = suffix
+        self.settings = settings
+        self.hits = 0
+        self.misses = 0
+        self.adopted = 0
+        self.bytes_written = 0
+
+    def path(self, infile: str) -> str:
+        """Returns the name of the cached conversion of infile"""
+        os.makedirs(self.dirname, exist_ok=True)
+        return os.path.join(
+            self.dirname, image_key(infile, self.settings) + self.suffix
+        )
+
+    @staticmethod
+    def contains(cachefile: str) -> bool:
+        """Returns whether cachefile has been converted before"""
+        return os.path.exists(cachefile)
+
+    def hit(self, cachefile: str):
+        """Counts a hit of cachefile and marks it as used, see prune()"""
+        self.hits += 1
+        try:
+            os.utime(cachefile)
+        except OSError:
+            pass
+
+    def adopt(self, outfile: str, cachefile: str):
+        """Stores an existing output, that is known to be the conversion of
+        the source of cachefile, in the cache instead of converting it again.
+        """
+        self.adopted += 1
+        self.bytes_written += copy(outfile, cachefile)
+        instrument.count("imgcache.adopted")
+
+    def prune(self, max_age: float) -> Tuple[int, int]:
+        """Removes the cached images that haven't been used for max_age
+        seconds and returns the number of files and bytes removed.
+        """
+        limit = time.time() - max_age
+        files = size = 0
+        try:
+            entries = list(os.scandir(self.dirname))
+        except FileNotFoundError:
+            return 0, 0
+        for entry in entries:
+            try:
+                stat = entry.stat()
+                if entry.is_file() and stat.st_mtime < limit:
+                    os.remove(entry.path)
+                    files += 1
+                    size += stat.st_size
+            except OSError:
+                continue
+        instrument.count("imgcache.pruned", files)
+        return files, size
+
+    @staticmethod
+    def is_current(cachefile: str, outfile: str) -> bool:
+        """Returns whether outfile is identical to cachefile"""
+        try:
+            return os.path.samefile(cachefile, outfile) or filecmp.cmp(
+                cachefile, outfile, shallow=False
+            )
+        except OSError:
+            return False
+
+    def summary(self) -> str:
+        """Returns a line with the statistics of this cache"""
+        text = "image cache: {} hits, {} misses ({} adopted), {:,} bytes written"
+        return text.format(self.hits, self.misses, self.adopted, self.bytes_written)
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+
+"""infocache stores parsed EyeFileInfo's in a sqlite database next to the
+data files, so that unchanged files don't have to be parsed again.
+
+An entry is keyed by the name of the file in its directory and is valid as
+long as the size and modification time of the file, and optionally a hash
+of its contents, are unchanged. Whether the hash is checked is decided per
+lookup, so one cache serves callers with and without use_hash alike. Next
+to the info, an entry holds the number of trials of the file once
+trial_count() has counted them.
+"""
+
+import os
+import os.path
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from typing import Dict, Optional
+
+import ascfile
+import edfinfo
+import edfreader
+import instrument
+import trialindex
+
+CACHE_NAME = ".edfinfo-cache.sqlite"
+
+# The maximum number of entries in one cache, the least recently used
+# entries are removed when there are more.
+MAX_ENTRIES = 10000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS info (
+    name    TEXT PRIMARY KEY,
+    size    INTEGER NOT NULL,
+    mtime   INTEGER NOT NULL,
+    hash    TEXT,
+    deep    INTEGER NOT NULL,
+    info    TEXT NOT NULL,
+    used    REAL NOT NULL,
+    trials  INTEGER
+)
+"""
+
+_HASH_BLOCKSIZE = 1 << 20
+
+
+def file_hash(fn: str) -> str:
+    """Returns a hexadecimal hash of the contents of fn"""
+    digest = hashlib.sha1()
+    with open(fn, "rb") as f:
+        while block := f.read(_HASH_BLOCKSIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class InfoCache:
+    """The cache of the EyeFileInfo's of the files in one directory"""
+
+    def __init__(self, dirname: str, max_entries: int = MAX_ENTRIES):
+        self.dirname = dirname
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            os.path.join(dirname, CACHE_NAME), check_same_thread=False
+        )
+        with self._db:
+            self._db.execute(_SCHEMA)
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(info)")]
+            # A cache written before the trial counts were added
+            if "trials" not in columns:
+                self._db.execute("ALTER TABLE info ADD COLUMN trials INTEGER")
+
+    def _key(self, fn: str):
+        """Returns the name, size and mtime of fn"""
+        stat = os.stat(fn)
+        return os.path.basename(fn), stat.st_size, stat.st_mtime_ns
+
+    def _valid_row(self, fn: str, columns: str, use_hash: bool):
+        """Returns the columns of the entry of fn, or None when there is
+        no entry or fn has changed since.
+        """
+        name, size, mtime = self._key(fn)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT size, mtime, hash, {} FROM info WHERE name = ?".format(columns),
+                (name,),
+            ).fetchone()
+        if not row:
+            return None
+        cached_size, cached_mtime, cached_hash = row[:3]
+        if (cached_size, cached_mtime) != (size, mtime):
+            return None
+        if use_hash and cached_hash != file_hash(fn):
+            return None
+        return row[3:]
+
+    def get(
+        self, fn: str, deep: bool = True, use_hash: bool = False
+    ) -> Optional[edfinfo.EyeFileInfo]:
+        """Returns the cached info of fn or None when it isn't cached or
+        when fn has changed since.
+
+        @deep when True an incomplete info is only returned when it was
+              obtained by a deep parse as well.
+        @use_hash when True the contents of fn must also match the hash
+                  stored with the entry, an entry without hash is stale.
+        """
+        row = self._valid_row(fn, "deep, info", use_hash)
+        if not row:
+            return None
+
+        name = os.path.basename(fn)
+        cached_deep, text = row
+
+        info = edfinfo.EyeFileInfo()
+        vars(info).update(json.loads(text))
+        if deep and not cached_deep and not info.is_complete():
+            return None
+
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE info SET used = ? WHERE name = ?", (time.time(), name)
+            )
+        return info
+
+    def put(
+        self,
+        fn: str,
+        info: edfinfo.EyeFileInfo,
+        deep: bool = True,
+        use_hash: bool = False,
+    ):
+        """Stores the info of fn in the cache, with use_hash together with
+        a hash of the contents of fn.
+        """
+        name, size, mtime = self._key(fn)
+        digest = file_hash(fn) if use_hash else None
+        with self._lock, self._db:
+            # The trial count stays valid as long as the file is unchanged
+            self._db.execute(
+                "INSERT INTO info (name, size, mtime, hash, deep, info, used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(name) DO UPDATE SET "
+                "trials = CASE WHEN size = excluded.size AND mtime = excluded.mtime "
+                "THEN trials END, size = excluded.size, mtime = excluded.mtime, "
+                "hash = excluded.hash, deep = excluded.deep, info = excluded.info, "
+                "used = excluded.used",
+                (name, size, mtime, digest, deep, json.dumps(vars(info)), time.time()),
+            )
+            self._db.execute(
+                "DELETE FROM info WHERE name NOT IN "
+                "(SELECT name FROM info ORDER BY used DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+    def get_trials(self, fn: str, use_hash: bool = False) -> Optional[int]:
+        """Returns the cached number of trials of fn or None, see get()"""
+        row = self._valid_row(fn, "trials", use_hash)
+        return row[0] if row else None
+
+    def put_trials(self, fn: str, trials: int):
+        """Stores the number of trials of fn with its entry, if it has one"""
+        name, size, mtime = self._key(fn)
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE info SET trials = ? WHERE name = ? AND size = ? AND mtime = ?",
+                (trials, name, size, mtime),
+            )
+
+    def invalidate(self, fn: Optional[str] = None):
+        """Removes the entry of fn, or all entries when fn is None"""
+        with self._lock, self._db:
+            if fn is None:
+                self._db.execute("DELETE FROM info")
+            else:
+                self._db.execute(
+                    "DELETE FROM info WHERE name = ?", (os.path.basename(fn),)
+                )
+
+    def close(self):
+        """Closes the underlying database"""
+        self._db.close()
+
+
+_caches: Dict[str, Optional[InfoCache]] = {}
+_caches_lock = threading.Lock()
+
+
+def open_cache(fn: str) -> Optional[InfoCache]:
+    """Returns the cache of the directory of fn, or None when the cache
+    cannot be used, e.g. because the directory is read only.
+    """
+    dirname = os.path.dirname(os.path.abspath(fn))
+    with _caches_lock:
+        if dirname not in _caches:
+            try:
+                _caches[dirname] = InfoCache(dirname)
+            except (sqlite3.Error, OSError):
+                _caches[dirname] = None
+        return _caches[dirname]
+
+
+def cached(
+    fn: str, deep: bool = True, use_hash: bool = False
+) -> Optional[edfinfo.EyeFileInfo]:
+    """Returns the cached info of fn without parsing fn, or None when there
+    is none. See InfoCache.get() for the meaning of deep.
+    """
+    cache = open_cache(fn)
+    if cache:
+        try:
+            if info := cache.get(fn, deep, use_hash):
+                instrument.count("infocache.hits")
+                return info
+        except sqlite3.Error:
+            pass
+    return None
+
+
+def parse_file(
+    fn: str, deep: bool = True, use_cache: bool = True, use_hash: bool = False
+) -> edfinfo.EyeFileInfo:
+    """Returns the EyeFileInfo of fn, from the cache when possible.
+    See EyeFileInfo.parse_file for the meaning of deep.
+    """
+    cache = open_cache(fn) if use_cache else None
+    if cache:
+        try:
+            if info := cache.get(fn, deep, use_hash):
+                instrument.count("infocache.hits")
+                return info
+        except sqlite3.Error:
+            cache = None
+
+    if cache:
+        instrument.count("infocache.misses")
+    info = edfinfo.EyeFileInfo()
+    info.parse_file(fn, deep)
+
+    if cache:
+        store(fn, info, deep, use_hash)
+    return info
+
+
+def store(
+    fn: str, info: edfinfo.EyeFileInfo, deep: bool = True, use_hash: bool = False
+):
+    """Stores the info of fn in its cache, failures are ignored since the
+    cache is only an optimization.
+    """
+    cache = open_cache(fn)
+    if cache:
+        try:
+            cache.put(fn, info, deep, use_hash)
+        except (sqlite3.Error, OSError):
+            pass
+
+
+def trial_count(
+    fn: str, use_cache: bool = True, use_hash: bool = False
+) -> Optional[int]:
+    """Returns the number of trials of fn, from the cache when possible, or
+    None when they can't be read. The count is only cached for files whose
+    info is cached, and no trialindex is saved next to fn.
+    """
+    cache = open_cache(fn) if use_cache else None
+    if cache:
+        try:
+            trials = cache.get_trials(fn, use_hash)
+            if trials is not None:
+                return trials
+        except sqlite3.Error:
+            cache = None
+    try:
+        trials = len(trialindex.trials_of(fn, save=False))
+    except (edfreader.NotAnEdfFile,) + ascfile.READ_ERRORS:
+        return None
+    if cache:
+        try:
+            cache.put_trials(fn, trials)
+        except (sqlite3.Error, OSError):
+            pass
+    return trials
+
+
+def clear(fn: str):
+    """Removes all entries from the cache of the directory of fn"""
+    cache = open_cache(fn)
+    if cache:
+        cache.invalidate()
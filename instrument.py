@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+"""instrument records where the time of a run goes.
+
+The tools mark their stages, e.g. running edf2asc, parsing the preamble or
+encoding an image, and count what they process, e.g. bytes read or cache
+hits:
+
+    with instrument.timed("edfinfo.preamble"):
+        ...
+    instrument.count("edfinfo.lines", len(lines))
+
+Nothing is recorded until enable() is called; until then timed() returns
+a shared no-op context manager and count() returns right away, so the
+marks cost next to nothing in a normal run. A stage records the number of
+calls and the summed wall time; stages that run in several threads or
+worker processes at once may sum to more than the wall time of the run.
+A worker process records what it does with remote(), the parent adds it
+to its own records with merge().
+
+report() prints a table of the stages and counters, write_trace() writes
+them as JSON together with every timed call in the Chrome trace event
+format, which chrome://tracing and https://ui.perfetto.dev display as a
+timeline per process and thread.
+"""
+
+import os
+import sys
+import time
+import atexit
+import threading
+import contextlib
+
+from typing import Dict, List, Optional
+
+_PROGRAM_NAME = "instrument"
+
+ENABLED = False
+
+_NULL = contextlib.nullcontext()
+_lock = threading.Lock()
+_start = time.perf_counter()
+# name -> [calls, seconds]
+_stages: Dict[str, List] = {}
+_counters: Dict[str, int] = {}
+# The timed calls, only kept when a trace is written
+_events: Optional[List[dict]] = None
+# The number of snapshots of other processes that have been merged
+_merged = 0
+
+
+class _Timer:
+    """Times one call of a stage"""
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        elapsed = end - self.start
+        with _lock:
+            stage = _stages.get(self.name)
+            if stage is None:
+                _stages[self.name] = [1, elapsed]
+            else:
+                stage[0] += 1
+                stage[1] += elapsed
+            if _events is not None:
+                _events.append(
+                    {
+                        "name": self.name,
+                        "ph": "X",
+                        "ts": (self.start - _start) * 1e6,
+                        "dur": elapsed * 1e6,
+                        "pid": os.getpid(),
+                        "tid": threading.get_ident(),
+                    }
+                )
+        return False
+
+
+def timed(name: str):
+    """Returns a context manager that adds its duration to stage name"""
+    if not ENABLED:
+        return _NULL
+    return _Timer(name)
+
+
+def count(name: str, value: int = 1):
+    """Adds value to the counter name"""
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def enable(trace: bool = False):
+    """Starts recording, with trace every timed call is kept as well"""
+    global ENABLED, _events
+    with _lock:
+        ENABLED = True
+        if trace and _events is None:
+            _events = []
+
+
+def snapshot() -> dict:
+    """Returns what has been recorded so far"""
+    with _lock:
+        return {
+            "stages": {
+                name: {"calls": calls, "seconds": seconds}
+                for name, (calls, seconds) in _stages.items()
+            },
+            "counters": dict(_counters),
+            "events": list(_events) if _events is not None else [],
+        }
+
+
+def merge(recorded: dict):
+    """Adds a snapshot, e.g. of a worker process, to the own records"""
+    global _merged
+    with _lock:
+        _merged += 1
+        for name, stage in recorded["stages"].items():
+            calls, seconds = _stages.get(name, (0, 0.0))
+            _stages[name] = [calls + stage["calls"], seconds + stage["seconds"]]
+        for name, value in recorded["counters"].items():
+            _counters[name] = _counters.get(name, 0) + value
+        if _events is not None:
+            _events.extend(recorded["events"])
+
+
+def _reset(trace: bool):
+    """Forgets what was recorded, e.g. what a forked worker inherited"""
+    global _events
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+        _events = [] if trace else None
+
+
+def remote(func, trace, *args):
+    """Runs func(*args) in a worker process with recording enabled and
+    returns its result and a snapshot to merge() in the parent. When func
+    raises, the snapshot is attached to the exception as its "recorded"
+    attribute.
+    """
+    _reset(trace)
+    enable(trace)
+    try:
+        result = func(*args)
+    except Exception as error:
+        error.recorded = snapshot()
+        raise
+    return result, snapshot()
+
+
+def tracing() -> bool:
+    """Returns whether timed calls are kept for a trace"""
+    return _events is not None
+
+
+def report(out=sys.stderr):
+    """Prints the stages and counters to out"""
+    recorded = snapshot()
+    wall = time.perf_counter() - _start
+    print("{:<28}{:>8}{:>12}{:>8}".format("stage", "calls", "seconds", "%"), file=out)
+    stages = sorted(recorded["stages"].items(), key=lambda item: -item[1]["seconds"])
+    for name, stage in stages:
+        print(
+            "{:<28}{:>8}{:>12.3f}{:>8.1f}".format(
+                name, stage["calls"], stage["seconds"], 100 * stage["seconds"] / wall
+            ),
+            file=out,
+        )
+    print("{:<28}{:>8}{:>12.3f}".format("wall time", "", wall), file=out)
+    if _merged:
+        print(
+            "The stages include {} tasks of worker processes, whose seconds are"
+            " summed\nover the workers.".format(_merged),
+            file=out,
+        )
+    if recorded["counters"]:
+        print("{:<28}{:>20}".format("counter", "value"), file=out)
+        for name, value in sorted(recorded["counters"].items()):
+            print("{:<28}{:>20,}".format(name, value), file=out)
+
+
+def write_trace(fn: str):
+    """Writes the stages, counters and timed calls as JSON to fn"""
+    import json
+
+    recorded = snapshot()
+    trace = {
+        "traceEvents": recorded.pop("events"),
+        "displayTimeUnit": "ms",
+        "wall_seconds": time.perf_counter() - _start,
+    }
+    trace.update(recorded)
+    with open(fn, "w") as f:
+        json.dump(trace, f, indent=1)
+
+
+def setup(profile: bool = False, trace: Optional[str] = None):
+    """Enables recording for a command line run when profile or trace is
+    given, the report is printed to stderr and/or the trace is written to
+    the file trace when the program exits.
+    """
+    if not (profile or trace):
+        return
+    enable(trace=bool(trace))
+    if profile:
+        atexit.register(report)
+    if trace:
+        atexit.register(write_trace, trace)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+"""manifest keeps track of the outputs that have been created from which
+inputs, much like make does, but based on the contents of the files rather
+than on their timestamps alone.
+
+For every output it records the input it was made from, a hash of the
+input and of the output and the version of the converter. An output is
+up to date as long as none of these have changed. An output that exists
+but isn't in the manifest, e.g. because it was made before there was a
+manifest, is stale, since it may be partial or made from an older input.
+Only when the manifest is created with adopt=True, such an output is
+taken as up to date and recorded with the current input.
+
+The manifest is saved at most every SAVE_INTERVAL seconds while outputs
+are recorded and by save(), which its user calls when it's done.
+"""
+
+import os
+import os.path
+import json
+import time
+import threading
+
+from typing import Dict
+
+from infocache import file_hash
+
+MANIFEST_NAME = ".mkasczep-manifest.json"
+_FORMAT_VERSION = 1
+
+# The minimum number of seconds between two saves by record()
+SAVE_INTERVAL = 5.0
+
+
+def _stat(fn: str):
+    """Returns the size and mtime of fn"""
+    stat = os.stat(fn)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class Manifest:
+    """The manifest of the outputs in one directory"""
+
+    def __init__(
+        self, fn: str = MANIFEST_NAME, converter: str = "", adopt: bool = False
+    ):
+        """
+        @fn the file in which the manifest is stored
+        @converter the version of the program that creates the outputs
+        @adopt whether an existing output without entry is up to date
+        """
+        self.fn = fn
+        self.converter = converter
+        self.adopt = adopt
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict] = {}
+        self._dirty = False
+        self._saved = time.monotonic()
+        try:
+            with open(fn) as f:
+                data = json.load(f)
+            if data.get("format") == _FORMAT_VERSION:
+                self._entries = data["outputs"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _unchanged(self, fn: str, entry: Dict, prefix: str) -> bool:
+        """Returns whether fn still matches the size, mtime and hash
+        recorded with prefix in entry.
+        """
+        size, mtime = _stat(fn)
+        if (size, mtime) == (entry[prefix + "size"], entry[prefix + "mtime"]):
+            return True
+        if size != entry[prefix + "size"] or file_hash(fn) != entry[prefix + "hash"]:
+            return False
+        # Only touched, remember the new mtime to avoid hashing it again.
+        with self._lock:
+            entry[prefix + "mtime"] = mtime
+        return True
+
+    def is_current(self, output: str, inputfn: str) -> bool:
+        """Returns whether output exists and is up to date with respect to
+        inputfn. When output was created from an other input, that is
+        up to date as long as the output is unchanged. An output without
+        entry is only up to date, and then recorded, with adopt.
+        """
+        with self._lock:
+            entry = self._entries.get(os.path.normpath(output))
+        if not os.path.exists(output):
+            return False
+        if not entry:
+            if not self.adopt:
+                return False
+            self.record(output, inputfn)
+            return True
+        if not self._unchanged(output, entry, "output_"):
+            return False
+        if entry["input"] != os.path.normpath(inputfn):
+            return True
+        return entry["converter"] == self.converter and self._unchanged(
+            inputfn, entry, "input_"
+        )
+
+    def record(self, output: str, inputfn: str):
+        """Records that output has been created from inputfn, the manifest
+        is saved when the last save is SAVE_INTERVAL seconds ago.
+        """
+        input_size, input_mtime = _stat(inputfn)
+        output_size, output_mtime = _stat(output)
+        entry = {
+            "input": os.path.normpath(inputfn),
+            "input_size": input_size,
+            "input_mtime": input_mtime,
+            "input_hash": file_hash(inputfn),
+            "converter": self.converter,
+            "output_size": output_size,
+            "output_mtime": output_mtime,
+            "output_hash": file_hash(output),
+        }
+        with self._lock:
+            self._entries[os.path.normpath(output)] = entry
+            self._dirty = True
+            if time.monotonic() - self._saved >= SAVE_INTERVAL:
+                self._save()
+
+    def save(self):
+        """Saves the manifest when outputs have been recorded since the
+        last save.
+        """
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def _save(self):
+        """Writes the manifest atomically, so an interrupted run leaves the
+        previous or the new manifest behind, never a partial one.
+        """
+        tempname = "{}.{}.tmp".format(self.fn, os.getpid())
+        with open(tempname, "w") as f:
+            json.dump(
+                {"format": _FORMAT_VERSION, "outputs": self._entries},
+                f,
+                indent=1,
+                sort_keys=True,
+            )
+        os.replace(tempname, self.fn)
+        self._dirty = False
+        self._saved = time.monotonic()
@@ -2,28 +2,116 @@
 """A small program to convert Eyelink edf files to Eyelink asc files"""
 
 import sys
+import io
 import re
-import shutil
 import os
 import os.path
 import pathlib
+import subprocess
+import threading
+import queue
+import time
 import argparse as ap
-import edfinfo
+import concurrent.futures as cf
+import functools
+import ascfile
+import instrument
 
 _EDF2ASC = "edf2asc"
 _EDFINFO = "edfinfo"
-EDF2ASC = shutil.which(_EDF2ASC)
 
 # regular expressions to handle file type
 FTYPE1 = re.compile(r"^((\w+)(-\w+)?)\.(\w+)\.(\d+)\.(\d+)\.edf$")
 FTYPE2 = re.compile(r"^(\d+)\_(\d+)\_(\d+)\.edf$")
 
 SKIPFILE_MSG = 'Skipping "{}", because it\'s output "{}" exists.'
+# The name of the temporary output of an edf file in the current directory,
+# unique per process and worker thread
+TEMP_FMT = ".{}.{}.{}.tmp.asc"
+UPTODATE_MSG = 'Skipping "{}", because it\'s output "{}" is up to date.'
+RE_EDF2ASC_VERSION = re.compile(r"version\s*:?\s*(\d[\w.]*)", re.IGNORECASE)
 
 PROGNAME = os.path.basename(sys.argv[0])
 PROGDESC = "translate .edf files to their ascii counterpart."
 
 VERBOSE = False
+USE_CACHE = True
+SIDECARS = False
+# The compression of the output .asc files, see ascfile
+COMPRESS = None
+# Whether existing outputs that aren't in the manifest are up to date
+ADOPT = False
+# The edf2asc processes at once and the seconds after which one is given
+# up, see runner(). TIMEOUT mirrors edfrunner.TIMEOUT, which isn't imported
+# for --help.
+CONCURRENCY = 1
+TIMEOUT = 300.0
+# The edfrunner.Runner that runs edf2asc, see runner()
+RUNNER = None
+_RUNNER_LOCK = threading.Lock()
+
+# The defaults of the watch mode
+WATCH_INTERVAL = 2.0
+QUEUE_SIZE = 64
+# The seconds a file must be unmodified before it's considered complete
+SETTLE_TIME = 2.0
+
+
+class ConversionError(Exception):
+    """Raised when a single edf file could not be converted"""
+
+
+class OutputClaims:
+    """Hands out the output files of a batch in the order of the input
+    files. When several input files result in the same output file, the
+    first one is converted and the others are skipped, just like in a
+    serial run, regardless of which worker gets there first.
+    """
+
+    def __init__(self, count):
+        self._named = [threading.Event() for _ in range(count)]
+        self._claimed = set()
+        self._lock = threading.Lock()
+
+    def claim(self, index, fnasc):
+        """Returns True when input file index may produce fnasc"""
+        for event in self._named[:index]:
+            event.wait()
+        with self._lock:
+            taken = str(fnasc) in self._claimed
+            self._claimed.add(str(fnasc))
+        self.release(index)
+        return not taken
+
+    def release(self, index):
+        """Marks that input file index won't claim an output (anymore)"""
+        self._named[index].set()
+
+
+class OutputLocks:
+    """Lets only one worker at a time produce an output file in watch mode,
+    with the same interface as OutputClaims. A worker that claims an output
+    that is being produced waits until the other worker is done, after which
+    the manifest tells whether it still has to be converted.
+    """
+
+    def __init__(self):
+        self._held = {}
+        self._changed = threading.Condition()
+
+    def claim(self, worker, fnasc):
+        """Waits until fnasc is free and holds it for worker, returns True"""
+        with self._changed:
+            while str(fnasc) in self._held.values():
+                self._changed.wait()
+            self._held[worker] = str(fnasc)
+        return True
+
+    def release(self, worker):
+        """Frees the output held by worker, if any"""
+        with self._changed:
+            if self._held.pop(worker, None) is not None:
+                self._changed.notify_all()
 
 
 def die(msg):
@@ -71,16 +159,69 @@ def process_filetype1(filename):
     newname = exppath / "dat" / fnout
     os.rename(filename.newname)
 
-    os.system("edf2asc {}".format(newname))
+    run_edf2asc(str(newname), str(newname.with_suffix(".asc")))
+
 
+def runner():
+    """Returns the edfrunner.Runner that runs edf2asc, it's created at the
+    first use, so the asyncio that edfrunner loads isn't imported for --help.
+    """
+    global RUNNER
+    with _RUNNER_LOCK:
+        if RUNNER is None:
+            import edfrunner
 
-def process_filetype2(filename):
-    """Processes filetype2"""
-    raw_asc_fn = os.path.splitext(filename)[0] + ".asc"
+            RUNNER = edfrunner.Runner(CONCURRENCY, TIMEOUT)
+        return RUNNER
 
-    info = edfinfo.EyeFileInfo()
-    info.parse_file(filename)
 
+@functools.lru_cache(maxsize=None)
+def edf2asc_version():
+    """Returns the version of edf2asc as it reports it in its usage
+    message, or "unknown".
+    """
+    import edfrunner
+
+    try:
+        proc = subprocess.run(
+            [edfrunner.find_edf2asc()],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+            timeout=10,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+    mobj = RE_EDF2ASC_VERSION.search(proc.stdout)
+    return mobj.group(1) if mobj else "unknown"
+
+
+def run_edf2asc(filename, ascname, out=None):
+    """Runs edf2asc to convert filename into ascname, its output is printed
+    to out
+
+    Raises ConversionError when edf2asc fails or times out.
+    """
+    # edf2asc's output is captured, so that the output of parallel
+    # conversions doesn't get interleaved.
+    #   -y  : overwrite .asc if exists
+    result = runner().convert(filename, ascname, ("-y",))
+    print(result.stdout, end="", file=out)
+    if result.ok:
+        print(result.stderr, end="", file=out)
+    if not result.ok:
+        raise ConversionError(result.error())
+    if not os.path.exists(ascname) or not os.path.getsize(ascname):
+        raise ConversionError(f"{_EDF2ASC} produced no output for {filename}")
+
+
+def asc_name(filename, info):
+    """Returns the name of the output .asc file based on the info of
+    the edf file filename.
+
+    Raises ConversionError when the info doesn't contain a valid participant.
+    """
     # handle case that participant is dummy or pp123 like
     pp_id = "000" if info.participant == "dummy" else info.participant
     pp_id = pp_id[2:] if pp_id[:2].lower() == "pp" else pp_id
@@ -91,36 +232,350 @@ def process_filetype2(filename):
         if len(pp_id) != 3:
             raise ValueError(f'length of "{pp_id}" != 3')
     except ValueError as e:
-        exit(f"{filename} hasn't got a valid participant id: {str(e)}")
+        raise ConversionError(
+            f"{filename} hasn't got a valid participant id: {str(e)}"
+        ) from e
 
-    fnbase = pathlib.Path(
-        "{}_{}{}_{}".format(info.experiment, info.list, info.recording, pp_id)
-    )
-    fnasc = fnbase.with_suffix(".asc")
-    if fnasc.exists():
-        if VERBOSE:
-            print(SKIPFILE_MSG.format(filename, fnasc))
+    fnbase = "{}_{}{}_{}".format(info.experiment, info.list, info.recording, pp_id)
+    return pathlib.Path(ascfile.compressed_name(fnbase + ascfile.ASC, COMPRESS))
+
+
+def existing_output(fnasc, filename=None, builds=None):
+    """Returns the name of an existing output, fnasc or one of its other
+    compressions, or None when there's none.
+
+    @builds a manifest.Manifest, when given only an output that is up to
+            date with filename counts.
+    """
+    names = [str(fnasc)]
+    names += [name for name in ascfile.variants(str(fnasc)) if name != names[0]]
+    for name in names:
+        if builds is None and os.path.exists(name):
+            return name
+        if builds is not None and builds.is_current(name, filename):
+            return name
+    return None
+
+
+def write_sidecar(fnasc, info, out=None, only_stale=False):
+    """Writes the columnar sidecar of fnasc, see ascstore
+
+    @only_stale when True the sidecar is only written when it's missing
+                or older than fnasc.
+    """
+    # Imported here, since ascstore depends on NumPy which is only needed
+    # when sidecars are requested.
+    import ascstore
+
+    if only_stale and ascstore.is_current(str(fnasc)):
         return
+    print('writing "{}".'.format(ascstore.sidecar_name(str(fnasc))), file=out)
+    with instrument.timed("mkasczep.sidecar"):
+        ascstore.write(str(fnasc), info)
+
 
-    os.system("edf2asc {}".format(filename))
+def compress_output(tempname, fnasc):
+    """Compresses the converted file tempname into fnasc"""
+    packed = ascfile.temp_name(fnasc)
+    try:
+        ascfile.compress(tempname, packed)
+        os.replace(packed, fnasc)
+    finally:
+        if os.path.exists(packed):
+            os.unlink(packed)
+
+
+def process_filetype2(filename, out=None, claim=None, builds=None):
+    """Processes filetype2
 
-    print('renaming "{}" to "{}".'.format(raw_asc_fn, fnasc))
-    os.rename(str(raw_asc_fn), str(fnasc))
+    @filename the edf file to convert
+    @out a file like object to which progress is printed, defaults to stdout
+    @claim a callable that returns whether this file may produce the
+           output file it is given, rather than an earlier file of the
+           batch.
+    @builds a manifest.Manifest, when given an existing output is only
+            skipped when it is up to date according to the manifest.
 
+    The conversion is written to a temporary file that is renamed to
+    the output when it is complete, so an interrupted run never leaves a
+    partial output behind.
 
-def process_files(fnlist):
-    """Converts all relevant edf files to there matching ascii versions"""
-    for filename in fnlist:
+    Raises ConversionError when the file cannot be converted.
+    """
+    import infocache
+
+    with instrument.timed("mkasczep.info"):
+        # A cached info that is complete or has been read from all MSG's
+        # already, e.g. of a file that never named its participant.
+        info = infocache.cached(filename) if USE_CACHE else None
+        searched = info is not None
+        if info is None:
+            info = infocache.parse_file(filename, deep=False, use_cache=USE_CACHE)
+
+    # Zep-2 stores part of the info in MSG's, these are read from the edf
+    # file directly. If that didn't work, the info is read from the
+    # converted file, instead of running edf2asc once to obtain the info
+    # and once more for the real conversion.
+    tempname = TEMP_FMT.format(
+        os.path.basename(filename), os.getpid(), threading.get_ident()
+    )
+    converted = False
+    try:
+        if not (searched or info.is_complete()):
+            run_edf2asc(filename, tempname, out)
+            converted = True
+            with instrument.timed("mkasczep.info"):
+                info.parse_asc_messages(tempname)
+            if USE_CACHE:
+                infocache.store(filename, info)
+
+        fnasc = asc_name(filename, info)
+        if claim and not claim(fnasc):
+            instrument.count("mkasczep.skipped")
+            if VERBOSE:
+                print(SKIPFILE_MSG.format(filename, fnasc), file=out)
+            return
+        existing = existing_output(fnasc, filename, builds)
+        if builds is None and existing:
+            instrument.count("mkasczep.skipped")
+            if VERBOSE:
+                print(SKIPFILE_MSG.format(filename, existing), file=out)
+            return
+        if existing:
+            instrument.count("mkasczep.skipped")
+            if VERBOSE:
+                print(UPTODATE_MSG.format(filename, existing), file=out)
+            if SIDECARS:
+                write_sidecar(existing, info, out, only_stale=True)
+            return
+
+        if not converted:
+            run_edf2asc(filename, tempname, out)
+
+        print('writing "{}" to "{}".'.format(filename, fnasc), file=out)
+        if COMPRESS:
+            with instrument.timed("mkasczep.compress"):
+                compress_output(tempname, str(fnasc))
+        else:
+            os.replace(tempname, str(fnasc))
+        instrument.count("mkasczep.converted")
+        if instrument.ENABLED:
+            instrument.count("mkasczep.bytes_written", os.path.getsize(str(fnasc)))
+        if builds is not None:
+            builds.record(str(fnasc), filename)
+        if SIDECARS:
+            write_sidecar(fnasc, info, out)
+    finally:
+        # Don't leave the raw output behind for skipped or invalid files.
+        if os.path.exists(tempname):
+            os.unlink(tempname)
+
+
+def process_file(filename, index=0, claims=None, builds=None):
+    """Converts one file and returns a tuple (output, error) with the
+    text that should be printed for this file and an error message or None
+    when the conversion succeeded.
+
+    @index the position of filename in the batch, or the worker in watch
+           mode
+    @claims the OutputClaims of the batch or the OutputLocks of the watcher
+    @builds the manifest.Manifest of the batch
+    """
+    out = io.StringIO()
+    claim = functools.partial(claims.claim, index) if claims else None
+    try:
         if FTYPE2.match(filename):
-            process_filetype2(filename)
+            process_filetype2(filename, out, claim, builds)
         elif FTYPE1.match(filename):  # Probably not longer used.
             process_filetype1(filename)
         else:
-            print('Skipping "{}": unknown filetype.'.format(filename))
+            print('Skipping "{}": unknown filetype.'.format(filename), file=out)
+    except (ConversionError,) + ascfile.READ_ERRORS as error:
+        return out.getvalue(), str(error)
+    finally:
+        if claims:
+            claims.release(index)
+    return out.getvalue(), None
+
+
+def process_files(fnlist, jobs=1):
+    """Converts all relevant edf files to there matching ascii versions
+
+    @fnlist the files to convert
+    @jobs the number of files that are converted in parallel
+
+    The output of every file is reported in the order of fnlist, regardless
+    of the order in which the conversions finish.
+
+    Returns the number of files that failed to convert.
+    """
+    import manifest
+
+    builds = manifest.Manifest(converter=edf2asc_version(), adopt=ADOPT)
+    work = functools.partial(
+        process_file, claims=OutputClaims(len(fnlist)), builds=builds
+    )
+    if jobs > 1:
+        executor = cf.ThreadPoolExecutor(max_workers=jobs)
+        results = executor.map(work, fnlist, range(len(fnlist)))
+    else:
+        executor = None
+        results = map(work, fnlist, range(len(fnlist)))
+
+    failures = 0
+    try:
+        for output, error in results:
+            print(output, end="")
+            if error:
+                failures += 1
+                print(error, file=sys.stderr)
+    finally:
+        if executor:
+            executor.shutdown()
+        builds.save()
+    return failures
+
+
+def index_output(filename):
+    """Builds the trial index of the output of filename, if it has one"""
+    import infocache
+    import trialindex
+
+    info = infocache.parse_file(filename, deep=False, use_cache=USE_CACHE)
+    try:
+        fnasc = asc_name(filename, info)
+    except ConversionError:
+        return
+    existing = existing_output(fnasc)
+    if existing:
+        trialindex.load(existing)
+
+
+class Watcher:
+    """Watches the working directory for new or changed edf files and
+    converts them on a pool of worker threads.
+
+    The directory is polled; a file is converted once its size and
+    modification time are the same in two successive polls and it hasn't
+    been modified for SETTLE_TIME seconds, so files that are still being
+    copied are left alone. The files ready for conversion
+    are put in a bounded queue; when it's full they are picked up by a later
+    poll. A file is queued again only when it changes, and the manifest
+    skips outputs that are up to date, also after a restart.
+    """
+
+    def __init__(self, jobs=1, interval=WATCH_INTERVAL, queue_size=QUEUE_SIZE):
+        self.jobs = jobs
+        self.interval = interval
+        import manifest
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.builds = manifest.Manifest(converter=edf2asc_version(), adopt=ADOPT)
+        self.outputs = OutputLocks()
+        # The (size, mtime) of every file at the last poll, and of the
+        # version that was queued.
+        self.polled = {}
+        self.queued = {}
+        self.lock = threading.Lock()
+        self.converted = 0
+        self.failed = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+
+    def poll(self):
+        """Queues the files that are stable and haven't been queued yet"""
+        polled = {}
+        settled = time.time_ns() - int(SETTLE_TIME * 1e9)
+        for fn in sorted(str(i) for i in pathlib.Path(".").glob("*.edf")):
+            try:
+                stat = os.stat(fn)
+            except OSError:
+                continue
+            polled[fn] = stat.st_size, stat.st_mtime_ns
+        for fn, (size, mtime) in polled.items():
+            if (
+                size
+                and mtime <= settled
+                and self.polled.get(fn) == (size, mtime)
+                and self.queued.get(fn) != (size, mtime)
+            ):
+                try:
+                    self.queue.put_nowait(fn)
+                except queue.Full:
+                    break
+                self.queued[fn] = size, mtime
+        self.polled = polled
+
+    def log(self, msg, file=sys.stdout):
+        """Prints msg with a time stamp"""
+        with self.lock:
+            print("[{}] {}".format(time.strftime("%H:%M:%S"), msg), file=file)
+
+    def work(self, worker):
+        """Converts the queued files until None is queued
+
+        @worker the number of this worker thread
+        """
+        while True:
+            fn = self.queue.get()
+            if fn is None:
+                break
+            start = time.monotonic()
+            output, error = process_file(fn, worker, self.outputs, self.builds)
+            if not error:
+                try:
+                    index_output(fn)
+                except OSError as ioerror:
+                    error = str(ioerror)
+            elapsed = time.monotonic() - start
+            with self.lock:
+                print(output, end="")
+                if error:
+                    self.failed += 1
+                else:
+                    self.converted += 1
+                    self.bytes += self.queued[fn][0]
+                rate = self.bytes / max(time.monotonic() - self.started, 1e-9)
+                total = self.converted
+            if error:
+                self.log(error, file=sys.stderr)
+            self.log(
+                'processed "{}" in {:.1f}s, {} files done ({:.1f} MB/s), '
+                "queue depth {}".format(
+                    fn, elapsed, total, rate / 1e6, self.queue.qsize()
+                )
+            )
+
+    def run(self):
+        """Watches until interrupted, returns the number of failures"""
+        workers = [
+            threading.Thread(target=self.work, args=(i,), daemon=True)
+            for i in range(self.jobs)
+        ]
+        for worker in workers:
+            worker.start()
+        self.log(
+            "watching {} for edf files, press Ctrl+C to stop".format(os.getcwd())
+        )
+        try:
+            while True:
+                self.poll()
+                self.builds.save()
+                time.sleep(self.interval)
+        except KeyboardInterrupt:
+            self.log("stopping after the queued files")
+        for _ in workers:
+            self.queue.put(None)
+        for worker in workers:
+            worker.join()
+        self.builds.save()
+        return self.failed
 
 
 def parse_cmd_arguments():
     """Parses the command line arguments"""
+    # TIMEOUT is the default of --timeout as well
+    global CONCURRENCY, TIMEOUT
     aparser = ap.ArgumentParser(PROGNAME, description=PROGDESC)
     aparser.add_argument(
         "edffiles",
@@ -142,24 +597,122 @@ def parse_cmd_arguments():
         action="store_true",
         help="Makes the output a bit more verbose.",
     )
+    aparser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="The number of files to convert in parallel (default 1).",
+    )
+    aparser.add_argument(
+        "--sidecar",
+        action="store_true",
+        help="Also write a columnar binary copy of every .asc, see ascstore.",
+    )
+    aparser.add_argument(
+        "-z",
+        "--compress",
+        choices=sorted(ascfile.COMPRESSIONS),
+        help="Write compressed .asc.gz or .asc.zst files (zst requires the "
+        "zstandard package).",
+    )
+    aparser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Don't use or update the cache of the info of the edf files.",
+    )
+    aparser.add_argument(
+        "--timeout",
+        type=float,
+        default=TIMEOUT,
+        help="The seconds after which a conversion is given up (default {:g}).".format(
+            TIMEOUT
+        ),
+    )
+    aparser.add_argument(
+        "--adopt",
+        action="store_true",
+        help="Take existing .asc files that mkasczep hasn't recorded as its "
+        "outputs yet as up to date, e.g. on the first run in a directory "
+        "that was converted by an older version. By default they are "
+        "converted again.",
+    )
+    aparser.add_argument(
+        "-w",
+        "--watch",
+        action="store_true",
+        help="Keep watching the working directory and convert new or changed "
+        ".edf files as soon as they are complete.",
+    )
+    aparser.add_argument(
+        "--interval",
+        type=float,
+        default=WATCH_INTERVAL,
+        help="The seconds between two scans in watch mode (default {}).".format(
+            WATCH_INTERVAL
+        ),
+    )
+    aparser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print the time spent per stage and the counters to stderr.",
+    )
+    aparser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="Write the stages, counters and a timeline of the run as JSON "
+        "(Chrome trace format) to FILE.",
+    )
     args = aparser.parse_args()
+    if args.jobs < 1:
+        aparser.error("--jobs must be 1 or greater")
+    instrument.setup(args.profile, args.trace)
     files = args.edffiles if args.edffiles else []
     if args.glob:
-        files = [str(i) for i in pathlib.Path(".").glob("*.edf")]
+        files = sorted(str(i) for i in pathlib.Path(".").glob("*.edf"))
     if args.verbose:
         global VERBOSE
         VERBOSE = True
-    return files
+    if args.no_cache:
+        global USE_CACHE
+        USE_CACHE = False
+    if args.adopt:
+        global ADOPT
+        ADOPT = True
+    if args.sidecar:
+        global SIDECARS
+        SIDECARS = True
+    if args.compress:
+        if not ascfile.available(args.compress):
+            aparser.error(
+                "--compress {} requires the zstandard package".format(args.compress)
+            )
+        global COMPRESS
+        COMPRESS = args.compress
+    if args.interval <= 0:
+        aparser.error("--interval must be greater than 0")
+    if args.timeout <= 0:
+        aparser.error("--timeout must be greater than 0")
+    CONCURRENCY = args.jobs
+    TIMEOUT = args.timeout
+    return files, args.jobs, args.watch, args.interval
 
 
 def main():
     """runs the program"""
-    if not EDF2ASC:
+    files, jobs, watch, interval = parse_cmd_arguments()
+    import edfrunner
+
+    # Looked up only now, so that --help and an empty run don't need it
+    if (watch or files) and not edfrunner.find_edf2asc():
         die("Unable to find {}".format(_EDF2ASC))
 
-    files = parse_cmd_arguments()
-    if files:
-        process_files(files)
+    if watch:
+        if Watcher(jobs, interval).run():
+            exit(1)
+    elif files:
+        if process_files(files, jobs):
+            exit(1)
     else:
         print("No input exiting")
 
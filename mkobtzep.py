@@ -3,10 +3,13 @@
 the png files created by zep to png's
 """
 
+import os
 import sys
 import argparse
 from pathlib import Path
-from PIL import Image
+
+import imgcache
+import instrument
 
 PROG_NAME = "mkobtzep"
 PROG_DESCRIPTION = (
@@ -24,40 +27,29 @@ OBJ_COLS = 14
 PNG = ".png"
 BMP = ".bmp"
 OBT = ".obt"
+RASTER = ".labels.npy"
+
+# Whether to write a label raster next to every obt file
+RASTERS = False
 
 INVALID_DIR = 'The folder "{}" doesn\'t exist or is not a folder'
+SKIP_MSG = 'skipping "{}" since its output "{}" already exists.'
+CONVERT_MSG = 'Converting "{}" into "{}".'
+CACHED_MSG = 'Using the cached conversion of "{}" for "{}".'
+ADOPT_MSG = 'Adding the existing conversion of "{}", "{}", to the cache.'
+# printf-style, since it's a lot faster than str.format for many short lines
 OUT_LINE_FMT = (
-    "{:<23}"
-    "{:>3}"
-    "{:>4}{:>4}"
-    "{:>5}{:>5}"
-    "{:>4}{:>4}{:>4}"
-    "{:>5}{:>5}{:>5}{:>5}"
-    "{:>4}{:>4}"
+    "%-23s"
+    "%3d"
+    "%4d%4d"
+    "%5d%5d"
+    "%4d%4d%4d"
+    "%5d%5d%5d%5d"
+    "%4d%4d"
     "\r\n"
 )
 
 
-class ObtItem:
-    """The objects are generated by trial and condition
-    For example, obt need to be generated for trial 1 and CNDB and
-    QCNDB. mkobt zep needs to distinguish between trial 1 CNDB and
-    trial1 QCNDB.
-    ObtItem implements __eq__ and __hash__ functions in order to make
-    the object hashable
-    """
-
-    def __init__(self, trialnum, condition):
-        self.trialnum = trialnum
-        self.condition = condition
-
-    def __eq__(self, other):
-        return self.trialnum == other.trialnum and self.condition == other.condition
-
-    def __hash__(self):
-        return hash((self.trialnum, self.condition))
-
-
 def die(msg):
     """Prints message to stderr and exit unsuccessfully."""
     print(msg, file=sys.stderr)
@@ -76,18 +68,194 @@ def parse_arguments():
         nargs="+",
         help="The number of the list to generate the objects for",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="The number of images to convert in parallel (default 1).",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Don't use the cache of converted images, only convert the "
+        "images whose bmp doesn't exist.",
+    )
+    parser.add_argument(
+        "--prune-cache",
+        type=float,
+        metavar="DAYS",
+        help="After converting, remove the cached images that haven't been "
+        "used for DAYS days.",
+    )
+    parser.add_argument(
+        "--rasters",
+        action="store_true",
+        help="Also write a label raster with the object under every pixel "
+        "of the image next to the obt files (requires NumPy).",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print the time spent per stage and the counters to stderr.",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="Write the stages, counters and a timeline of the run as JSON "
+        "(Chrome trace format) to FILE.",
+    )
     args = parser.parse_args()
-    return args.expname, args.listnum
+    if args.jobs < 1:
+        parser.error("--jobs must be 1 or greater")
+    if args.prune_cache is not None:
+        if args.no_cache:
+            parser.error("--prune-cache can't be combined with --no-cache")
+        if args.prune_cache < 0:
+            parser.error("--prune-cache must be 0 or greater")
+    instrument.setup(args.profile, args.trace)
+    global RASTERS
+    RASTERS = args.rasters
+    return args.expname, args.listnum, args.jobs, not args.no_cache, args.prune_cache
+
+
+def save_image_as(infile, outfile):
+    """Saves image infile as outfile, the format follows from its extension"""
+    # Imported here, since Pillow takes a while to load and isn't needed
+    # for --help or when all images are cached.
+    from PIL import Image
+
+    with instrument.timed("pillow.convert"):
+        loadedim = Image.open(infile)
+        loadedim.save(outfile)
+    instrument.count("images.converted")
 
 
 def convert_image_to(infile, outfile):
     """Converts image infile to the output image outfile"""
-    print('Converting "{}" into "{}".'.format(infile, outfile))
-    loadedim = Image.open(infile)
-    loadedim.save(outfile)
+    print(CONVERT_MSG.format(infile, outfile))
+    save_image_as(infile, outfile)
+
+
+def is_conversion_of(outfile, infile):
+    """Returns whether the existing image outfile may be taken for the
+    conversion of infile: it isn't older and has the same size in pixels.
+    Only the headers of the images are read.
+    """
+    from PIL import Image
+
+    try:
+        if os.path.getmtime(outfile) < os.path.getmtime(infile):
+            return False
+        with Image.open(infile) as source, Image.open(outfile) as output:
+            return source.size == output.size
+    except OSError:
+        return False
+
+
+def convert_cached(infile, cachefile, outfile):
+    """Converts infile into the cache and places the result at outfile,
+    returns the number of bytes written.
+    """
+    root, ext = os.path.splitext(cachefile)
+    tempname = "{}.{}.tmp{}".format(root, os.getpid(), ext)
+    save_image_as(infile, tempname)
+    os.replace(tempname, cachefile)
+    return os.path.getsize(cachefile) + imgcache.place(cachefile, outfile)
+
 
+class ImagePool:
+    """Converts images on a pool of worker processes, so that the obt files
+    can be written in the mean time.
 
-def convert_planame(expname, planame):
+    The messages are printed when a conversion is scheduled, hence in the
+    same order as in a serial run. Every output is converted only once,
+    also when it is used by several lists.
+    """
+
+    def __init__(self, jobs):
+        # Imported here, since it's only needed with --jobs
+        import concurrent.futures as cf
+
+        self.executor = cf.ProcessPoolExecutor(max_workers=jobs)
+        self.outputs = set()
+        self.pending = []
+        # The futures of the conversions into the cache by cache file and
+        # the outputs that have to wait for them
+        self.caching = {}
+        self.deferred = []
+
+    def scheduled(self, outfile):
+        """Returns whether outfile has already been scheduled"""
+        return outfile in self.outputs
+
+    def convert(self, infile, outfile, cachefile=None):
+        """Schedules the conversion of infile to outfile, via cachefile
+        when given.
+        """
+        print(CONVERT_MSG.format(infile, outfile))
+        self.outputs.add(outfile)
+        if cachefile is None:
+            future = self.submit(save_image_as, infile, outfile)
+        else:
+            future = self.submit(convert_cached, infile, cachefile, outfile)
+            self.caching[cachefile] = future
+        self.pending.append((infile, future))
+
+    def submit(self, func, *args):
+        """Runs func(*args) on a worker, when profiling the worker's records
+        are returned with the result, see wait().
+        """
+        if instrument.ENABLED:
+            return self.executor.submit(
+                instrument.remote, func, instrument.tracing(), *args
+            )
+        return self.executor.submit(func, *args)
+
+    def caches(self, cachefile):
+        """Returns whether cachefile is being converted"""
+        return cachefile in self.caching
+
+    def place_later(self, cachefile, outfile):
+        """Places cachefile at outfile once it has been converted"""
+        self.outputs.add(outfile)
+        self.deferred.append((cachefile, outfile))
+
+    def wait(self, cache=None):
+        """Waits for all conversions, returns the number that failed
+
+        @param cache the ImageCache whose statistics are updated
+        """
+        failures = 0
+        for infile, future in self.pending:
+            try:
+                written = future.result()
+                if instrument.ENABLED:
+                    written, recorded = written
+                    instrument.merge(recorded)
+            except Exception as error:  # Pillow raises a variety of errors
+                recorded = getattr(error, "recorded", None)
+                if recorded:
+                    instrument.merge(recorded)
+                print(
+                    'Unable to convert "{}": {}'.format(infile, error), file=sys.stderr
+                )
+                failures += 1
+                continue
+            if cache and written:
+                cache.bytes_written += written
+        for cachefile, outfile in self.deferred:
+            if not self.caching[cachefile].exception():
+                written = imgcache.place(cachefile, outfile)
+                if cache:
+                    cache.bytes_written += written
+        self.pending = []
+        self.deferred = []
+        self.executor.shutdown()
+        return failures
+
+
+def convert_planame(expname, planame, pool=None, cache=None):
     """
     Converts planame to a bmp for fixation.
 
@@ -96,117 +264,240 @@ def convert_planame(expname, planame):
 
     @param expname (three letter) experiment name
     @param planame basename of the picture
+    @param pool an ImagePool, when given the conversion is scheduled on the
+           pool instead of done right away.
+    @param cache an ImageCache, when given an existing bmp is only skipped
+           when it matches the current png and an identical png that has
+           been converted before is taken from the cache. An existing bmp
+           that isn't in the cache yet is added to it when it's the
+           conversion of the png according to is_conversion_of.
     """
-    imgdir = Path("./{}".format(expname)) / IMGDIR
-    if not imgdir.exists() or not imgdir.is_dir():
-        die(INVALID_DIR.format(str(imgdir)))
+    imgdir = experiment_dir(expname, IMGDIR)
     fnin = str(imgdir / (planame + PNG))
     fnout = str(imgdir / (planame + BMP))
-    if Path(fnout).exists():
-        print('skipping "{}" since its output "{}" already exists.'.format(fnin, fnout))
+    if pool and pool.scheduled(fnout):
+        print(SKIP_MSG.format(fnin, fnout))
+        return
+    if not cache:
+        if Path(fnout).exists():
+            print(SKIP_MSG.format(fnin, fnout))
+        elif pool:
+            pool.convert(fnin, fnout)
+        else:
+            convert_image_to(fnin, fnout)
         return
-    convert_image_to(fnin, fnout)
+
+    try:
+        cachefile = cache.path(fnin)
+    except OSError as error:
+        die('Unable to read "{}": {}'.format(fnin, error))
+    if pool and pool.caches(cachefile):
+        print(CACHED_MSG.format(fnin, fnout))
+        cache.hits += 1
+        pool.place_later(cachefile, fnout)
+    elif not cache.contains(cachefile):
+        cache.misses += 1
+        if Path(fnout).exists() and is_conversion_of(fnout, fnin):
+            print(ADOPT_MSG.format(fnin, fnout))
+            cache.adopt(fnout, cachefile)
+        elif pool:
+            pool.convert(fnin, fnout, cachefile)
+        else:
+            print(CONVERT_MSG.format(fnin, fnout))
+            cache.bytes_written += convert_cached(fnin, cachefile, fnout)
+    elif cache.is_current(cachefile, fnout):
+        print(SKIP_MSG.format(fnin, fnout))
+        cache.hit(cachefile)
+    else:
+        print(CACHED_MSG.format(fnin, fnout))
+        cache.hit(cachefile)
+        cache.bytes_written += imgcache.place(cachefile, fnout)
+
+
+def experiment_dir(expname, subdir):
+    """Returns the subdir of the experiment, it exits when it doesn't exist"""
+    dirname = Path("./{}".format(expname)) / subdir
+    if not dirname.exists() or not dirname.is_dir():
+        die(INVALID_DIR.format(str(dirname)))
+    return dirname
+
+
+def parse_row(line):
+    """Parses a line of an objects csv file
+
+    @return a tuple with the OBJ_COLS fields of the line or None when the
+            line doesn't describe an object, e.g. the header.
+    """
+    fields = line.split(";")
+    if len(fields) != OBJ_COLS:
+        return None
+    try:
+        return (int(fields[0]), fields[1], *map(int, fields[2:-1]), fields[-1].strip())
+    except ValueError:
+        return None
 
 
-def create_obt(expname, obtname, words):
-    """Creates a new obt file for one stimulus
-    The new obt file will be created in the exp/obt/ directory
-    relative to the current working directory.
+def group_rows(lines):
+    """Groups the objects in lines by trial
+
+    The objects are generated by trial and condition, e.g. obt files need
+    to be generated for trial 1 of CNDB and trial 1 of QCNDB.
+
+    @return a dict that maps (trialnum, condition) to the rows of the trial,
+            in order of appearance.
+    """
+    trials = {}
+    for line in lines:
+        row = parse_row(line)
+        if row is not None:
+            key = row[0], row[1]
+            rows = trials.get(key)
+            if rows is None:
+                trials[key] = [row]
+            else:
+                rows.append(row)
+    return trials
+
+
+def obt_line(row):
+    """Formats the row of one object as a line of an obt file"""
+    (
+        stimnum,
+        condition,
+        nl,
+        ln,
+        wnt,
+        nwl,
+        wnl,
+        wx,
+        wy,
+        ww,
+        wh,
+        ll,
+        wl,
+        word,
+    ) = row
+    return OUT_LINE_FMT % (
+        word,  # object
+        wl,  # object length
+        wnl + 1,  # object number in line
+        nwl,  # number of objects in line
+        ll,  # line length
+        wnt + 1,  # object number in line
+        ln + 1,  # line number
+        nl,  # number of lines in text
+        stimnum,  # stimulus number
+        wx,  # object x
+        wy,  # object y
+        wx + ww,  # object x + object width
+        wy + wh,  # object y + object height
+        0,  # object code
+        0,  # object position code
+    )
+
+
+def create_obt(obtdir, obtname, words):
+    """Creates a new obt file for one stimulus in obtdir
+
+    @param words the rows of the objects of the stimulus
     """
-    obtdir = Path("./{}".format(expname)) / OBTDIR
-    if not obtdir.exists() or not obtdir.is_dir():
-        die(INVALID_DIR.format(str(obtdir)))
     fnout = str(obtdir / (obtname + OBT))
-    with open(fnout, "wb") as obtfile:
-        for fields in words:
-            (
-                stimnum,
-                condition,
-                nl,
-                ln,
-                wnt,
-                nwl,
-                wnl,
-                wx,
-                wy,
-                ww,
-                wh,
-                ll,
-                wl,
-                word,
-            ) = tuple(fields)
-            line = OUT_LINE_FMT.format(
-                word,  # object
-                wl,  # object length
-                wnl + 1,  # object number in line
-                nwl,  # number of objects in line
-                ll,  # line length
-                wnt + 1,  # object number in line
-                ln + 1,  # line number
-                nl,  # number of lines in text
-                stimnum,  # stimulus number
-                wx,  # object x
-                wy,  # object y
-                wx + ww,  # object x + object width
-                wy + wh,  # object y + object height
-                0,  # object code
-                0,  # object position code
-            )
-            obtfile.write(line.encode("utf8"))
+    with instrument.timed("mkobtzep.write_obt"):
+        data = "".join([obt_line(row) for row in words]).encode("utf8")
+        with open(fnout, "wb") as obtfile:
+            obtfile.write(data)
+    instrument.count("mkobtzep.obt_bytes", len(data))
     print('Created obt file "{}".'.format(fnout))
 
 
-def process_lines(llist, expname):
-    """Processes the lines in the line list llist"""
-    trials = {}
-    for line in llist:
-        # split line and strip (leading and) trailing white space
-        try:
-            fields = line.split(";")
-            fields = (
-                [int(fields[0]), fields[1]]
-                + [int(i) for i in fields[2:-1]]
-                + [fields[-1].strip()]
-            )
-        except ValueError:
-            # skip line
-            continue
-
-        # Put the fields that belong to one trial in the trials dict as a list.
-        if len(fields) == OBJ_COLS:
-            obt = ObtItem(fields[0], fields[1])
-            if obt in trials:
-                trials[obt].append(fields)
-            else:
-                trials[obt] = [fields]
+def create_raster(obtdir, imgdir, obtname, words):
+    """Creates the label raster of one stimulus in obtdir
+
+    The raster is a uint16 array of the size of the image of the stimulus
+    that holds for every pixel the number of the object (1, 2, ...) under it,
+    or 0 where there's no object. It's saved in the .npy format, so it can
+    be memory mapped by numpy.load.
 
-    for key, trial in trials.items():
-        condition = key.condition
-        planame = "{}{:03}".format(condition, key.trialnum)
-        convert_planame(expname, planame)
-        create_obt(expname, planame, trial)
+    @param words the rows of the objects of the stimulus
+    """
+    import numpy as np
+    from PIL import Image
 
+    fnin = str(imgdir / (obtname + PNG))
+    try:
+        with Image.open(fnin) as image:
+            width, height = image.size
+    except OSError as error:
+        die('Unable to read "{}": {}'.format(fnin, error))
+    raster = np.zeros((height, width), np.uint16)
+    for row in words:
+        wnt, wx, wy, ww, wh = row[4], row[7], row[8], row[9], row[10]
+        raster[max(wy, 0) : max(wy + wh, 0), max(wx, 0) : max(wx + ww, 0)] = wnt + 1
+
+    fnout = str(obtdir / (obtname + RASTER))
+    tempname = "{}.{}.tmp".format(fnout, os.getpid())
+    with open(tempname, "wb") as f:
+        np.save(f, raster)
+    os.replace(tempname, fnout)
+    print('Created label raster "{}".'.format(fnout))
+
+
+def process_lines(llist, expname, pool=None, cache=None):
+    """Processes the lines in the line list llist, which may be any
+    iterable of lines such as an open file.
+
+    @param pool an optional ImagePool that converts the images
+    @param cache an optional ImageCache with the converted images
+    """
+    with instrument.timed("mkobtzep.read_objects"):
+        trials = group_rows(llist)
+    if not trials:
+        return
+    obtdir = experiment_dir(expname, OBTDIR)
+    for (trialnum, condition), trial in trials.items():
+        planame = "{}{:03}".format(condition, trialnum)
+        convert_planame(expname, planame, pool, cache)
+        create_obt(obtdir, planame, trial)
+        if RASTERS:
+            with instrument.timed("mkobtzep.raster"):
+                create_raster(obtdir, experiment_dir(expname, IMGDIR), planame, trial)
 
-def process_file(expname, listnum):
+
+def process_file(expname, listnum, pool=None, cache=None):
     """
     Processes the list number
+
+    @param pool an optional ImagePool that converts the images
+    @param cache an optional ImageCache with the converted images
     """
     pathin1 = Path("./" + expname) / "obt" / "objects{}.csv".format(listnum)
-    lines = []
     try:
-        with open(str(pathin1)) as infile:
-            lines = infile.readlines()
+        infile = open(str(pathin1))
     except IOError:
         die("Unable to open: '{}'".format(str(pathin1)))
-
-    process_lines(lines, expname)
+    with infile:
+        process_lines(infile, expname, pool, cache)
 
 
 def main():
     """The main function"""
-    expname, listnumbers = parse_arguments()
+    expname, listnumbers, jobs, use_cache, prune_days = parse_arguments()
+    pool = ImagePool(jobs) if jobs > 1 else None
+    cache = None
+    if use_cache:
+        cache = imgcache.ImageCache(str(Path("./{}".format(expname)) / IMGDIR), BMP)
     for listn in listnumbers:
-        process_file(expname, listn)
+        process_file(expname, listn, pool, cache)
+    failures = pool.wait(cache) if pool else 0
+    if cache:
+        instrument.count("imgcache.hits", cache.hits)
+        instrument.count("imgcache.misses", cache.misses)
+        print(cache.summary())
+        if prune_days is not None:
+            files, size = cache.prune(prune_days * 24 * 3600)
+            print("image cache: pruned {} images, {:,} bytes".format(files, size))
+    if failures:
+        exit(1)
 
 
 if __name__ == "__main__":
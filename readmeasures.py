@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+
+"""readmeasures assigns the fixations of reading experiments to the words
+of the stimuli and computes the standard reading measures per word.
+
+The words and their bounding boxes are read from the .obt files that
+mkobtzep generates in ./exp/obt/. The boxes are relative to the stimulus
+image, which zep shows in the center of the screen, hence the fixations are
+shifted by the margin between the image (from ./exp/img/) and the screen
+(from the GAZE_COORDS message) before they are assigned.
+
+The fixations are the EFIX events of the .asc files, a fixation belongs to
+the trial whose trialbeg and trialend messages enclose it and the plafile
+message of the trial names the stimulus, e.g. "CNDA001.bmp" is described by
+"CNDA001.obt".
+
+A fixation is assigned to the word whose box contains it, fixations
+outside all boxes are ignored. The measures per word are:
+
+    ffd         first fixation duration: the duration of the first
+                fixation on the word in first pass
+    gd          gaze duration: the sum of the first pass fixations on the
+                word before it is left
+    gopast      go-past time: the sum of the fixations from the first pass
+                entry of the word until a word to its right is fixated
+    regout      1 when the first pass on the word ends with a regression
+                to a word to its left
+    regin       the number of times the word is entered from a word to
+                its right
+    total       the sum of all fixations on the word
+    nfix        the number of fixations on the word
+
+A word is in first pass when it is fixated before any word to its right,
+the first pass measures are 0 for words that are skipped.
+"""
+
+import os
+import os.path
+import re
+import sys
+import csv
+
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+import ascreader
+import trialindex
+
+_PROGRAM_NAME = "readmeasures"
+_DESCRIPTION = """readmeasures computes the reading measures per word of
+the trials in Eyelink .asc files using the .obt files of the experiment.
+It's run from the data directory of a zep experiment."""
+
+OBTDIR = "obt"
+IMGDIR = "img"
+OBT = ".obt"
+
+RE_GAZE_COORDS = re.compile(r"^GAZE_COORDS\s+(\S+)\s+(\S+)\s+(\S+)\s+(\S+)")
+
+# The widths of the numeric columns at the end of an obt line, see
+# mkobtzep.OUT_LINE_FMT. The word in front of them may be wider than its
+# column.
+_OBT_WIDTHS = (3, 4, 4, 5, 5, 4, 4, 4, 5, 5, 5, 5, 4, 4)
+
+WORD_DTYPE = np.dtype(
+    [
+        ("word", "O"),
+        ("length", "i4"),
+        ("number_in_line", "i4"),
+        ("words_in_line", "i4"),
+        ("line_length", "i4"),
+        ("number", "i4"),
+        ("line", "i4"),
+        ("nlines", "i4"),
+        ("stimulus", "i4"),
+        ("x1", "f4"),
+        ("y1", "f4"),
+        ("x2", "f4"),
+        ("y2", "f4"),
+        ("code", "i4"),
+        ("position_code", "i4"),
+    ]
+)
+
+MEASURES = ("ffd", "gd", "gopast", "regout", "regin", "total", "nfix")
+
+
+def read_obt(fn: str) -> np.ndarray:
+    """Reads the words of an .obt file into an array of WORD_DTYPE"""
+    tail = sum(_OBT_WIDTHS)
+    rows = []
+    with open(fn, encoding="utf8", newline="") as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if len(line) <= tail:
+                continue
+            fields = [line[:-tail].rstrip()]
+            pos = len(line) - tail
+            for width in _OBT_WIDTHS:
+                fields.append(int(line[pos : pos + width]))
+                pos += width
+            rows.append(tuple(fields))
+    return np.array(rows, WORD_DTYPE)
+
+
+class Stimulus:
+    """The words of one stimulus in reading order, indexed by position
+
+    The lines are sorted by their top, the words of a line by their left
+    edge, so the word under a point is found with a binary search.
+    """
+
+    def __init__(self, words: np.ndarray):
+        self.words = words[np.argsort(words["number"], kind="stable")]
+        words = self.words
+        lines, line_index = np.unique(words["line"], return_inverse=True)
+        top = np.full(len(lines), np.inf)
+        bottom = np.full(len(lines), -np.inf)
+        np.minimum.at(top, line_index, words["y1"])
+        np.maximum.at(bottom, line_index, words["y2"])
+        order = np.argsort(top, kind="stable")
+        self.line_top = top[order]
+        self.line_bottom = bottom[order]
+        rank = np.empty(len(lines), np.int64)
+        rank[order] = np.arange(len(lines))
+        line_index = rank[line_index]
+
+        # The words sorted by line and left edge, the left edges are offset
+        # by the line, so one search finds a word in the line of a point.
+        self.order = np.lexsort((words["x1"], line_index))
+        self.word_line = line_index[self.order]
+        self.x1 = words["x1"][self.order].astype(np.float64)
+        self.x2 = words["x2"][self.order].astype(np.float64)
+        if len(words):
+            self.low = self.x1.min() - 1.0
+            self.span = self.x2.max() + 1.0 - self.low
+        else:
+            self.low, self.span = 0.0, 1.0
+        self.keys = self.word_line * self.span + (self.x1 - self.low)
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def assign(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """Returns for every point the index of the word in words that
+        contains it, or -1 when it isn't on a word.
+        """
+        x = np.asarray(x, np.float64)
+        y = np.asarray(y, np.float64)
+        result = np.full(len(x), -1, np.int64)
+        if not len(self.words) or not len(x):
+            return result
+        line = np.searchsorted(self.line_top, y, side="right") - 1
+        on_line = (line >= 0) & (y < self.line_bottom[np.maximum(line, 0)])
+        line = np.where(on_line, line, 0)
+        offset = np.clip(x - self.low, 0.0, self.span - 1.0)
+        word = np.searchsorted(self.keys, line * self.span + offset, side="right") - 1
+        word = np.maximum(word, 0)
+        hit = (
+            on_line
+            & (self.word_line[word] == line)
+            & (x >= self.x1[word])
+            & (x < self.x2[word])
+        )
+        result[hit] = self.order[word[hit]]
+        return result
+
+
+def measures(
+    sequence: Iterable[int], durations: Iterable[float], nwords: int
+) -> Dict[str, np.ndarray]:
+    """Computes the reading measures from the words fixated in sequence
+
+    @sequence the position in the text of the word of every fixation
+    @durations the durations of the fixations
+    @return a dict that maps the names in MEASURES to an array with the
+            measure of every word.
+    """
+    sequence = list(sequence)
+    durations = list(durations)
+    result = {name: np.zeros(nwords) for name in MEASURES}
+    ffd, gd, gopast = result["ffd"], result["gd"], result["gopast"]
+    regout, regin = result["regout"], result["regin"]
+    total, nfix = result["total"], result["nfix"]
+
+    rightmost = -1
+    for i, (word, duration) in enumerate(zip(sequence, durations)):
+        total[word] += duration
+        nfix[word] += 1
+        if i and sequence[i - 1] > word:
+            regin[word] += 1
+        if word <= rightmost:
+            continue
+        # First pass entry of word
+        rightmost = word
+        ffd[word] = duration
+        j = i
+        while j < len(sequence) and sequence[j] == word:
+            gd[word] += durations[j]
+            j += 1
+        if j < len(sequence) and sequence[j] < word:
+            regout[word] = 1
+        k = i
+        while k < len(sequence) and sequence[k] <= word:
+            gopast[word] += durations[k]
+            k += 1
+    return result
+
+
+def screen_size(messages: np.ndarray) -> Optional[Tuple[float, float]]:
+    """Returns the width and height of the screen from the GAZE_COORDS
+    message, or None when there is none.
+    """
+    for text in messages["text"]:
+        mobj = RE_GAZE_COORDS.match(text)
+        if mobj:
+            left, top, right, bottom = (float(v) for v in mobj.groups())
+            return right - left + 1, bottom - top + 1
+    return None
+
+
+class ObtLibrary:
+    """Loads the Stimulus of a plafile from the obt directory of an
+    experiment on demand
+    """
+
+    def __init__(self, expdir: str):
+        self.obtdir = os.path.join(expdir, OBTDIR)
+        self.imgdir = os.path.join(expdir, IMGDIR)
+        self.stimuli: Dict[str, Optional[Stimulus]] = {}
+        self.sizes: Dict[str, Optional[Tuple[int, int]]] = {}
+
+    def get(self, plafile: str) -> Optional[Stimulus]:
+        """Returns the stimulus of plafile or None when it has no obt file"""
+        name = os.path.splitext(os.path.basename(plafile))[0]
+        if name not in self.stimuli:
+            fn = os.path.join(self.obtdir, name + OBT)
+            self.stimuli[name] = Stimulus(read_obt(fn)) if os.path.exists(fn) else None
+        return self.stimuli[name]
+
+    def image_size(self, plafile: str) -> Optional[Tuple[int, int]]:
+        """Returns the size of the image of plafile, or None when it cannot
+        be read.
+        """
+        if plafile not in self.sizes:
+            from PIL import Image
+
+            self.sizes[plafile] = None
+            name = os.path.splitext(os.path.basename(plafile))[0]
+            for fn in (plafile, name + ".bmp", name + ".png"):
+                try:
+                    with Image.open(os.path.join(self.imgdir, fn)) as image:
+                        self.sizes[plafile] = image.size
+                    break
+                except OSError:
+                    pass
+        return self.sizes[plafile]
+
+    def offset(self, plafile: str, screen: Optional[Tuple[float, float]]):
+        """Returns the position of the top left of the centered image of
+        plafile on screen, (0, 0) when either size is unknown.
+        """
+        size = self.image_size(plafile)
+        if not (size and screen):
+            return 0.0, 0.0
+        return (screen[0] - size[0]) / 2, (screen[1] - size[1]) / 2
+
+
+class WordMeasures(NamedTuple):
+    """The reading measures of one trial"""
+
+    trial: trialindex.Trial
+    words: np.ndarray
+    measures: Dict[str, np.ndarray]
+
+
+def process_file(
+    fn: str, library: ObtLibrary, offset: Optional[Tuple[float, float]] = None
+) -> List[WordMeasures]:
+    """Computes the reading measures of all trials in the .asc file fn with
+    a stimulus in library.
+
+    @offset the position of the stimuli on screen, by default they are
+            assumed to be centered.
+    """
+    rec = ascreader.read_asc(fn)
+    fixations = rec.fixations
+    screen = screen_size(rec.messages)
+    starts = fixations["start"]
+    results = []
+    for trial in trialindex.load(fn):
+        stimulus = library.get(trial.plafile) if trial.plafile else None
+        if stimulus is None:
+            continue
+        end = trial.end_time if not np.isnan(trial.end_time) else np.inf
+        first, last = np.searchsorted(starts, [trial.begin_time, end])
+        fixes = fixations[first:last]
+        dx, dy = offset or library.offset(trial.plafile, screen)
+        index = stimulus.assign(fixes["x"] - dx, fixes["y"] - dy)
+        on_word = index >= 0
+        results.append(
+            WordMeasures(
+                trial,
+                stimulus.words,
+                measures(index[on_word], fixes["duration"][on_word], len(stimulus)),
+            )
+        )
+    return results
+
+
+def write_csv(out, fn: str, results: List[WordMeasures], header: bool = True):
+    """Writes the measures of results as csv rows to out"""
+    writer = csv.writer(out, lineterminator="\n")
+    if header:
+        writer.writerow(
+            ["file", "trial", "item", "condition", "plafile", "line", "number", "word"]
+            + list(MEASURES)
+        )
+    for result in results:
+        trial = result.trial
+        for i, word in enumerate(result.words):
+            writer.writerow(
+                [
+                    os.path.basename(fn),
+                    trial.trial,
+                    trial.item,
+                    trial.condition,
+                    trial.plafile,
+                    word["line"],
+                    word["number"],
+                    word["word"],
+                ]
+                + ["{:g}".format(result.measures[name][i]) for name in MEASURES]
+            )
+
+
+if __name__ == "__main__":
+    import argparse as ap
+    import ascfile
+
+    parser = ap.ArgumentParser(_PROGRAM_NAME, description=_DESCRIPTION)
+    parser.add_argument("expname", help="The name of the experiment")
+    parser.add_argument("input_files", nargs="+", help="The input .asc file's")
+    parser.add_argument(
+        "-o", "--output", help="The output csv file, by default standard output"
+    )
+    parser.add_argument(
+        "--offset",
+        type=float,
+        nargs=2,
+        metavar=("X", "Y"),
+        help="The position of the top left of the stimuli on screen, by "
+        "default they are centered.",
+    )
+    args = parser.parse_args()
+
+    expdir = os.path.join(".", args.expname)
+    library = ObtLibrary(expdir)
+    if not os.path.isdir(library.obtdir):
+        print(
+            'The folder "{}" doesn\'t exist or is not a folder'.format(
+                library.obtdir
+            ),
+            file=sys.stderr,
+        )
+        exit(1)
+
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    with out:
+        header = True
+        for fn in args.input_files:
+            if not os.path.exists(fn):
+                print('Skipping "{}" (it doesn\'t exist).'.format(fn), file=sys.stderr)
+                continue
+            try:
+                measures = process_file(fn, library, args.offset)
+            except ascfile.READ_ERRORS as error:
+                print('Skipping "{}" ({}).'.format(fn, error), file=sys.stderr)
+                continue
+            write_csv(out, fn, measures, header)
+            header = False
@@ -0,0 +1,86 @@
+"""Tests of reading compressed .asc files, in particular damaged ones"""
+
+import os
+import sys
+import gzip
+import shutil
+import subprocess
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+sys.path.insert(0, ROOT)
+
+import ascfile  # noqa: E402
+import ascreader  # noqa: E402
+import infocache  # noqa: E402
+
+DATA = os.path.join(ROOT, "data", "reading", "dat")
+
+
+@pytest.fixture
+def datadir(tmp_path):
+    """A directory with an intact .asc and .asc.gz and a truncated .asc.gz"""
+    shutil.copy(os.path.join(DATA, "0011_01_01.asc"), str(tmp_path))
+    with open(os.path.join(DATA, "0001_01_01.asc"), "rb") as f:
+        data = gzip.compress(f.read())
+    (tmp_path / "0001_01_01.asc.gz").write_bytes(data)
+    (tmp_path / "0007_01_01.asc.gz").write_bytes(data[: len(data) // 2])
+    return tmp_path
+
+
+def run(module, *args, cwd):
+    """Runs the script of module with args in cwd"""
+    return subprocess.run(
+        [sys.executable, os.path.join(ROOT, module + ".py")] + list(args),
+        cwd=str(cwd),
+        capture_output=True,
+        text=True,
+    )
+
+
+def test_gz_reads_like_plain(datadir):
+    plain = ascreader.read_asc(os.path.join(DATA, "0001_01_01.asc"))
+    packed = ascreader.read_asc(str(datadir / "0001_01_01.asc.gz"))
+    assert plain.samples.tobytes() == packed.samples.tobytes()
+    assert plain.messages.tolist() == packed.messages.tolist()
+
+
+def test_truncated_gz_raises_a_read_error(datadir):
+    with pytest.raises(ascfile.READ_ERRORS):
+        ascreader.read_asc(str(datadir / "0007_01_01.asc.gz"))
+
+
+def test_trial_count_of_truncated_gz(datadir):
+    fn = str(datadir / "0007_01_01.asc.gz")
+    assert infocache.trial_count(fn, use_cache=False) is None
+    assert not os.path.exists(fn + ".trials.json")
+
+
+@pytest.mark.parametrize(
+    "args", [["--no-cache", "."], ["--no-cache", "-f", "csv", "."], ["-t", "."]]
+)
+def test_edfinfo_skips_truncated_gz(datadir, args):
+    result = run("edfinfo", *args, cwd=datadir)
+    assert "Traceback" not in result.stderr
+    assert result.returncode == 0
+    assert "0011_01_01.asc" in result.stdout
+    assert "0001_01_01.asc.gz" in result.stdout
+
+
+def test_dataquality_skips_truncated_gz(datadir):
+    result = run("dataquality", "-j", "1", ".", cwd=datadir)
+    assert "Traceback" not in result.stderr
+    assert 'Skipping "./0007_01_01.asc.gz"' in result.stderr
+    assert "0011_01_01.asc" in result.stdout
+
+
+@pytest.mark.parametrize(
+    "module", ["trialindex", "ascreader", "eventdetect", "ascstore"]
+)
+def test_readers_skip_truncated_gz(datadir, module):
+    result = run(module, "0007_01_01.asc.gz", "0011_01_01.asc", cwd=datadir)
+    assert "Traceback" not in result.stderr
+    assert 'Skipping "0007_01_01.asc.gz"' in result.stderr
+    assert result.returncode == 0
@@ -0,0 +1,94 @@
+"""Tests of ascreader against parsing the lines one by one with str.split"""
+
+import os
+import sys
+import glob
+
+import numpy as np
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+sys.path.insert(0, ROOT)
+
+import ascreader  # noqa: E402
+
+DATA = os.path.join(ROOT, "data", "reading", "dat")
+
+SAMPLES = b"SAMPLES\tGAZE\tRIGHT\tRATE\t 500.00\tTRACKING\tCR\tFILTER\t2\n"
+SAMPLE = b"%d\t%7s\t%7s\t%7s\t...\n"
+
+
+def value(token):
+    return float("nan") if token.strip() == "." else float(token)
+
+
+def split_samples(text):
+    """The time, x, y and pupil of the sample lines of a monocular text"""
+    rows = [
+        tuple(value(v) for v in line.split("\t")[:4])
+        for line in text.splitlines()
+        if line[:1].isdigit()
+    ]
+    return np.array(rows, ascreader.SAMPLE_DTYPE.descr[:4])
+
+
+def split_events(text, word):
+    """The events of type word parsed with str.split"""
+    dtype = ascreader.EVENT_DTYPES[word.encode()]
+    rows = [
+        (fields[1],) + tuple(value(v) for v in fields[2 : len(dtype) + 1])
+        for fields in (line.split() for line in text.splitlines())
+        if fields[:1] == [word]
+    ]
+    return np.array(rows, dtype)
+
+
+def same(a, b):
+    """Whether the fields of b are equal in a, NaN equals NaN"""
+    return len(a) == len(b) and all(
+        np.array_equal(a[name], b[name], equal_nan=b.dtype[name].kind == "f")
+        for name in b.dtype.names
+    )
+
+
+@pytest.mark.parametrize("chunk_size", [ascreader.CHUNK_SIZE, 5000])
+@pytest.mark.parametrize("fn", sorted(glob.glob(os.path.join(DATA, "*.asc"))))
+def test_matches_split(fn, chunk_size):
+    with open(fn) as f:
+        text = f.read()
+    rec = ascreader.read_asc(fn, chunk_size)
+    assert same(rec.samples, split_samples(text))
+    assert same(rec.fixations, split_events(text, "EFIX"))
+    assert same(rec.saccades, split_events(text, "ESACC"))
+    assert same(rec.blinks, split_events(text, "EBLINK"))
+
+
+def test_irregular_sample_lines():
+    """Lines that don't share the column layout of the other lines"""
+    regular = [(b"394.2", b"367.7", b"207.0")] * 100
+    irregular = [
+        (b"-12.5", b"367.7", b"207.0"),
+        (b".", b".", b"0.0"),
+        (b"394", b"367.7", b"207.0"),
+        (b"394.25", b"1e2", b"207.0"),
+    ]
+    lines = [SAMPLE % ((1000 + i,) + row) for i, row in enumerate(regular)]
+    lines += [SAMPLE % ((2000 + i,) + row) for i, row in enumerate(irregular)]
+    lines.append(b"3000\t394.2  \t  367.7\t  207.0\t...\n")
+    text = SAMPLES + b"".join(lines)
+    # A line with too few columns is skipped.
+    samples = ascreader.parse(text + b"4000\t  394.2\t  367.7\n").samples
+    assert same(samples, split_samples(text.decode()))
+
+
+def test_irregular_event_lines():
+    """Event lines with more values than usual are parsed one by one"""
+    text = (
+        "EFIX R   1000\t1100\t102\t  394.2\t  367.7\t    207\n"
+        "EFIX R   1200\t1300\t102\t  394.2\t  367.7\t    207\t  54.00\t  54.80\n"
+        "ESACC R  1100\t1200\t102\t  394.2\t  367.7\t      .\t  100.0\t   1.2\t 210\n"
+    )
+    rec = ascreader.parse(text.encode())
+    assert same(rec.fixations, split_events(text, "EFIX"))
+    assert same(rec.saccades, split_events(text, "ESACC"))
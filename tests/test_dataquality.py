@@ -0,0 +1,46 @@
+"""Tests of the single pass over an .asc file of dataquality.assess"""
+
+import os
+import sys
+import shutil
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+sys.path.insert(0, ROOT)
+
+import dataquality  # noqa: E402
+import trialindex  # noqa: E402
+
+DATA = os.path.join(ROOT, "data", "reading", "dat")
+
+
+@pytest.fixture
+def asc(tmp_path):
+    shutil.copy(os.path.join(DATA, "0007_01_01.asc"), str(tmp_path))
+    return str(tmp_path / "0007_01_01.asc")
+
+
+def test_writes_no_index(asc):
+    dataquality.assess(asc)
+    assert not os.path.exists(trialindex.index_name(asc))
+
+
+def test_trials_match_trialindex(asc):
+    report = dataquality.assess(asc)
+    expected = trialindex.build(asc)
+    assert [t[:7] for t, _ in report.trials] == [t[:7] for t in expected]
+    assert sum(q.samples for _, q in report.trials) > 0
+
+
+def test_trials_across_chunks(asc):
+    """A trial that spans several chunks gets all of its samples"""
+
+    def metrics(report):
+        return [(q.samples, q.missing, q.recorded, q.drift) for _, q in report.trials]
+
+    whole = dataquality.assess(asc)
+    chunked = dataquality.assess(asc, chunk_size=5000)
+    assert metrics(chunked) == metrics(whole)
+    assert chunked.session.samples == whole.session.samples
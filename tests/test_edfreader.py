@@ -0,0 +1,60 @@
+"""Tests of edfreader against the edf2asc output of the example data"""
+
+import os
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+import edfreader  # noqa: E402
+
+DATA = os.path.join(HERE, "..", "data", "reading", "dat")
+
+SESSIONS = ["0001_01_01", "0007_01_01", "0011_01_01"]
+
+
+def asc_msg_lines(fn):
+    """Returns the MSG lines of the .asc file fn without line endings"""
+    with open(fn, encoding="utf8", errors="replace") as f:
+        return [line.rstrip("\r\n") for line in f if line.startswith("MSG")]
+
+
+@pytest.mark.parametrize("session", SESSIONS)
+def test_msg_lines_match_edf2asc(session):
+    edf = os.path.join(DATA, session + ".edf")
+    asc = os.path.join(DATA, session + ".asc")
+    expected = asc_msg_lines(asc)
+    assert expected
+    assert edfreader.msg_lines(edf) == expected
+
+
+@pytest.mark.parametrize("session", SESSIONS)
+def test_read_messages_in_order(session):
+    messages = edfreader.read_messages(os.path.join(DATA, session + ".edf"))
+    times = [t for t, _ in messages]
+    assert times == sorted(times)
+
+
+@pytest.mark.parametrize("session", SESSIONS)
+def test_preamble_matches_edf2asc(session):
+    with open(os.path.join(DATA, session + ".asc"), encoding="utf8") as f:
+        expected = [
+            line.rstrip("\r\n")[3:]
+            for line in f
+            if line.startswith("** ") and not line.startswith("** CONVERTED")
+        ]
+    assert edfreader.read_preamble(os.path.join(DATA, session + ".edf")) == expected
+
+
+def test_not_an_edf_file(tmp_path):
+    fn = tmp_path / "0001_01_01.edf"
+    fn.write_bytes(b"** CONVERTED FROM 0001_01_01.edf\n")
+    with pytest.raises(edfreader.NotAnEdfFile):
+        edfreader.read_messages(str(fn))
+
+
+def test_asc_is_not_an_edf_file():
+    with pytest.raises(edfreader.NotAnEdfFile):
+        edfreader.msg_lines(os.path.join(DATA, "0001_01_01.asc"))
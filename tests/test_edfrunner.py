@@ -0,0 +1,133 @@
+"""Tests of edfrunner.Runner with the stand-in edf2asc of the benchmarks"""
+
+import os
+import sys
+import time
+import shutil
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, os.path.join(HERE, "..", "benchmarks"))
+
+import edfrunner  # noqa: E402
+import synthetic  # noqa: E402
+
+DATA = os.path.join(HERE, "..", "data", "reading", "dat")
+
+
+@pytest.fixture
+def runners():
+    """Makes runners and closes them after the test"""
+    made = []
+
+    def make(tmp_path, latency=0.0, **kwargs):
+        program = synthetic.write_fake_edf2asc(str(tmp_path), latency)
+        runner = edfrunner.Runner(program=program, **kwargs)
+        made.append(runner)
+        return runner
+
+    yield make
+    for runner in made:
+        runner.close()
+
+
+def copy_edf(tmp_path, name="0011_01_01"):
+    """Copies an example edf file to tmp_path and returns its name"""
+    fn = str(tmp_path / (name + ".edf"))
+    shutil.copy(os.path.join(DATA, name + ".edf"), fn)
+    return fn
+
+
+def test_convert(tmp_path, runners):
+    runner = runners(tmp_path)
+    edf = copy_edf(tmp_path)
+    asc = str(tmp_path / "out.asc")
+    result = runner.convert(edf, asc)
+    assert result.ok
+    assert result.returncode == 0
+    assert "Converted successfully" in result.stdout
+    with open(asc) as f:
+        assert any(line.startswith("MSG") for line in f)
+
+
+def test_nonzero_exit_is_an_error(tmp_path, runners):
+    runner = runners(tmp_path)
+    edf = str(tmp_path / "0001_01_01.edf")
+    with open(edf, "w") as f:
+        f.write("not an edf file\n")
+    result = runner.convert(edf, str(tmp_path / "out.asc"))
+    assert not result.ok
+    assert result.returncode == 1
+    assert not result.timed_out
+    assert "exit status 1" in result.error()
+    assert "doesn't look like an edf file" in result.error()
+
+
+def test_hanging_converter_is_killed(tmp_path, runners):
+    runner = runners(tmp_path, latency=60, timeout=0.5)
+    result = runner.convert(copy_edf(tmp_path), str(tmp_path / "out.asc"))
+    assert result.timed_out
+    assert not result.ok
+    assert result.returncode is None
+    assert result.elapsed < 10
+    assert "timed out" in result.error()
+
+
+def test_missing_program(tmp_path):
+    runner = edfrunner.Runner(program=str(tmp_path / "edf2asc"))
+    try:
+        with pytest.raises(FileNotFoundError):
+            runner.convert(copy_edf(tmp_path), str(tmp_path / "out.asc"))
+    finally:
+        runner.close()
+
+
+def test_follow_stops_early(tmp_path, runners):
+    # A long session, so edf2asc is still writing when follow is satisfied
+    edf, asc = synthetic.write_session(str(tmp_path), "0001_01_01", 200, 5000)
+    runner = runners(tmp_path)
+    lines = []
+
+    def follow(line):
+        lines.append(line)
+        return line.startswith("MSG")
+
+    out = str(tmp_path / "out.asc")
+    result = runner.convert(edf, out, follow=follow)
+    assert result.stopped
+    assert result.ok
+    assert result.returncode is None
+    # follow isn't called after it returned True
+    assert lines[-1].startswith("MSG")
+    assert not any(line.startswith("MSG") for line in lines[:-1])
+    assert os.path.getsize(out) < os.path.getsize(asc)
+
+
+def test_follow_sees_all_lines(tmp_path, runners):
+    runner = runners(tmp_path)
+    lines = []
+    out = str(tmp_path / "out.asc")
+    result = runner.convert(
+        copy_edf(tmp_path), out, follow=lambda line: lines.append(line) and False
+    )
+    assert result.ok
+    assert not result.stopped
+    with open(out) as f:
+        assert lines == f.readlines()
+
+
+@pytest.mark.parametrize("concurrency", [1, 2])
+def test_concurrency_limit(tmp_path, runners, concurrency):
+    latency = 0.5
+    runner = runners(tmp_path, latency=latency, concurrency=concurrency)
+    edf = copy_edf(tmp_path)
+    pairs = [(edf, str(tmp_path / "out{}.asc".format(i))) for i in range(4)]
+    start = time.monotonic()
+    results = runner.convert_all(pairs)
+    elapsed = time.monotonic() - start
+    assert all(result.ok for result in results)
+    assert [result.asc for result in results] == [asc for _, asc in pairs]
+    # At most concurrency conversions overlap, so they take as many rounds
+    assert elapsed >= latency * len(pairs) / concurrency
@@ -0,0 +1,41 @@
+"""Tests of the fixations of eventdetect against the EFIX events of the
+tracker in the example recordings.
+"""
+
+import os
+import sys
+import glob
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+sys.path.insert(0, ROOT)
+
+import ascreader  # noqa: E402
+import eventdetect  # noqa: E402
+
+DATA = os.path.join(ROOT, "data", "reading", "dat")
+
+THRESHOLDS = {
+    "ivt": eventdetect.VELOCITY_THRESHOLD,
+    "idt": eventdetect.DISPERSION_THRESHOLD,
+}
+# At the time of writing I-VT matched 94-98% of the EFIX events and I-DT
+# all of them, for both about 95% of the samples agreed.
+MIN_MATCHED = 0.9
+MIN_AGREEMENT = 0.9
+
+
+@pytest.mark.parametrize("algorithm", sorted(THRESHOLDS))
+@pytest.mark.parametrize("fn", sorted(glob.glob(os.path.join(DATA, "*.asc"))))
+def test_fixations_match_efix(fn, algorithm):
+    rec = ascreader.read_asc(fn)
+    ppd = eventdetect.estimate_ppd(rec.saccades)
+    events = eventdetect.ALGORITHMS[algorithm](
+        rec.samples, THRESHOLDS[algorithm], eventdetect.MIN_DURATION, ppd
+    )
+    result = eventdetect.compare(rec.samples["time"], events.fixations, rec.fixations)
+    assert result["reference"] > 0
+    assert result["matched"] >= MIN_MATCHED
+    assert result["agreement"] >= MIN_AGREEMENT
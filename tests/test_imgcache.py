@@ -0,0 +1,90 @@
+"""Tests of the cache of the images that mkobtzep converts"""
+
+import os
+import sys
+import time
+import subprocess
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import imgcache  # noqa: E402
+import synthetic  # noqa: E402
+
+pytest.importorskip("PIL")
+
+DAY = 24 * 3600
+
+
+@pytest.fixture
+def expdir(tmp_path):
+    """An experiment with two stimuli"""
+    return synthetic.write_experiment(str(tmp_path), "exp", 120, 2)
+
+
+def mkobtzep(cwd, *args):
+    """Runs mkobtzep for list 1 of exp in cwd and returns its output"""
+    proc = subprocess.run(
+        [sys.executable, os.path.join(ROOT, "mkobtzep.py")] + list(args) + ["exp", "1"],
+        cwd=str(cwd),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return proc.stdout
+
+
+def cached_images(expdir):
+    return sorted(os.listdir(os.path.join(expdir, "img", imgcache.CACHE_DIR)))
+
+
+def test_existing_bmps_are_adopted(expdir):
+    cwd = os.path.dirname(expdir)
+    mkobtzep(cwd, "--no-cache")
+    out = mkobtzep(cwd)
+    assert "Converting" not in out
+    assert "2 misses (2 adopted)" in out
+    assert len(cached_images(expdir)) == 2
+
+
+def test_older_bmp_is_converted_again(expdir):
+    cwd = os.path.dirname(expdir)
+    mkobtzep(cwd, "--no-cache")
+    bmp = os.path.join(expdir, "img", "CNDB001.bmp")
+    os.utime(bmp, (time.time() - DAY, time.time() - DAY))
+    out = mkobtzep(cwd)
+    assert 'Converting "exp/img/CNDB001.png"' in out
+    assert "1 adopted" in out
+
+
+def test_editing_an_output_leaves_the_cache_intact(expdir):
+    cwd = os.path.dirname(expdir)
+    mkobtzep(cwd)
+    bmp = os.path.join(expdir, "img", "CNDB001.bmp")
+    with open(bmp, "rb") as f:
+        original = f.read()
+    with open(bmp, "r+b") as f:
+        f.write(b"edited")
+    out = mkobtzep(cwd)
+    assert 'Using the cached conversion of "exp/img/CNDB001.png"' in out
+    with open(bmp, "rb") as f:
+        assert f.read() == original
+
+
+def test_prune_removes_unused_images(expdir):
+    cwd = os.path.dirname(expdir)
+    mkobtzep(cwd)
+    cachedir = os.path.join(expdir, "img", imgcache.CACHE_DIR)
+    stale = os.path.join(cachedir, "stale.bmp")
+    with open(stale, "wb") as f:
+        f.write(b"BM")
+    for name in os.listdir(cachedir):
+        os.utime(os.path.join(cachedir, name), (time.time() - 10 * DAY,) * 2)
+    out = mkobtzep(cwd, "--prune-cache", "5")
+    assert "pruned 1 images" in out
+    assert not os.path.exists(stale)
+    assert len(cached_images(expdir)) == 2
@@ -0,0 +1,68 @@
+"""Tests of the up to date checks of manifest"""
+
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+import manifest  # noqa: E402
+
+
+def make(tmp_path, name, text):
+    """Writes text to the file name in tmp_path and returns its path"""
+    fn = tmp_path / name
+    fn.write_text(text)
+    return str(fn)
+
+
+def test_missing_output_is_stale(tmp_path):
+    builds = manifest.Manifest(str(tmp_path / manifest.MANIFEST_NAME))
+    inputfn = make(tmp_path, "0001_01_01.edf", "input")
+    assert not builds.is_current(str(tmp_path / "reading_1_001.asc"), inputfn)
+
+
+def test_recorded_output_is_current(tmp_path):
+    fn = str(tmp_path / manifest.MANIFEST_NAME)
+    inputfn = make(tmp_path, "0001_01_01.edf", "input")
+    output = make(tmp_path, "reading_1_001.asc", "output")
+    builds = manifest.Manifest(fn, "1.0")
+    builds.record(output, inputfn)
+    builds.save()
+    assert manifest.Manifest(fn, "1.0").is_current(output, inputfn)
+    assert not manifest.Manifest(fn, "2.0").is_current(output, inputfn)
+
+
+def test_unrecorded_output_is_stale(tmp_path):
+    # E.g. a partial output, or one of an edf file that was exported again,
+    # written before there was a manifest.
+    fn = str(tmp_path / manifest.MANIFEST_NAME)
+    inputfn = make(tmp_path, "0001_01_01.edf", "exported again")
+    output = make(tmp_path, "reading_1_001.asc", "partial")
+    builds = manifest.Manifest(fn)
+    assert not builds.is_current(output, inputfn)
+    builds.save()
+    assert not manifest.Manifest(fn).is_current(output, inputfn)
+
+
+def test_unrecorded_output_is_adopted_on_request(tmp_path):
+    fn = str(tmp_path / manifest.MANIFEST_NAME)
+    inputfn = make(tmp_path, "0001_01_01.edf", "input")
+    output = make(tmp_path, "reading_1_001.asc", "output")
+    builds = manifest.Manifest(fn, adopt=True)
+    assert builds.is_current(output, inputfn)
+    builds.save()
+    assert manifest.Manifest(fn).is_current(output, inputfn)
+
+
+def test_changed_input_or_output_is_stale(tmp_path):
+    fn = str(tmp_path / manifest.MANIFEST_NAME)
+    inputfn = make(tmp_path, "0001_01_01.edf", "input")
+    output = make(tmp_path, "reading_1_001.asc", "output")
+    builds = manifest.Manifest(fn)
+    builds.record(output, inputfn)
+    make(tmp_path, "0001_01_01.edf", "other input")
+    assert not builds.is_current(output, inputfn)
+    builds.record(output, inputfn)
+    make(tmp_path, "reading_1_001.asc", "edited")
+    assert not builds.is_current(output, inputfn)
@@ -0,0 +1,92 @@
+"""Tests of mkasczep, mostly of the coordination of its worker threads"""
+
+import os
+import sys
+import threading
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+sys.path.insert(0, ROOT)
+
+import ascfile  # noqa: E402
+import mkasczep  # noqa: E402
+
+
+def test_output_claims_follow_input_order():
+    claims = mkasczep.OutputClaims(3)
+    results = {}
+
+    def claim(index):
+        results[index] = claims.claim(index, "reading_1_001.asc")
+
+    # The later input asks first, but the first input gets the output
+    later = threading.Thread(target=claim, args=(2,))
+    later.start()
+    claims.release(1)
+    claim(0)
+    later.join()
+    assert results == {0: True, 2: False}
+
+
+def test_output_locks_wait_for_the_holder():
+    locks = mkasczep.OutputLocks()
+    assert locks.claim(0, "reading_1_001.asc")
+    # An other output is free
+    assert locks.claim(1, "reading_1_002.asc")
+    locks.release(1)
+
+    claimed = threading.Event()
+
+    def claim():
+        locks.claim(1, "reading_1_001.asc")
+        claimed.set()
+
+    waiter = threading.Thread(target=claim)
+    waiter.start()
+    assert not claimed.wait(0.2)
+    locks.release(0)
+    assert claimed.wait(5)
+    waiter.join()
+    locks.release(1)
+    # Releasing a worker without output is harmless
+    locks.release(1)
+
+
+def test_temp_names_differ_per_thread():
+    names = []
+    # Both threads live at once, so their identities differ
+    barrier = threading.Barrier(2)
+
+    def name():
+        names.append(ascfile.temp_name("reading_1_001.asc.gz"))
+        barrier.wait()
+
+    threads = [threading.Thread(target=name) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(names)) == 2
+    assert all(n.endswith(".tmp.asc.gz") for n in names)
+
+
+def test_help_skips_the_heavy_imports():
+    """--help shouldn't load asyncio, sqlite3 or the modules that need them"""
+    code = (
+        "import atexit, runpy, sys\n"
+        "heavy = {'asyncio', 'sqlite3', 'edfrunner', 'infocache', 'manifest'}\n"
+        "atexit.register(lambda: print(sorted(heavy & set(sys.modules))))\n"
+        "sys.argv = ['mkasczep.py', '--help']\n"
+        "runpy.run_path('mkasczep.py', run_name='__main__')\n"
+    )
+    proc = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True
+    )
+    assert proc.stdout.splitlines()[-1] == "[]"
+
+
+def test_timeout_mirrors_edfrunner():
+    import edfrunner
+
+    assert mkasczep.TIMEOUT == edfrunner.TIMEOUT
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+"""trialindex finds the trials in Eyelink .asc files
+
+Zep marks the trials in the recording with messages such as:
+
+    MSG	953684 trialbeg 001 2 001 CNDA
+    MSG	953685 plafile CNDA001.bmp
+    ...
+    MSG	960042 trialend 001 2 001 CNDA
+
+The index records for every trial the byte offsets of its first and last
+line, so a reader can seek straight to a trial instead of scanning the
+whole file, and the time range, condition and plafile of the trial.
+The index of "name.asc" is saved in "name.asc.trials.json" and rebuilt
+when the .asc file changes.
+"""
+
+import os
+import os.path
+import re
+import json
+import collections
+
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import ascfile
+
+_PROGRAM_NAME = "trialindex"
+_DESCRIPTION = """trialindex lists the trials in Eyelink .asc files."""
+
+INDEX_SUFFIX = ".trials.json"
+_FORMAT_VERSION = 1
+
+# The number of bytes that is scanned at once
+CHUNK_SIZE = 1 << 22
+
+RE_TRIAL_MSG = re.compile(
+    rb"^MSG\s+(\S+)\s+(trialbeg|trialend|plafile)\b[ \t]*([^\r\n]*)\r?\n?", re.M
+)
+
+
+class Trial(NamedTuple):
+    """A trial as marked by the trialbeg and trialend messages
+
+    begin_offset and end_offset are None when the trial is found via the
+    messages of an .edf file.
+    """
+
+    item: str
+    trial: int
+    code: str
+    condition: str
+    plafile: str
+    begin_time: float
+    end_time: float
+    begin_offset: Optional[int]
+    end_offset: Optional[int]
+
+
+def _parse_trialbeg(text: str) -> Tuple[str, int, str, str]:
+    """Returns item, trial, code and condition of the text of a trialbeg"""
+    fields = text.split()
+    fields += [""] * (4 - len(fields))
+    try:
+        trial = int(fields[1])
+    except ValueError:
+        trial = 0
+    return fields[0], trial, fields[2], fields[3]
+
+
+class Builder:
+    """Collects the trials from the trial messages, which may be added bit
+    by bit, e.g. chunk by chunk with add_messages().
+    """
+
+    def __init__(self):
+        self.trials: List[Trial] = []
+        self.current: Optional[Dict] = None
+
+    def message(self, time: float, kind: str, text: str, begin=None, end=None):
+        """Processes one trial message, begin and end are the offsets of
+        the line of the message.
+        """
+        if kind == "trialbeg":
+            self.close(time, begin)
+            item, trial, code, condition = _parse_trialbeg(text)
+            self.current = {
+                "item": item,
+                "trial": trial,
+                "code": code,
+                "condition": condition,
+                "plafile": "",
+                "begin_time": time,
+                "begin_offset": begin,
+            }
+        elif self.current is None:
+            return
+        elif kind == "plafile":
+            self.current["plafile"] = text.strip()
+        elif kind == "trialend":
+            self.close(time, end)
+
+    def add_messages(self, messages: Iterable[Tuple[float, str]]):
+        """Processes the trial messages among (time, text) messages"""
+        for time, text in messages:
+            kind, _, rest = text.partition(" ")
+            if kind in ("trialbeg", "trialend", "plafile"):
+                self.message(float(time), kind, rest)
+
+    def open_trial(self) -> Optional[Trial]:
+        """Returns the trial that has begun but not ended yet, if any, its
+        end_time is NaN.
+        """
+        if self.current is None:
+            return None
+        return Trial(end_time=float("nan"), end_offset=None, **self.current)
+
+    def close(self, time: float, offset: Optional[int]):
+        """Finishes the current trial, if any, at time and offset"""
+        if self.current is not None:
+            self.trials.append(Trial(end_time=time, end_offset=offset, **self.current))
+            self.current = None
+
+
+def build(fn: str, chunk_size: int = CHUNK_SIZE) -> List[Trial]:
+    """Scans the .asc file fn and returns its trials in file order"""
+    builder = Builder()
+    base = 0
+    remainder = b""
+    with ascfile.open_asc(fn) as f:
+        while True:
+            block = f.read(chunk_size)
+            data = remainder + block
+            cut = len(data) if not block else data.rfind(b"\n") + 1
+            for mobj in RE_TRIAL_MSG.finditer(data, 0, cut):
+                builder.message(
+                    float(mobj.group(1)),
+                    mobj.group(2).decode(),
+                    mobj.group(3).decode("utf8", "replace"),
+                    base + mobj.start(),
+                    base + mobj.end(),
+                )
+            base += cut
+            remainder = data[cut:]
+            if not block:
+                break
+    # A trial without trialend runs up to the end of the file.
+    builder.close(float("nan"), base)
+    return builder.trials
+
+
+def from_messages(messages: Iterable[Tuple[float, str]]) -> List[Trial]:
+    """Returns the trials found in (time, text) messages, such as those
+    obtained by edfreader.read_messages(). The trials have no offsets.
+    """
+    builder = Builder()
+    builder.add_messages(messages)
+    builder.close(float("nan"), None)
+    return builder.trials
+
+
+def index_name(fn: str) -> str:
+    """Returns the name of the saved index of fn"""
+    return fn + INDEX_SUFFIX
+
+
+def _source(fn: str) -> Dict:
+    """Returns the properties of fn that determine whether an index is
+    up to date.
+    """
+    stat = os.stat(fn)
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+def load(fn: str, save: bool = True) -> List[Trial]:
+    """Returns the trials of the .asc file fn from its saved index, the
+    index is (re)built when it is missing or out of date.
+
+    @save whether a (re)built index is saved next to fn
+    """
+    try:
+        with open(index_name(fn)) as f:
+            saved = json.load(f)
+        if saved["format"] == _FORMAT_VERSION and saved["source"] == _source(fn):
+            return [Trial(**trial) for trial in saved["trials"]]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    source = _source(fn)
+    trials = build(fn)
+    if save:
+        tempname = "{}.{}.tmp".format(index_name(fn), os.getpid())
+        try:
+            with open(tempname, "w") as f:
+                json.dump(
+                    {
+                        "format": _FORMAT_VERSION,
+                        "source": source,
+                        "trials": [t._asdict() for t in trials],
+                    },
+                    f,
+                    indent=1,
+                )
+            os.replace(tempname, index_name(fn))
+        except OSError:
+            # The index is only an optimization
+            pass
+    return trials
+
+
+def read_trial(fn: str, trial: Trial) -> bytes:
+    """Returns the lines of fn from the trialbeg up to and including the
+    trialend of trial.
+    """
+    with ascfile.open_asc(fn) as f:
+        f.seek(trial.begin_offset)
+        return f.read(trial.end_offset - trial.begin_offset)
+
+
+def trials_of(fn: str, save: bool = True) -> List[Trial]:
+    """Returns the trials of an .asc or .edf file, see load() for save"""
+    if fn.endswith(".edf"):
+        import edfreader
+
+        return from_messages(edfreader.read_messages(fn))
+    return load(fn, save)
+
+
+def conditions(trials: Iterable[Trial]) -> Dict[str, int]:
+    """Returns the number of trials per condition in order of appearance"""
+    return dict(collections.Counter(t.condition for t in trials))
+
+
+def summary(trials: List[Trial]) -> str:
+    """Returns a summary of trials compatible with the output of edfinfo"""
+    conds = ", ".join(
+        "{} ({})".format(cond, count) for cond, count in conditions(trials).items()
+    )
+    return "  trials:\t\t{}".format(len(trials)) + os.linesep + (
+        "  conditions:\t\t{}".format(conds)
+    )
+
+
+if __name__ == "__main__":
+    import sys
+    import argparse as ap
+
+    parser = ap.ArgumentParser(_PROGRAM_NAME, description=_DESCRIPTION)
+    parser.add_argument("input_files", nargs="+", help="The input .asc file's")
+    args = parser.parse_args()
+
+    for fn in args.input_files:
+        if not os.path.exists(fn):
+            print('Skipping "{}" (it doesn\'t exist).'.format(fn), file=sys.stderr)
+            continue
+        try:
+            trials = trials_of(fn)
+        except ascfile.READ_ERRORS as error:
+            print('Skipping "{}" ({}).'.format(fn, error), file=sys.stderr)
+            continue
+        print("{}:".format(fn))
+        for t in trials:
+            print(
+                "  {:>4} {:>4} {:<6} {:<16} {:>10.0f} {:>10.0f}".format(
+                    t.trial,
+                    t.item,
+                    t.condition,
+                    t.plafile,
+                    t.begin_time,
+                    t.end_time,
+                )
+            )
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+
+"""trialsplit cuts Eyelink .asc files into a chunk per trial, so that the
+trials of one session can be analyzed in parallel.
+
+A trial consists of the lines from its trialbeg up to and including its
+trialend message, as found by trialindex. A TrialChunk holds these lines
+together with what's needed to interpret them on their own:
+
+    trial       the trialindex.Trial, i.e. its condition, plafile etc.
+    info        the edfinfo.EyeFileInfo of the session
+    context     the last SAMPLES line and GAZE_COORDS and RECCFG messages
+                before the trial, which determine the columns of the
+                samples, the screen size and the sample rate
+    prologue    the preamble and the messages before the first trial, with
+                which a chunk is a complete .asc file
+
+iter_split() reads a session once from front to back and yields its chunks
+in memory, write() saves them as .asc files of their own. map_trials()
+runs a function on the chunks of any number of sessions on a pool of
+worker processes and returns the results per session in trial order, so a
+long session with many blocks keeps all cores busy rather than one.
+"""
+
+import os
+import os.path
+import re
+import csv
+import functools
+import collections
+
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import ascfile
+import ascreader
+import edfinfo
+import eventdetect
+import infocache
+import trialindex
+
+_PROGRAM_NAME = "trialsplit"
+_DESCRIPTION = """trialsplit writes every trial of Eyelink .asc files to an
+.asc file of its own, or detects the fixations and saccades of the trials
+on all cores."""
+
+# The number of bytes outside the trials that is scanned at once
+CHUNK_SIZE = 1 << 22
+
+# The name of the file of a chunk: the session and the number of the chunk
+CHUNK_FMT = "{}_trial{:03}.asc"
+
+# The lines that determine how the lines after them are read, the last one
+# of every kind before a trial is kept.
+RE_CONTEXT = re.compile(
+    rb"^(SAMPLES|MSG\s+\S+\s+(GAZE_COORDS|RECCFG))\b[^\r\n]*\r?\n", re.M
+)
+RE_PROLOGUE = re.compile(rb"^(\*\*|MSG\b)[^\r\n]*\r?\n", re.M)
+
+# The number of chunks per worker that is submitted ahead of the results
+_AHEAD = 4
+
+
+class TrialChunk(NamedTuple):
+    """The lines of one trial of a session and their context
+
+    index is the position of the trial in the session, starting at 0.
+    """
+
+    fn: str
+    index: int
+    trial: trialindex.Trial
+    info: edfinfo.EyeFileInfo
+    context: bytes
+    prologue: bytes
+    data: bytes
+
+    @property
+    def plafile(self) -> str:
+        """The stimulus image of the trial"""
+        return self.trial.plafile
+
+    @property
+    def condition(self) -> str:
+        """The condition of the trial"""
+        return self.trial.condition
+
+    def lines(self) -> bytes:
+        """Returns the context followed by the lines of the trial"""
+        return self.context + self.data
+
+    def recording(self, eye: Optional[str] = None) -> ascreader.Recording:
+        """Returns the samples and events of the trial, see ascreader"""
+        return ascreader.parse(self.lines(), eye)
+
+    def asc(self) -> bytes:
+        """Returns the chunk as the contents of an .asc file"""
+        return self.prologue + self.context + self.data
+
+
+def _update_context(context: Dict[bytes, bytes], data: bytes):
+    """Stores the context lines of data in context by their kind"""
+    for mobj in RE_CONTEXT.finditer(data):
+        context[mobj.group(2) or mobj.group(1)] = mobj.group(0)
+
+
+def _skip(f, size: int, context: Dict[bytes, bytes], prologue=None):
+    """Reads the next size bytes of f, which lie outside the trials, in
+    pieces of at most CHUNK_SIZE and keeps their context lines.
+
+    @prologue a list to which the prologue lines are appended
+    """
+    remainder = b""
+    while size > 0:
+        block = f.read(min(size, CHUNK_SIZE))
+        if not block:
+            break
+        size -= len(block)
+        data = remainder + block
+        cut = len(data) if size <= 0 else data.rfind(b"\n") + 1
+        _update_context(context, data[:cut])
+        if prologue is not None:
+            prologue.extend(m.group(0) for m in RE_PROLOGUE.finditer(data, 0, cut))
+        remainder = data[cut:]
+
+
+def iter_split(fn: str, use_cache: bool = True) -> Iterator[TrialChunk]:
+    """Yields the TrialChunk's of the .asc file fn in trial order
+
+    @use_cache whether the info of fn is looked up in the infocache
+    """
+    trials = trialindex.load(fn)
+    if not trials:
+        return
+    info = infocache.parse_file(fn, deep=False, use_cache=use_cache)
+    context: Dict[bytes, bytes] = {}
+    prologue: List[bytes] = []
+    pos = 0
+    with ascfile.open_asc(fn) as f:
+        for index, trial in enumerate(trials):
+            _skip(f, trial.begin_offset - pos, context, prologue if not index else None)
+            data = f.read(trial.end_offset - trial.begin_offset)
+            pos = trial.end_offset
+            yield TrialChunk(
+                fn,
+                index,
+                trial,
+                info,
+                b"".join(context.values()),
+                b"".join(prologue),
+                data,
+            )
+            # A recording may start within one trial and continue in the next
+            _update_context(context, data)
+
+
+def chunk_name(chunk: TrialChunk, dirname: Optional[str] = None) -> str:
+    """Returns the name of the .asc file of chunk, in dirname or else next
+    to its session.
+    """
+    base = os.path.basename(ascfile.plain_name(chunk.fn))[: -len(ascfile.ASC)]
+    if dirname is None:
+        dirname = os.path.dirname(chunk.fn)
+    return os.path.join(dirname, CHUNK_FMT.format(base, chunk.index + 1))
+
+
+def write(chunks: Iterable[TrialChunk], dirname: Optional[str] = None) -> List[str]:
+    """Writes every chunk to an .asc file of its own, see chunk_name(), and
+    returns the names of the files.
+    """
+    names = []
+    for chunk in chunks:
+        name = chunk_name(chunk, dirname)
+        tempname = "{}.{}.tmp".format(name, os.getpid())
+        with open(tempname, "wb") as f:
+            f.write(chunk.asc())
+        os.replace(tempname, name)
+        names.append(name)
+    return names
+
+
+def _drain(pending: collections.deque, results: list, limit: int):
+    """Collects the results of pending, in order, until at most limit are
+    left and yields (fn, results) at the end of every session, the results
+    of a session that ended with False are dropped.
+    """
+    while len(pending) > limit:
+        fn, future = pending.popleft()
+        if future is None:
+            yield fn, results[:]
+            results.clear()
+        elif future is False:
+            results.clear()
+        else:
+            results.append(future.result())
+
+
+def map_trials(
+    func: Callable[[TrialChunk], object],
+    fns: Iterable[str],
+    jobs: Optional[int] = None,
+    use_cache: bool = True,
+    on_error: Optional[Callable[[str, Exception], None]] = None,
+) -> Iterator[Tuple[str, list]]:
+    """Runs func on every TrialChunk of the .asc files fns on a pool of
+    worker processes and yields (fn, results) per file, with the results
+    in trial order.
+
+    @func a picklable callable, e.g. a module level function or a
+          functools.partial of one.
+    @jobs the number of worker processes, by default one per core.
+    @on_error when given, a file that can't be read (see
+              ascfile.READ_ERRORS) is passed to on_error together with the
+              error and skipped, otherwise the error is raised.
+
+    The sessions are split while the workers compute, only a few chunks
+    per worker are held in memory at once. An exception raised by func is
+    raised here.
+    """
+    import concurrent.futures as cf
+
+    jobs = jobs or os.cpu_count() or 1
+    executor = cf.ProcessPoolExecutor(max_workers=jobs)
+    # (fn, future) per chunk and (fn, None) at the end of every session, or
+    # (fn, False) at the end of a session that couldn't be read
+    pending: collections.deque = collections.deque()
+    results: list = []
+    try:
+        for fn in fns:
+            try:
+                for chunk in iter_split(fn, use_cache):
+                    pending.append((fn, executor.submit(func, chunk)))
+                    yield from _drain(pending, results, _AHEAD * jobs)
+            except ascfile.READ_ERRORS as error:
+                if on_error is None:
+                    raise
+                on_error(fn, error)
+                pending.append((fn, False))
+                continue
+            pending.append((fn, None))
+        yield from _drain(pending, results, 0)
+    finally:
+        # The chunks that haven't been started aren't needed anymore.
+        for _, future in pending:
+            if future:
+                future.cancel()
+        executor.shutdown()
+
+
+EVENT_FIELDS = [
+    "file",
+    "trial",
+    "item",
+    "condition",
+    "plafile",
+    "samples",
+    "fixations",
+    "saccades",
+    "efix",
+    "matched",
+    "agreement",
+]
+
+
+def detect_events(
+    chunk: TrialChunk, algorithm: str = "ivt", ppd: Optional[float] = None
+) -> Dict:
+    """Detects the fixations and saccades of one trial and compares them
+    with the EFIX events, see eventdetect.
+
+    @ppd pixels per degree, by default estimated from the ESACC events of
+         the trial.
+    @return a dict with the EVENT_FIELDS of the trial
+    """
+    rec = chunk.recording()
+    ppd = ppd or eventdetect.estimate_ppd(rec.saccades)
+    events = eventdetect.ALGORITHMS[algorithm](rec.samples, ppd=ppd)
+    result = eventdetect.compare(rec.samples["time"], events.fixations, rec.fixations)
+    return {
+        "file": os.path.basename(chunk.fn),
+        "trial": chunk.trial.trial,
+        "item": chunk.trial.item,
+        "condition": chunk.condition,
+        "plafile": chunk.plafile,
+        "samples": len(rec.samples),
+        "fixations": result["detected"],
+        "saccades": len(events.saccades),
+        "efix": result["reference"],
+        "matched": "{:.3f}".format(result["matched"]),
+        "agreement": "{:.3f}".format(result["agreement"]),
+    }
+
+
+if __name__ == "__main__":
+    import sys
+    import argparse as ap
+
+    parser = ap.ArgumentParser(_PROGRAM_NAME, description=_DESCRIPTION)
+    parser.add_argument(
+        "input_files", nargs="+", help="The input .asc, .asc.gz or .asc.zst file's"
+    )
+    parser.add_argument(
+        "-d",
+        "--dir",
+        help="The directory for the .asc files of the trials, by default "
+        "they are written next to their session.",
+    )
+    parser.add_argument(
+        "-e",
+        "--events",
+        choices=sorted(eventdetect.ALGORITHMS),
+        help="Instead of writing the trials, detect the fixations and "
+        "saccades per trial with this algorithm and write them as csv to "
+        "standard output.",
+    )
+    parser.add_argument(
+        "--ppd",
+        type=float,
+        help="Pixels per degree for --events, by default estimated from the "
+        "ESACC events of every trial.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="The number of trials processed in parallel with --events "
+        "(default the number of cores).",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Don't use or update the cache of the info of the files.",
+    )
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be 1 or greater")
+    if args.dir and not os.path.isdir(args.dir):
+        parser.error('"{}" is not a directory'.format(args.dir))
+
+    files = []
+    for fn in args.input_files:
+        if not (ascfile.is_asc(fn) and os.path.exists(fn)):
+            print('Skipping "{}" (not an asc file).'.format(fn), file=sys.stderr)
+            continue
+        files.append(fn)
+
+    def skip(fn, error):
+        """Reports that fn can't be read"""
+        print('Skipping "{}" ({}).'.format(fn, error), file=sys.stderr)
+
+    if args.events:
+        writer = csv.DictWriter(sys.stdout, EVENT_FIELDS, lineterminator="\n")
+        writer.writeheader()
+        detect = functools.partial(detect_events, algorithm=args.events, ppd=args.ppd)
+        for fn, rows in map_trials(detect, files, args.jobs, not args.no_cache, skip):
+            writer.writerows(rows)
+    else:
+        for fn in files:
+            try:
+                names = write(iter_split(fn, not args.no_cache), args.dir)
+            except ascfile.READ_ERRORS as error:
+                skip(fn, error)
+                continue
+            print('writing {} trials of "{}".'.format(len(names), fn))